@@ -0,0 +1,142 @@
+# Сквозной бенчмарк handle_message на заглушках Ollama, Yandex и Telegram
+import argparse # Параметры запуска
+import asyncio # Асинхронная обработка запросов
+import logging # Приглушение логов бота во время замера
+import os # Переменные окружения и пути
+import random # Генерация текстов новостей
+import sys # Путь к модулям бота
+import time # Измерение времени
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from stubs import StubOllama, StubYandex, StubThread, FakeBot, FakeUpdate, FakeContext # noqa: E402
+
+WORDS = (
+    'землетрясение магнитуда Крым водопад Учан-Су сейсмологи глубина эпицентр министерство заявил '
+    'правительство решение бюджет рублей миллиардов регион область город жители пострадавшие спасатели '
+    'агентство сообщило источник пресс-служба губернатор совещание проект строительство дорога мост'
+).split()
+
+def make_news(rng, index):
+    """Уникальный текст новости длиной 400-1500 символов"""
+    words = [rng.choice(WORDS) for _ in range(rng.randint(60, 200))]
+    return f"Новость {index}. " + ' '.join(words)
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+async def monitor_loop_lag(lags, interval=0.01):
+    """Задержка цикла событий: насколько позже запланированного просыпается таймер"""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - started - interval)
+
+async def run_level(bot_module, users, messages_per_user, telegram_latency, rng, counter):
+    """Каждый из users пользователей последовательно отправляет messages_per_user сообщений"""
+    bot = FakeBot(latency=telegram_latency)
+    context = FakeContext(bot)
+    latencies, lags = [], []
+
+    async def user_session(user_id):
+        for _ in range(messages_per_user):
+            counter[0] += 1
+            update = FakeUpdate(bot, user_id, make_news(rng, counter[0]))
+            started = time.perf_counter()
+            await bot_module.handle_message(update, context)
+            latencies.append(time.perf_counter() - started)
+
+    lag_task = asyncio.create_task(monitor_loop_lag(lags))
+    started = time.perf_counter()
+    await asyncio.gather(*(user_session(1_000_000 + counter[0] + i) for i in range(users)))
+    elapsed = time.perf_counter() - started
+    lag_task.cancel()
+
+    total = users * messages_per_user
+    return {
+        'users': users,
+        'messages': total,
+        'elapsed': elapsed,
+        'per_minute': total / elapsed * 60,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'lag_p99': percentile(lags, 99),
+        'lag_max': max(lags, default=0.0),
+        'edits': bot.edits
+    }
+
+async def run_benchmark(args, ollama_stub, yandex_stub):
+    import factcheckbot_yac as bot_module # Импорт после настройки окружения и конфигурации
+    logging.getLogger().setLevel(logging.ERROR)
+    logging.getLogger('httpx').setLevel(logging.ERROR)
+
+    bot_module.yandex_client.url = yandex_stub.url + '/search/xml'
+    bot_module.flood_control.limit = 10 ** 9 # Ограничение на пользователя не должно влиять на замер
+    await bot_module.warm_up_models() # Как при запуске бота: до прогрева сообщения не анализируются
+    rng = random.Random(args.seed)
+    counter = [0]
+    results = []
+    for users in args.users:
+        ollama_requests, yandex_requests = ollama_stub.requests, yandex_stub.requests
+        prompt_tokens = ollama_stub.prompt_eval_tokens
+        result = await run_level(bot_module, users, args.messages_per_user, args.telegram_latency, rng, counter)
+        result['llm_calls'] = (ollama_stub.requests - ollama_requests) / result['messages']
+        result['search_calls'] = (yandex_stub.requests - yandex_requests) / result['messages']
+        result['prompt_tokens'] = (ollama_stub.prompt_eval_tokens - prompt_tokens) / result['messages']
+        results.append(result)
+        print(
+            f"{result['users']:>5} {result['messages']:>6} {result['per_minute']:>10.1f} "
+            f"{result['p50']:>7.2f} {result['p95']:>7.2f} {result['p99']:>7.2f} "
+            f"{result['lag_p99'] * 1000:>9.1f} {result['lag_max'] * 1000:>9.1f} "
+            f"{result['llm_calls']:>5.1f} {result['search_calls']:>6.1f} {result['prompt_tokens']:>8.0f}",
+            flush=True
+        )
+    await bot_module.yandex_client.close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк конвейера анализа")
+    parser.add_argument('--users', type=int, nargs='+', default=[1, 10, 100], help="Уровни одновременных пользователей")
+    parser.add_argument('--messages-per-user', type=int, default=2)
+    parser.add_argument('--llm-latency', type=float, default=0.2, help="Задержка одного вызова заглушки Ollama, с")
+    parser.add_argument('--ollama-slots', type=int, default=4, help="Параллельные слоты заглушки Ollama")
+    parser.add_argument('--llm-parallel', type=int, default=4, help="LLM_MAX_PARALLEL бота")
+    parser.add_argument('--workers', type=int, default=4, help="ANALYSIS_WORKERS бота")
+    parser.add_argument('--yandex-latency', type=float, default=0.3, help="Задержка заглушки Yandex, с")
+    parser.add_argument('--yandex-rps', type=float, default=50, help="YANDEX_RPS бота")
+    parser.add_argument('--yandex-error-rate', type=float, default=0.0, help="Доля ответов с ошибкой")
+    parser.add_argument('--yandex-error-code', default='55', choices=['55', '15'])
+    parser.add_argument('--telegram-latency', type=float, default=0.05, help="Задержка заглушки Telegram API, с")
+    parser.add_argument('--shed', action='store_true', help="Включить ступени снижения нагрузки (SHED_*)")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    ollama_stub = StubOllama(latency=args.llm_latency, slots=args.ollama_slots)
+    yandex_stub = StubYandex(latency=args.yandex_latency, error_rate=args.yandex_error_rate,
+                             error_code=args.yandex_error_code)
+    with StubThread(ollama_stub, yandex_stub):
+        os.environ['OLLAMA_HOST'] = ollama_stub.url # Клиенты Ollama читают адрес при создании
+        import config # Настройки бота переопределяются до импорта его модулей
+        config.LLM_MAX_PARALLEL = args.llm_parallel
+        config.YANDEX_RPS = args.yandex_rps
+        config.ANALYSIS_WORKERS = args.workers
+        config.ANALYSIS_QUEUE_SIZE = 10 ** 6 # Замер пропускной способности, а не отказов
+        config.SEARCH_CACHE_PATH = '' # Без записи на диск
+        config.FACT_VERDICT_PATH = ''
+        config.QUOTA_USER_SEARCHES = config.QUOTA_USER_TOKENS = config.QUOTA_GLOBAL_SEARCHES = 10 ** 9 # Без квот
+        config.METRICS_PORT = 0
+        if not args.shed:
+            config.SHED_THRESHOLDS = () # Без --shed замеряется полная проверка при любой нагрузке
+
+        print(f"Ollama: {args.llm_latency} с x {args.ollama_slots} слотов, Yandex: {args.yandex_latency} с, "
+              f"ошибки {args.yandex_error_rate:.0%}, Telegram: {args.telegram_latency} с")
+        print(f"{'польз':>5} {'сообщ':>6} {'сообщ/мин':>10} {'p50,с':>7} {'p95,с':>7} {'p99,с':>7} "
+              f"{'лаг p99':>9} {'лаг max':>9} {'LLM':>5} {'поиск':>6} {'префилл':>8}")
+        asyncio.run(run_benchmark(args, ollama_stub, yandex_stub))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+# Замер ограничителя запросов на 1M разных пользователей: время проверки, память и вытеснение неактивных
+import argparse # Параметры замера
+import asyncio # Общий ограничитель SQLite
+import os # Работа с путями
+import sys # Путь к модулям бота
+import tempfile # Временный файл общего ограничителя
+import time # Измерение времени
+import tracemalloc # Замер памяти структур ограничителя
+from collections import defaultdict # Прежний FloodControl
+from datetime import datetime, timedelta # Прежний FloodControl
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from rate_limiter import InProcessRateLimiter, SQLiteRateLimiter # noqa: E402
+
+class LegacyFloodControl:
+    """Прежний FloodControl: список datetime на пользователя без вытеснения"""
+
+    def __init__(self, max_requests_per_hour=15):
+        self.max_requests = max_requests_per_hour
+        self.user_requests = defaultdict(list)
+
+    def check_user(self, user_id):
+        now = datetime.now()
+        user_requests = self.user_requests[user_id]
+        user_requests[:] = [req_time for req_time in user_requests if now - req_time < timedelta(hours=1)]
+        if len(user_requests) >= self.max_requests:
+            return False
+        user_requests.append(now)
+        return True
+
+    def get_remaining_requests(self, user_id):
+        now = datetime.now()
+        user_requests = self.user_requests[user_id]
+        user_requests[:] = [req_time for req_time in user_requests if now - req_time < timedelta(hours=1)]
+        return max(0, self.max_requests - len(user_requests))
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def measure(label, make_check, users):
+    """make_check() создает новый ограничитель и возвращает проверку одного сообщения"""
+    check = make_check()
+    started = time.perf_counter()
+    for user_id in range(users):
+        check(user_id)
+    elapsed = time.perf_counter() - started
+    del check
+
+    tracemalloc.start() # Память - отдельным прогоном: трассировка замедляет выделения
+    check = make_check()
+    for user_id in range(users):
+        check(user_id)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"{label:<22}{elapsed / users * 1e9:>10.0f}{memory / 2 ** 20:>12.1f}")
+
+def bench_eviction(users, period=3600):
+    """Пользователи приходят равномерно в течение периода, затем остаются только новые"""
+    clock = FakeClock()
+    limiter = InProcessRateLimiter(limit=15, period=period, clock=clock)
+    step = period / users
+    for user_id in range(users):
+        clock.now += step
+        limiter.check(user_id)
+    sizes = [len(limiter)]
+    for _ in range(2): # Еще два периода с 10k активных пользователей
+        for i in range(10_000):
+            clock.now += period / 10_000
+            limiter.check(users + i)
+        sizes.append(len(limiter))
+    print(f"Записей: после {users} пользователей {sizes[0]}, через период {sizes[1]}, через два {sizes[2]}")
+
+def bench_sqlite(requests):
+    async def run():
+        with tempfile.TemporaryDirectory() as directory:
+            limiter = SQLiteRateLimiter(os.path.join(directory, 'flood.sqlite3'))
+            started = time.perf_counter()
+            for user_id in range(requests):
+                await limiter.acquire(user_id)
+            elapsed = time.perf_counter() - started
+            limiter.db.close()
+        print(f"SQLite (общий файл): {elapsed / requests * 1e6:.0f} мкс на запрос ({requests} пользователей)")
+    asyncio.run(run())
+
+def main():
+    parser = argparse.ArgumentParser(description="Ограничитель запросов на большом числе пользователей")
+    parser.add_argument('--users', type=int, default=1_000_000, help="Разных пользователей")
+    parser.add_argument('--sqlite-requests', type=int, default=20_000, help="Запросов к общему ограничителю SQLite")
+    args = parser.parse_args()
+
+    print(f"{'ограничитель':<22}{'нс/запрос':>10}{'память, МиБ':>12}")
+    def legacy_check():
+        legacy = LegacyFloodControl()
+        # Прежний обработчик сообщения вызывал check_user и get_remaining_requests
+        return lambda user_id: (legacy.check_user(user_id), legacy.get_remaining_requests(user_id))
+
+    measure('FloodControl (списки)', legacy_check, args.users)
+    measure('GCRA в памяти', lambda: InProcessRateLimiter().check, args.users)
+    bench_eviction(args.users)
+    bench_sqlite(args.sqlite_requests)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+# Замер задержки поиска в индексе похожих новостей на 100k документов
+import os # Работа с путями
+import random # Генерация синтетических текстов
+import sys # Путь к модулям бота
+import time # Измерение времени
+import resource # Замер памяти процесса
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from similarity_index import SimilarityIndex # noqa: E402
+
+def make_text(rng, vocabulary, length=80):
+    return ' '.join(rng.choice(vocabulary) for _ in range(length))
+
+def rewrite(rng, text, vocabulary, ratio=0.05):
+    """Перефразирование: замена части слов и добавленное вступление"""
+    words = text.split()
+    for i in rng.sample(range(len(words)), int(len(words) * ratio)):
+        words[i] = rng.choice(vocabulary)
+    return 'Срочно сообщают ' + ' '.join(words)
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def main(documents=100_000, queries=1000):
+    rng = random.Random(42)
+    vocabulary = [f'слово{i}' for i in range(50_000)]
+    index = SimilarityIndex(capacity=documents, max_age=10 ** 9)
+    texts = []
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    for i in range(documents):
+        text = make_text(rng, vocabulary)
+        if i < queries:
+            texts.append(text)
+        index.add(text, i)
+    build_time = time.perf_counter() - started
+    index_memory = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) * 1024 # ru_maxrss в КиБ (Linux)
+
+    hit_latencies, miss_latencies, found = [], [], 0
+    for i, text in enumerate(texts):
+        started = time.perf_counter()
+        result = index.query(rewrite(rng, text, vocabulary))
+        hit_latencies.append(time.perf_counter() - started)
+        found += result is not None and result[1] == i
+
+        started = time.perf_counter()
+        index.query(make_text(rng, vocabulary))
+        miss_latencies.append(time.perf_counter() - started)
+
+    print(f"Документов: {documents}, построение: {build_time:.1f} с, прирост памяти: {index_memory / 2 ** 20:.0f} МиБ")
+    print(f"Найдено перефразированных: {found}/{queries}")
+    for name, values in (('похожий текст', hit_latencies), ('новый текст', miss_latencies)):
+        print(f"Поиск ({name}): p50 {percentile(values, 50) * 1000:.2f} мс, "
+              f"p99 {percentile(values, 99) * 1000:.2f} мс")
+
+if __name__ == '__main__':
+    main()
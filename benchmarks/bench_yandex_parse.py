@@ -0,0 +1,57 @@
+# Замер разбора записанного ответа Yandex Search API (10 групп): BeautifulSoup против потокового lxml
+import argparse # Параметры замера
+import os # Работа с путями
+import sys # Путь к модулям бота
+import time # Измерение времени
+import tracemalloc # Замер выделений памяти
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bs4 import BeautifulSoup # noqa: E402
+from yandex_parser import parse_search_response # noqa: E402
+from stubs import load_data # noqa: E402
+
+def parse_bs4(body: bytes):
+    """Прежний путь: декодирование в str, полное дерево BeautifulSoup и поиск по нему"""
+    xml_soup = BeautifulSoup(body.decode('utf-8'), 'xml')
+    error = xml_soup.find('error')
+    if error:
+        return {'code': error.get('code', 'unknown'), 'text': error.text}, []
+    docs = []
+    for doc in xml_soup.find_all('doc'):
+        docs.append({
+            'url': doc.find('url').text.strip(),
+            'title': doc.find('title').text.strip() if doc.find('title') else None,
+            'passages': [p.text for p in doc.find_all('passage')][:3]
+        })
+    return None, docs
+
+def measure(parse, body: bytes, repeats: int):
+    started = time.perf_counter()
+    for _ in range(repeats):
+        parse(body)
+    elapsed = (time.perf_counter() - started) / repeats
+
+    tracemalloc.start()
+    parse(body)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+def main():
+    parser = argparse.ArgumentParser(description="Разбор ответа Yandex Search API: BeautifulSoup против lxml iterparse")
+    parser.add_argument('--repeats', type=int, default=500, help="Повторов разбора для замера времени")
+    args = parser.parse_args()
+
+    for name in ('yandex_response.xml', 'yandex_error_15.xml'):
+        body = load_data(name)
+        assert parse_bs4(body) == parse_search_response(body), f"Результаты разбора {name} различаются"
+        print(f"{name}: {len(body) / 1024:.1f} КиБ")
+        print(f"{'парсер':<14}{'мкс/ответ':>12}{'пик памяти, КиБ':>18}")
+        for label, parse in (('BeautifulSoup', parse_bs4), ('lxml iterparse', parse_search_response)):
+            elapsed, peak = measure(parse, body, args.repeats)
+            print(f"{label:<14}{elapsed * 1e6:>12.0f}{peak / 1024:>18.1f}")
+        print()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+# Отправка записанных обновлений Telegram на локальный вебхук бота
+import argparse # Параметры запуска
+import json # Работа с JSON-данными
+import os # Работа с путями
+import sys # Путь к модулям бота
+import time # Измерение времени
+
+import httpx # HTTP-клиент
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from config import WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET # noqa: E402
+
+DEFAULT_UPDATES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'updates.json')
+
+def main():
+    parser = argparse.ArgumentParser(description="Отправка записанных обновлений на вебхук бота")
+    parser.add_argument('--url', default=f"http://127.0.0.1:{WEBHOOK_PORT}/{WEBHOOK_PATH}", help="Адрес вебхука")
+    parser.add_argument('--secret', default=WEBHOOK_SECRET, help="Значение X-Telegram-Bot-Api-Secret-Token")
+    parser.add_argument('--updates', default=DEFAULT_UPDATES, help="JSON-файл со списком обновлений")
+    parser.add_argument('--repeat', type=int, default=1, help="Сколько раз отправить каждое обновление")
+    args = parser.parse_args()
+
+    with open(args.updates, encoding='utf-8') as f:
+        updates = json.load(f)
+    headers = {'X-Telegram-Bot-Api-Secret-Token': args.secret} if args.secret else {}
+    latencies = []
+    with httpx.Client(timeout=10) as client:
+        for round_index in range(args.repeat):
+            for update in updates:
+                update = dict(update, update_id=update['update_id'] + round_index * len(updates)) # Уникальные id
+                started = time.perf_counter()
+                response = client.post(args.url, json=update, headers=headers)
+                latencies.append(time.perf_counter() - started)
+                print(f"update {update['update_id']}: HTTP {response.status_code}, {latencies[-1] * 1000:.1f} мс")
+    latencies.sort()
+    print(f"Отправлено {len(latencies)}, медиана {latencies[len(latencies) // 2] * 1000:.1f} мс, "
+          f"максимум {latencies[-1] * 1000:.1f} мс")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,298 @@
+# Локальные заглушки Ollama, Yandex Search API и Telegram для офлайн-бенчмарков
+import asyncio # Асинхронная обработка запросов
+import hashlib # Детерминированные ответы по тексту промпта
+import json # Работа с JSON-данными
+import os # Работа с путями
+import random # Внедрение ошибок API
+import re # Регулярные выражения
+import threading # Заглушки работают в отдельном потоке со своим циклом событий
+import time # Временные метки
+from datetime import datetime, timezone # Поле created_at в ответах Ollama
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+def load_data(name: str) -> bytes:
+    with open(os.path.join(DATA_DIR, name), 'rb') as f:
+        return f.read()
+
+async def _read_request(reader):
+    """Разбор HTTP/1.1-запроса: метод, путь, заголовки и тело"""
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path, _ = request_line.decode('latin-1').split(' ', 2)
+    headers = {}
+    while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get('content-length', 0) or 0))
+    return method, path, headers, body
+
+def _head(status='200 OK', content_type='application/json', length=None):
+    head = f'HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nConnection: close\r\n'
+    if length is not None:
+        head += f'Content-Length: {length}\r\n'
+    return (head + '\r\n').encode('latin-1')
+
+class StubServer:
+    """Базовый HTTP-сервер заглушки; handle() возвращает (статус, тип, тело) или async-генератор строк"""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host = host
+        self.port = port
+        self.requests = 0
+
+    async def _serve(self, reader, writer):
+        try:
+            request = await _read_request(reader)
+            if request is None:
+                return
+            self.requests += 1
+            result = await self.handle(*request)
+            if isinstance(result, tuple):
+                status, content_type, body = result
+                writer.write(_head(status, content_type, len(body)) + body)
+            else: # Потоковый ответ: строки NDJSON до закрытия соединения
+                writer.write(_head(content_type='application/x-ndjson'))
+                async for line in result:
+                    writer.write(line)
+                    await writer.drain()
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.port}'
+
+class StubOllama(StubServer):
+    """Заглушка Ollama: заготовленные JSON-ответы этапов с настраиваемой задержкой"""
+
+    ASSESSMENT = (
+        "📊 ОБЩАЯ ОЦЕНКА ДОСТОВЕРНОСТИ: 72\n\n🔍 АНАЛИЗ ТЕКСТА: Нейтральный стиль, конкретные даты и источники.\n\n"
+        "📋 ПРОВЕРКА ФАКТОВ: Основные факты подтверждаются несколькими источниками.\n\n"
+        "📚 ИСТОЧНИКИ: Найдено 10 источников, среди них информационные агентства.\n\n"
+        "✅ ПОЛОЖИТЕЛЬНЫЕ АСПЕКТЫ: Указаны время, место и участники.\n\n"
+        "⚠️ ПРОБЛЕМНЫЕ МОМЕНТЫ: Часть деталей не подтверждена.\n\n"
+        "💭 ИТОГОВОЕ ЗАКЛЮЧЕНИЕ: Новость в целом достоверна."
+    )
+
+    def __init__(self, latency=0.2, slots=1, facts=6, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.slots_count = slots
+        self.facts = facts
+        self.prompt_chars = 0 # Суммарная длина промптов
+        self.slot_prompts = [''] * slots # Последний промпт каждого слота, как кэш KV в Ollama
+        self.prompt_eval_tokens = 0 # Токены промптов, которые пришлось вычислить (без совпавшего префикса)
+
+    async def start(self):
+        self.slots = asyncio.Semaphore(self.slots_count) # Параллельные слоты модели
+        return await super().start()
+
+    def _facts(self, prompt):
+        tag = hashlib.md5(prompt.encode('utf-8')).hexdigest()[:8] # Уникальные факты для каждого текста
+        return [f"15 ноября 2024 года произошло событие {tag}-{i} в Крыму по данным службы" for i in range(self.facts)]
+
+    def _answer(self, prompt):
+        if 'проверяемые факты' in prompt:
+            facts = self._facts(prompt)
+            if '"relevant"' in prompt:
+                return json.dumps({'facts': [{'fact': f, 'relevant': i < self.facts - 1} for i, f in enumerate(facts)]},
+                                  ensure_ascii=False)
+            return json.dumps({'facts': facts}, ensure_ascii=False)
+        if 'какие из извлеченных фактов' in prompt:
+            listed = re.findall(r'"([^"]*событие [^"]*)"', prompt)
+            return json.dumps({'relevant_facts': listed[:-1] or listed}, ensure_ascii=False)
+        if '"assessments"' in prompt:
+            indices = sorted({int(i) for i in re.findall(r'"fact_index":\s*(\d+)', prompt)})
+            return json.dumps({'assessments': [{
+                'fact_index': i, 'reliability_score': 70, 'sources_count': 10, 'authoritative_sources': True,
+                'consensus': 'согласуются', 'summary': 'надежные источники', 'top_source_index': 0,
+                'source_diversity': 'высокое'
+            } for i in indices]}, ensure_ascii=False)
+        if 'Оцени качество и надежность источников' in prompt:
+            return json.dumps({'reliability_score': 70, 'sources_count': 10, 'authoritative_sources': True,
+                               'consensus': 'согласуются', 'summary': 'надежные источники', 'top_source_index': 0,
+                               'source_diversity': 'высокое'}, ensure_ascii=False)
+        if 'проверку фактов' in prompt:
+            facts = re.findall(r'событие [0-9a-f]{8}-\d+', prompt)
+            return json.dumps({'factcheck_results': [{
+                'fact': f'15 ноября 2024 года произошло {fact} в Крыму по данным службы',
+                'relevance_to_news': 'высокая', 'source_confirmation': 'подтвержден', 'accuracy_level': 'точно',
+                'context_completeness': 'полный', 'temporal_accuracy': 'соответствует', 'source_count': 10,
+                'confidence_score': 80, 'explanation': 'совпадает с источниками'
+            } for fact in dict.fromkeys(facts)], 'overall_factcheck_score': 78,
+                'overall_assessment': 'факты подтверждены', 'methodology_notes': 'сравнение с источниками'},
+                ensure_ascii=False)
+        if 'по внутренним признакам' in prompt:
+            return json.dumps({'credibility_score': 70, 'style_analysis': 'нейтральный',
+                               'logical_consistency': 'без противоречий', 'specificity_level': 'высокий',
+                               'sources_quality': 'указаны', 'balance_assessment': 'сбалансирован',
+                               'manipulation_signs': 'не обнаружены', 'strong_points': ['даты'],
+                               'weak_points': ['мало цитат'], 'overall_conclusion': 'достоверно'},
+                              ensure_ascii=False)
+        return self.ASSESSMENT
+
+    def _prefill(self, request):
+        """Как Ollama: запрос занимает слот с самым длинным общим префиксом, вычисляется только остаток"""
+        full = (request.get('system') or '') + '\n' + request.get('prompt', '')
+        def common(cached):
+            return len(os.path.commonprefix([cached, full]))
+        slot = max(range(len(self.slot_prompts)), key=lambda i: common(self.slot_prompts[i]))
+        evaluated = (len(full) - common(self.slot_prompts[slot])) // 3 # ~3 символа на токен
+        self.slot_prompts[slot] = full
+        self.prompt_eval_tokens += evaluated
+        return evaluated
+
+    def _message(self, request, response, done, duration, prompt_tokens=0):
+        message = {'model': request.get('model', ''), 'created_at': datetime.now(timezone.utc).isoformat(),
+                   'response': response, 'done': done}
+        if done:
+            message.update({
+                'done_reason': 'stop', 'context': [1, 2, 3], 'total_duration': int(duration * 1e9),
+                'load_duration': 0, 'prompt_eval_count': prompt_tokens,
+                'prompt_eval_duration': int(duration * 0.3e9), 'eval_count': max(1, len(self.ASSESSMENT) // 3),
+                'eval_duration': int(duration * 0.7e9)
+            })
+        return message
+
+    async def handle(self, method, path, headers, body):
+        if path == '/api/generate':
+            request = json.loads(body or b'{}')
+            self.prompt_chars += len(request.get('prompt', ''))
+            answer = self._answer((request.get('system') or '') + request.get('prompt', ''))
+            if request.get('stream'):
+                return self._stream(request, answer)
+            async with self.slots:
+                prompt_tokens = self._prefill(request)
+                await asyncio.sleep(self.latency)
+            return '200 OK', 'application/json', json.dumps(
+                self._message(request, answer, True, self.latency, prompt_tokens), ensure_ascii=False
+            ).encode('utf-8')
+        if path == '/api/pull':
+            return '200 OK', 'application/json', b'{"status": "success"}'
+        if path == '/api/show':
+            return '200 OK', 'application/json', b'{"model_info": {}, "details": {"format": "gguf"}}'
+        if path == '/api/version':
+            return '200 OK', 'application/json', b'{"version": "0.0.0-stub"}'
+        if path == '/api/tags':
+            return '200 OK', 'application/json', b'{"models": []}'
+        return '404 Not Found', 'text/plain', b'not found'
+
+    async def _stream(self, request, answer):
+        chunks = [answer[i:i + 40] for i in range(0, len(answer), 40)] or ['']
+        async with self.slots:
+            prompt_tokens = self._prefill(request)
+            for chunk in chunks:
+                await asyncio.sleep(self.latency / len(chunks))
+                yield (json.dumps(self._message(request, chunk, False, 0), ensure_ascii=False) + '\n').encode('utf-8')
+            yield (json.dumps(self._message(request, '', True, self.latency, prompt_tokens),
+                              ensure_ascii=False) + '\n').encode('utf-8')
+
+class StubYandex(StubServer):
+    """Заглушка Yandex Search API: записанные XML-ответы и ошибки с заданной вероятностью"""
+
+    def __init__(self, latency=0.3, error_rate=0.0, error_code='55', seed=1, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.response = load_data('yandex_response.xml')
+        self.error = load_data(f'yandex_error_{error_code}.xml')
+        self.errors = 0
+
+    async def handle(self, method, path, headers, body):
+        await asyncio.sleep(self.latency)
+        if self.rng.random() < self.error_rate:
+            self.errors += 1
+            return '200 OK', 'application/xml', self.error
+        return '200 OK', 'application/xml', self.response
+
+class StubThread:
+    """Запускает заглушки в отдельном потоке, чтобы они не влияли на цикл событий бота"""
+
+    def __init__(self, *servers):
+        self.servers = servers
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        for server in self.servers:
+            asyncio.run_coroutine_threadsafe(server.start(), self.loop).result()
+        return self
+
+    def __exit__(self, *exc):
+        for server in self.servers:
+            server.server.close()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=5)
+
+# Заглушки Telegram: объекты с теми же атрибутами и методами, что использует бот
+
+class FakeBot:
+    """Бот Telegram с настраиваемой задержкой API"""
+
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self.edits = 0
+        self.sent = []
+        self._message_ids = 0
+
+    def next_message_id(self):
+        self._message_ids += 1
+        return self._message_ids
+
+    async def edit_message_text(self, chat_id=None, message_id=None, text=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.edits += 1
+
+    async def delete_message(self, chat_id=None, message_id=None, **kwargs):
+        await asyncio.sleep(self.latency)
+
+    async def send_message(self, chat_id=None, text=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.sent.append((chat_id, text))
+        return FakeMessage(self, chat_id, text)
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+
+class FakeMessage:
+    def __init__(self, bot, chat_id, text=None, caption=None):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = bot.next_message_id()
+        self.text = text
+        self.caption = caption
+        self.replies = [] # (время, текст) ответов бота
+        self.date = datetime.now(timezone.utc)
+
+    async def reply_text(self, text, **kwargs):
+        await asyncio.sleep(self.bot.latency)
+        self.replies.append((time.perf_counter(), text))
+        return FakeMessage(self.bot, self.chat_id, text)
+
+class FakeUpdate:
+    """Входящее сообщение пользователя"""
+
+    def __init__(self, bot, user_id, text):
+        self.effective_user = FakeUser(user_id)
+        self.message = FakeMessage(bot, chat_id=user_id, text=text)
+        self.effective_message = self.message
+        self.effective_chat = type('FakeChat', (), {'id': user_id})()
+
+class FakeContext:
+    def __init__(self, bot):
+        self.bot = bot
+        self.error = None
+        self.bot_data = {}
@@ -0,0 +1,233 @@
+# Брокер заданий анализа между Telegram-фронтендом и процессами-обработчиками
+import asyncio # Асинхронная обработка запросов
+import json # Сериализация заданий
+import logging # Для записи логов работы программы
+import os # Работа с путями
+import sqlite3 # Очередь заданий в файле, общем для процессов
+import time # Время постановки и аренды заданий
+import uuid # Идентификаторы заданий
+from abc import ABC, abstractmethod # Интерфейс, который должны реализовать все брокеры
+from collections import OrderedDict, deque # Очереди пользователей в порядке обхода
+
+from config import (
+    BROKER,
+    BROKER_PATH,
+    BROKER_LEASE,
+    BROKER_POLL_INTERVAL,
+    BROKER_MAX_ATTEMPTS
+) # Параметры брокера
+
+logger = logging.getLogger(__name__) # Логгер для текущего модуля
+
+class Broker(ABC):
+    """Интерфейс брокера: задание - словарь с полями user_id, chat_id, message_id, text и др."""
+
+    @abstractmethod
+    async def put(self, job: dict) -> str:
+        """Ставит задание в очередь и возвращает его идентификатор"""
+
+    @abstractmethod
+    async def get(self, worker_id: str, timeout: float = None):
+        """Забирает следующее задание (с арендой на BROKER_LEASE) или возвращает None по таймауту"""
+
+    @abstractmethod
+    async def renew(self, job_id: str, worker_id: str) -> bool:
+        """Продлевает аренду выполняемого задания; False - аренда потеряна (задание отдано другому обработчику)"""
+
+    @abstractmethod
+    async def complete(self, job_id: str, result: dict = None):
+        """Отмечает задание выполненным"""
+
+    @abstractmethod
+    async def fail(self, job_id: str, error: str):
+        """Отмечает задание неудачным"""
+
+    @abstractmethod
+    async def size(self) -> int:
+        """Число заданий, ожидающих обработчика"""
+
+class InProcessBroker(Broker):
+    """Брокер в памяти для фронтенда и обработчиков в одном процессе; пользователи обслуживаются по кругу"""
+
+    def __init__(self):
+        self.queues = OrderedDict() # {user_id: deque заданий}
+        self.count = 0
+        self._available = asyncio.Semaphore(0)
+        self.running = {} # {job_id: задание}
+
+    async def put(self, job: dict) -> str:
+        job = dict(job, id=job.get('id') or uuid.uuid4().hex)
+        self.queues.setdefault(job['user_id'], deque()).append(job)
+        self.count += 1
+        self._available.release()
+        return job['id']
+
+    async def get(self, worker_id: str, timeout: float = None):
+        try:
+            await asyncio.wait_for(self._available.acquire(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        user_id, queue = next(iter(self.queues.items()))
+        job = queue.popleft()
+        del self.queues[user_id]
+        if queue:
+            self.queues[user_id] = queue # Пользователь уходит в конец круга
+        self.count -= 1
+        self.running[job['id']] = job
+        return job
+
+    async def renew(self, job_id: str, worker_id: str) -> bool:
+        return job_id in self.running # Задания в памяти не теряют аренду
+
+    async def complete(self, job_id: str, result: dict = None):
+        self.running.pop(job_id, None)
+
+    async def fail(self, job_id: str, error: str):
+        self.running.pop(job_id, None)
+        logger.error(f"Задание {job_id} не выполнено: {error}")
+
+    async def size(self) -> int:
+        return self.count
+
+class SQLiteBroker(Broker):
+    """Брокер на SQLite: фронтенд и обработчики в разных процессах с общим файлом очереди.
+    Обработчик продлевает аренду задания, пока выполняет его; задание, аренда которого истекла
+    max_attempts раз (обработчик падает на нем), переводится в статус 'dead' и больше не выдается"""
+
+    def __init__(self, path=BROKER_PATH, lease=BROKER_LEASE, poll_interval=BROKER_POLL_INTERVAL,
+                 max_attempts=BROKER_MAX_ATTEMPTS):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL") # Чтение и запись из разных процессов без блокировок
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, user_id TEXT NOT NULL, user_seq INTEGER NOT NULL, "
+            "created REAL NOT NULL, status TEXT NOT NULL, worker TEXT, lease_until REAL, "
+            "payload TEXT NOT NULL, result TEXT, attempts INTEGER NOT NULL DEFAULT 0)"
+        )
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(jobs)")}
+        if 'attempts' not in columns: # Файл очереди, созданный до счетчика попыток
+            self.db.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+        self.db.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, user_seq, created)")
+        self._lock = asyncio.Lock() # Одно обращение к соединению за раз
+
+    async def _run(self, function, *args):
+        async with self._lock:
+            return await asyncio.to_thread(function, *args)
+
+    def _put(self, job):
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            # Номер задания среди ожидающих заданий пользователя: сортировка по нему дает обход по кругу
+            (user_seq,) = self.db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE user_id = ? AND status IN ('queued', 'running')",
+                (str(job['user_id']),)
+            ).fetchone()
+            self.db.execute(
+                "INSERT INTO jobs (id, user_id, user_seq, created, status, payload) VALUES (?, ?, ?, ?, 'queued', ?)",
+                (job['id'], str(job['user_id']), user_seq, time.time(), json.dumps(job, ensure_ascii=False))
+            )
+            self.db.execute("COMMIT")
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+
+    def _claim(self, worker_id):
+        now = time.time()
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            dead = self.db.execute(
+                "SELECT id, worker FROM jobs WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                (now, self.max_attempts)
+            ).fetchall()
+            self.db.executemany(
+                "UPDATE jobs SET status = 'dead', lease_until = NULL, result = ? WHERE id = ?",
+                [(json.dumps({'error': "аренда истекла на каждой попытке"}, ensure_ascii=False), job_id)
+                 for job_id, _ in dead]
+            ) # Задания, на которых обработчики падают каждый раз, больше не выдаются
+            self.db.execute(
+                "UPDATE jobs SET status = 'queued', worker = NULL WHERE status = 'running' AND lease_until < ?",
+                (now,)
+            ) # Задания упавших обработчиков возвращаются в очередь
+            row = self.db.execute(
+                "SELECT id, payload FROM jobs WHERE status = 'queued' ORDER BY user_seq, created LIMIT 1"
+            ).fetchone()
+            if row:
+                self.db.execute(
+                    "UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, attempts = attempts + 1 "
+                    "WHERE id = ?",
+                    (worker_id, now + self.lease, row[0])
+                )
+            self.db.execute("COMMIT")
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+        for job_id, worker in dead:
+            logger.error(f"Задание {job_id} отложено в 'dead' после {self.max_attempts} попыток (последний {worker})")
+        return json.loads(row[1]) if row else None
+
+    def _renew(self, job_id, worker_id):
+        cursor = self.db.execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = 'running' AND worker = ?",
+            (time.time() + self.lease, job_id, worker_id)
+        )
+        return cursor.rowcount > 0
+
+    def _finish(self, job_id, status, result):
+        self.db.execute(
+            "UPDATE jobs SET status = ?, lease_until = NULL, result = ? WHERE id = ?",
+            (status, json.dumps(result, ensure_ascii=False), job_id)
+        )
+        self.db.execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND created < ? OR status = 'dead' AND created < ?",
+            (time.time() - 86400, time.time() - 7 * 86400)
+        ) # Храним выполненные задания сутки, отложенные для разбора - неделю
+
+    def _size(self):
+        return self.db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+
+    async def put(self, job: dict) -> str:
+        job = dict(job, id=job.get('id') or uuid.uuid4().hex)
+        await self._run(self._put, job)
+        return job['id']
+
+    async def get(self, worker_id: str, timeout: float = None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = await self._run(self._claim, worker_id)
+            if job is not None:
+                return job
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            await asyncio.sleep(self.poll_interval)
+
+    async def renew(self, job_id: str, worker_id: str) -> bool:
+        return await self._run(self._renew, job_id, worker_id)
+
+    async def complete(self, job_id: str, result: dict = None):
+        await self._run(self._finish, job_id, 'done', result)
+
+    async def fail(self, job_id: str, error: str):
+        await self._run(self._finish, job_id, 'failed', {'error': error})
+
+    async def size(self) -> int:
+        return await self._run(self._size)
+
+_broker = None
+
+def get_broker() -> Broker:
+    """Брокер, выбранный в config.BROKER (создается при первом обращении)"""
+    global _broker
+    if _broker is None:
+        if BROKER == 'sqlite':
+            _broker = SQLiteBroker()
+        elif BROKER == 'memory':
+            _broker = InProcessBroker()
+        else:
+            raise ValueError(f"Неизвестный брокер: {BROKER}")
+    return _broker
@@ -3,3 +3,114 @@ YANDEX_API_KEY = ""
 YANDEX_SEARCH_URL = "https://yandex.ru/search/xml"
 YANDEX_USER = ""
 YANDEX_FOLDER_ID = ""
+
+# Параметры LLM (Ollama)
+OLLAMA_MODEL = "yandex/YandexGPT-5-Lite-8B-instruct-GGUF"
+LLM_MAX_PARALLEL = 1  # Число одновременных запросов к одному серверу Ollama (равно OLLAMA_NUM_PARALLEL сервера)
+LLM_TIMEOUT = 180  # Таймаут одного вызова модели, секунды
+OLLAMA_HOSTS = []  # Пул серверов Ollama, например ["http://gpu1:11434", "http://gpu2:11434"] ([] - OLLAMA_HOST)
+LLM_STAGE_MODELS = {}  # Модели отдельных этапов, например {"extraction": "qwen2.5:3b", "relevance_filter": "qwen2.5:3b"}
+LLM_RETRIES = 1  # Повторы вызова на другом сервере после сетевой ошибки, таймаута или ошибки 5xx
+LLM_EJECT_AFTER = 3  # Ошибок подряд, после которых сервер исключается из пула
+LLM_EJECT_SECONDS = 30  # Время исключения сервера, секунды
+LLM_HEALTH_INTERVAL = 15  # Интервал проверки серверов пула, секунды (0 - без проверок)
+LLM_KEEP_ALIVE = "30m"  # Сколько модель остается в памяти Ollama после вызова
+LLM_PULL_ON_START = True  # Скачивать недостающие модели при запуске (False - только python llm_gateway.py pull)
+LLM_CTX_BUCKETS = (4096, 8192, 16384)  # Допустимые размеры контекста (num_ctx); выбирается наименьший подходящий
+LLM_CHARS_PER_TOKEN = 2.5  # Символов на токен для оценки размера промпта (русский текст и JSON, с запасом)
+LLM_OUTPUT_RESERVE = 2048  # Токены контекста, оставляемые под ответ модели
+LLM_EVIDENCE_BUDGET = 10000  # Бюджет токенов блока источников; при превышении источники сжимаются
+
+# Параметры Yandex Search API
+YANDEX_RPS = 3  # Квота аккаунта, запросов в секунду
+YANDEX_QUOTA_COOLDOWN = 60  # Пауза после ошибки 32 (превышена квота), секунды
+YANDEX_MAX_RETRIES = 2  # Повторы запроса после ошибки 55 (RPS)
+
+# Кэш результатов поиска
+SEARCH_CACHE_TTL = 6 * 3600  # Время жизни результатов поиска, секунды
+SEARCH_CACHE_SIZE = 2048  # Записей в памяти (LRU)
+SEARCH_CACHE_PATH = "cache/search_cache.sqlite3"  # Файл дискового кэша ("" - только память)
+SEARCH_QUERIES_PER_FACT = 1  # Коротких поисковых запросов на факт (каждый - отдельный запрос к Yandex)
+SEARCH_QUERY_WORDS = 8  # Слов в поисковом запросе; более короткий факт ищется целиком
+SEARCH_RRF_K = 60  # Параметр reciprocal rank fusion: чем больше, тем меньше вес первых мест
+SEARCH_MAX_RESULTS = 10  # Источников факта после объединения результатов запросов
+SEARCH_SNIPPET_SIMILARITY = 0.8  # Сходство отрывков (Жаккар по шинглам), с которого документ считается повтором
+
+# Кэш вердиктов проверки отдельных фактов
+FACT_VERDICT_TTL = 24 * 3600  # Время жизни вердикта факта, секунды
+FACT_VERDICT_SIZE = 4096  # Вердиктов в памяти (LRU)
+FACT_VERDICT_PATH = "cache/fact_verdicts.sqlite3"  # Файл дискового кэша вердиктов ("" - только память)
+FACT_VERDICT_SIMILARITY = 0.8  # Сходство формулировок для повторного использования вердикта (числа должны совпадать)
+
+# Кэш готовых отчетов
+REPORT_CACHE_TTL = 3600  # Время жизни отчета для повторных пересылок, секунды
+REPORT_CACHE_SIZE = 512  # Максимум отчетов в памяти
+
+# Поиск похожих новостей
+SIMILARITY_INDEX_SIZE = 10000  # Максимум текстов в индексе
+SIMILARITY_INDEX_MAX_AGE = 24 * 3600  # Возраст, после которого текст вытесняется, секунды
+SIMILARITY_REUSE_THRESHOLD = 0.85  # Сходство для повторного использования готового отчета
+SIMILARITY_PARTIAL_THRESHOLD = 0.6  # Сходство для повторного использования фактов и источников
+
+# Оценка качества источников
+SOURCES_QUALITY_BATCH = True  # Оценивать источники всех фактов одним вызовом LLM
+DOMAIN_REPUTATION_PATH = "data/domain_reputation.json"  # Таблица уровней надежности доменов
+
+# Порядок этапов анализа
+FACT_RELEVANCE_MODE = "extract"  # "extract" - релевантность при извлечении фактов, до поиска; "filter" - отдельный вызов LLM после поиска
+
+# Telegram
+TELEGRAM_EDIT_INTERVAL = 1.5  # Минимальный интервал между правками сообщения о ходе обработки, секунды
+
+# Метрики
+METRICS_HOST = "127.0.0.1"  # Адрес эндпоинта /metrics
+METRICS_PORT = 9108  # Порт эндпоинта /metrics (0 - отключить)
+
+# Ограничение запросов пользователя
+FLOOD_MAX_REQUESTS = 15  # Запросов пользователя за период (и не больше подряд)
+FLOOD_PERIOD = 3600  # Период ограничения, секунды
+FLOOD_BACKEND = "memory"  # "memory" - в процессе бота; "sqlite" - общий файл для нескольких процессов бота
+FLOOD_PATH = "cache/flood.sqlite3"  # Файл общего ограничителя SQLite
+
+# Квоты по фактическому расходу (хранилище - FLOOD_BACKEND)
+QUOTA_PERIOD = 3600  # Период пользовательских квот, секунды
+QUOTA_USER_SEARCHES = 60  # Запросов к Yandex на пользователя за период (попадания в кэш бесплатны)
+QUOTA_USER_TOKENS = 300000  # Токенов LLM (промпт + ответ) на пользователя за период
+QUOTA_GLOBAL_SEARCHES = 1000  # Запросов к Yandex на весь аккаунт за QUOTA_GLOBAL_PERIOD
+QUOTA_GLOBAL_PERIOD = 3600  # Период общей квоты Yandex, секунды
+QUOTA_DEGRADED_SHARE = 0.2  # Доля остатка квоты, ниже которой включается сокращенная проверка
+QUOTA_ANALYSIS_TOKENS = 15000  # Ожидаемый расход токенов одного сокращенного анализа: при меньшем остатке - отказ
+MAX_FACTS = 6  # Фактов на сообщение
+QUOTA_DEGRADED_FACTS = 3  # Фактов на сообщение в сокращенной проверке
+
+# Снижение нагрузки: ступени упрощения анализа при росте очереди и задержек
+SHED_IN_FLIGHT = 8  # Сообщений в обработке (включая очередь), при которых давление равно 1
+SHED_LATENCY_TARGETS = {"analysis": 90, "llm": 30}  # Целевая скользящая длительность анализа и вызова LLM, секунды
+SHED_THRESHOLDS = (1.0, 1.5, 2.0, 3.0)  # Давление, с которого включаются ступени 1-4
+SHED_COOLDOWN = 30  # Секунд давления ниже порога перед снижением ступени на одну
+SHED_LATENCY_HALF_LIFE = 60  # Секунд без замеров, за которые скользящая длительность этапа уменьшается вдвое
+SHED_FACTS = 3  # Фактов на сообщение на ступенях 1-3
+SHED_UNKNOWN_DOMAIN_SCORE = 40  # Оценка неизвестных доменов, когда источники оцениваются без LLM
+
+# Очередь анализа
+ANALYSIS_WORKERS = 2  # Одновременно выполняемых анализов
+ANALYSIS_QUEUE_SIZE = 100  # Мест в очереди; при заполнении новые запросы отклоняются
+ANALYSIS_QUEUE_PER_USER = 3  # Запросов одного пользователя в очереди
+
+# Разделение на фронтенд и обработчики
+BOT_MODE = "standalone"  # "standalone" - анализ в процессе бота; "frontend" - бот только ставит задания для worker.py
+BROKER = "sqlite"  # Брокер заданий: "sqlite" - файл, общий для процессов; "memory" - обработчики в процессе бота
+BROKER_PATH = "cache/jobs.sqlite3"  # Файл очереди заданий SQLite
+BROKER_LEASE = 180  # Время, после которого задание упавшего обработчика возвращается в очередь, секунды
+BROKER_HEARTBEAT = 30  # Интервал продления аренды выполняемого задания, секунды
+BROKER_MAX_ATTEMPTS = 3  # Выдач задания, после которых оно переводится в 'dead' и больше не выдается
+BROKER_POLL_INTERVAL = 0.5  # Интервал опроса пустой очереди, секунды
+WORKER_CONCURRENCY = 2  # Одновременных анализов в одном процессе-обработчике
+
+# Получение обновлений Telegram
+TELEGRAM_WEBHOOK_URL = ""  # Публичный адрес вебхука, например "https://bot.example.com/telegram" ("" - long polling)
+WEBHOOK_LISTEN = "0.0.0.0"  # Адрес, на котором слушает сервер вебхука
+WEBHOOK_PORT = 8443  # Порт сервера вебхука
+WEBHOOK_PATH = "telegram"  # Путь вебхука на сервере
+WEBHOOK_SECRET = ""  # Значение заголовка X-Telegram-Bot-Api-Secret-Token (символы A-Z, a-z, 0-9, _ и -)
+DRAIN_TIMEOUT = 300  # Ожидание выполняющихся анализов при остановке, секунды
@@ -0,0 +1,115 @@
+# Таблица репутации доменов для оценки источников без обращения к LLM
+import json # Загрузка таблицы
+import logging # Для записи логов работы программы
+import os # Работа с путями
+from urllib.parse import urlparse # Парсинг URL
+
+from search_cache import is_error_result # Служебные ответы об ошибках поиска
+
+from config import DOMAIN_REPUTATION_PATH # Путь к таблице репутации
+
+logger = logging.getLogger(__name__) # Логгер для текущего модуля
+
+# Составные публичные суффиксы, под которыми регистрируются домены (eTLD)
+MULTI_PART_SUFFIXES = {
+    'co.uk', 'org.uk', 'gov.uk', 'ac.uk', 'com.au', 'net.au', 'org.au',
+    'com.ru', 'net.ru', 'org.ru', 'pp.ru', 'msk.ru', 'spb.ru', 'msk.su',
+    'com.ua', 'org.ua', 'in.ua', 'kiev.ua', 'com.by', 'com.kz', 'org.kz',
+    'co.jp', 'com.cn', 'com.tr', 'com.br', 'co.il'
+}
+
+def host_of(url: str) -> str:
+    """Имя хоста из URL в нижнем регистре, без www и порта"""
+    host = urlparse(url if '//' in url else f'//{url}').hostname or ''
+    host = host.rstrip('.').lower()
+    return host[4:] if host.startswith('www.') else host
+
+def registrable_domain(host: str) -> str:
+    """Нормализация до eTLD+1 (mchs.gov.ru -> gov.ru, news.bbc.co.uk -> bbc.co.uk)"""
+    labels = host.split('.')
+    if len(labels) >= 3 and '.'.join(labels[-2:]) in MULTI_PART_SUFFIXES:
+        return '.'.join(labels[-3:])
+    return '.'.join(labels[-2:])
+
+class DomainReputation:
+    """Уровни надежности доменов с поиском по хосту и его родительским доменам"""
+
+    def __init__(self, path=DOMAIN_REPUTATION_PATH):
+        self.tiers = {}
+        self.domains = {}
+        if path:
+            self.load(path)
+
+    def load(self, path: str):
+        """Загружает таблицу уровней и доменов из JSON-файла"""
+        if not os.path.isabs(path): # Относительный путь считается от каталога бота
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+        try:
+            with open(path, encoding='utf-8') as f:
+                table = json.load(f)
+        except (OSError, json.JSONDecodeError) as err:
+            logger.error(f"Не удалось загрузить таблицу репутации доменов {path}: {err}")
+            return
+        self.tiers = table.get('tiers', {})
+        self.domains = {
+            domain.lower(): tier for domain, tier in table.get('domains', {}).items()
+            if tier in self.tiers
+        }
+        logger.info(f"Таблица репутации: {len(self.domains)} доменов, {len(self.tiers)} уровней")
+
+    def lookup(self, url: str):
+        """Возвращает (домен, уровень, параметры уровня) или None для неизвестного домена"""
+        host = host_of(url)
+        if not host:
+            return None
+        registrable = registrable_domain(host)
+        candidate = host
+        while True: # От полного имени хоста к eTLD+1: не больше нескольких обращений к словарю
+            if (tier := self.domains.get(candidate)) is not None:
+                return candidate, tier, self.tiers[tier]
+            if candidate == registrable or '.' not in candidate:
+                return None
+            candidate = candidate.split('.', 1)[1]
+
+    def assess(self, sources: list, unknown_score: int = None):
+        """Оценка источников факта по таблице, если все домены известны; иначе None.
+        unknown_score - оценка неизвестных доменов, чтобы оценить любые источники без LLM
+        (служебные ответы об ошибках и записи без URL при этом не считаются источниками)"""
+        if unknown_score is not None:
+            sources = [src for src in sources if src.get('url') and not is_error_result([src])]
+            if not sources:
+                return {
+                    "reliability_score": 0,
+                    "sources_count": 0,
+                    "authoritative_sources": False,
+                    "consensus": "Нет данных",
+                    "summary": "Источники не найдены",
+                    "top_source": None
+                }
+        known = [(src, self.lookup(src.get('url', ''))) for src in sources]
+        if unknown_score is not None:
+            known = [
+                (src, info or (host_of(src.get('url', '')), None, {'score': unknown_score})) for src, info in known
+            ]
+        if not known or any(info is None for _, info in known):
+            return None
+
+        scored = sorted(known, key=lambda item: item[1][2]['score'], reverse=True)
+        top_scores = [info[2]['score'] for _, info in scored[:3]]
+        authoritative = [src for src, info in known if info[2].get('authoritative')]
+        domains = {info[0] for _, info in known}
+        return {
+            "reliability_score": round(sum(top_scores) / len(top_scores)),
+            "sources_count": len(sources),
+            "authoritative_sources": bool(authoritative),
+            "consensus": "Не оценивалась (оценка по репутации доменов)",
+            "summary": (
+                f"Оценка по таблице репутации: {len(sources)} источников, "
+                f"из них авторитетных {len(authoritative)}"
+            ),
+            "top_source": scored[0][0],
+            "source_diversity": f"Различных доменов: {len(domains)}"
+        }
+
+# Глобальный экземпляр таблицы репутации
+domain_reputation = DomainReputation()
@@ -0,0 +1,123 @@
+# Компактное строчное представление фактов, источников и результатов этапов для промптов
+from domain_reputation import host_of # Сайт источника
+
+def _line(value) -> str:
+    """Значение в одну строку без разделителя полей"""
+    return ' '.join(str(value).split()).replace('|', '/')
+
+def source_key(src: dict) -> str:
+    """Ключ источника: URL, а для записей без URL - заголовок и отрывок"""
+    return src.get('url') or f"{src.get('title', '')}|{src.get('snippet', '')}"
+
+def source_ids(fact_results: dict) -> dict:
+    """Идентификаторы S1, S2, ... в порядке первого появления; повторяющийся источник получает тот же id"""
+    ids = {}
+    for sources in fact_results.values():
+        for src in sources:
+            ids.setdefault(source_key(src), f"S{len(ids) + 1}")
+    return ids
+
+def fact_ids(fact_results: dict) -> dict:
+    """Идентификаторы фактов F0, F1, ... (номер совпадает с fact_index)"""
+    return {fact: f"F{i}" for i, fact in enumerate(fact_results)}
+
+def render_evidence(fact_results: dict) -> str:
+    """Каждый источник один раз с id, затем факты со ссылками на id своих источников"""
+    ids = source_ids(fact_results)
+    lines = ["Источники (id | сайт | заголовок | отрывок):"]
+    listed = set()
+    for sources in fact_results.values():
+        for src in sources:
+            key = source_key(src)
+            if key in listed:
+                continue
+            listed.add(key)
+            fields = [ids[key], host_of(src.get('url', '')) or '-', _line(src.get('title', ''))]
+            if src.get('snippet'):
+                fields.append(_line(src['snippet']))
+            lines.append(' | '.join(fields))
+    lines.append("")
+    lines.append("Факты и их источники в порядке выдачи поиска:")
+    for fact_id, (fact, sources) in zip(fact_ids(fact_results).values(), fact_results.items()):
+        lines.append(f"{fact_id}: {_line(fact)}")
+        lines.append(f"  источники: {' '.join(ids[source_key(src)] for src in sources) or 'нет'}")
+    return '\n'.join(lines)
+
+def find_source(sources: list, ids: dict, source_id) -> dict:
+    """Источник факта по id из ответа модели"""
+    for src in sources:
+        if ids.get(source_key(src)) == str(source_id).strip():
+            return src
+    return None
+
+TEXT_ANALYSIS_FIELDS = (
+    ('credibility_score', 'оценка достоверности'),
+    ('style_analysis', 'стиль'),
+    ('logical_consistency', 'логика'),
+    ('specificity_level', 'конкретность'),
+    ('sources_quality', 'источники в тексте'),
+    ('balance_assessment', 'баланс'),
+    ('manipulation_signs', 'признаки манипуляции'),
+    ('strong_points', 'сильные стороны'),
+    ('weak_points', 'слабые стороны'),
+    ('overall_conclusion', 'вывод')
+)
+
+def _value(value) -> str:
+    if isinstance(value, bool):
+        return 'да' if value else 'нет'
+    if isinstance(value, (list, tuple)):
+        return '; '.join(_line(item) for item in value)
+    return _line(value)
+
+def render_assessment_data(text_analysis, fact_results, sources_quality, factcheck_results, total_sources=None) -> str:
+    """Результаты этапов для итоговой оценки: факты и источники - ссылками на id из блока источников
+    (fact_results - те же, что в render_evidence, total_sources - число найденных до сжатия)"""
+    ids = source_ids(fact_results)
+    facts = fact_ids(fact_results)
+    lines = ["Анализ текста:"]
+    for key, label in TEXT_ANALYSIS_FIELDS:
+        if text_analysis.get(key) not in (None, '', []):
+            lines.append(f"  {label}: {_value(text_analysis[key])}")
+
+    lines.append("Оценка источников:")
+    for fact, quality in sources_quality.items():
+        top = quality.get('top_source')
+        parts = [
+            f"надежность {quality.get('reliability_score', '?')}",
+            f"авторитетные {_value(bool(quality.get('authoritative_sources')))}",
+            f"согласованность: {_value(quality.get('consensus', ''))}",
+            f"вывод: {_value(quality.get('summary', ''))}"
+        ]
+        if quality.get('source_diversity'):
+            parts.append(f"разнообразие: {_value(quality['source_diversity'])}")
+        if top:
+            parts.append(f"лучший {ids.get(source_key(top), _line(top.get('url', '')))}")
+        lines.append(f"  {facts.get(fact, _line(fact))}: {'; '.join(parts)}")
+
+    lines.append(
+        f"Проверка фактов (общая оценка {factcheck_results.get('overall_factcheck_score', '?')}): "
+        f"{_value(factcheck_results.get('overall_assessment', ''))}"
+    )
+    for item in factcheck_results.get('factcheck_results', []):
+        if not isinstance(item, dict):
+            continue
+        fact = item.get('fact', '')
+        parts = [
+            _value(item.get('source_confirmation', '')),
+            f"точность: {_value(item.get('accuracy_level', ''))}",
+            f"контекст: {_value(item.get('context_completeness', ''))}",
+            f"время: {_value(item.get('temporal_accuracy', ''))}",
+            f"уверенность {item.get('confidence_score', '?')}",
+            _value(item.get('explanation', ''))
+        ]
+        lines.append(f"  {facts.get(fact, _line(fact))}: {'; '.join(parts)}")
+
+    if total_sources is None:
+        total_sources = sum(len(sources) for sources in fact_results.values())
+    with_sources = sum(1 for sources in fact_results.values() if sources)
+    lines.append(
+        f"Статистика источников: найдено {total_sources} (уникальных {len(ids)}), "
+        f"фактов с источниками {with_sources} из {len(fact_results)}"
+    )
+    return '\n'.join(lines)
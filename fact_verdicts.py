@@ -0,0 +1,233 @@
+# Кэш вердиктов проверки отдельных фактов, общий для разных новостей
+import asyncio # Запись на диск вне цикла событий
+import json # Сериализация вердиктов для дискового уровня
+import logging # Для записи логов работы программы
+import os # Работа с путями
+import re # Регулярные выражения
+import sqlite3 # Дисковый уровень, общий для процессов-обработчиков
+import time # Время жизни записей
+from collections import OrderedDict # LRU-уровень в памяти
+
+from search_cache import normalize_fact, is_error_result # Ключ факта и распознавание ответов об ошибках
+from similarity_index import SimilarityIndex # Поиск того же утверждения в другой формулировке
+
+from config import (
+    FACT_VERDICT_TTL,
+    FACT_VERDICT_SIZE,
+    FACT_VERDICT_PATH,
+    FACT_VERDICT_SIMILARITY
+) # Параметры кэша вердиктов
+
+logger = logging.getLogger(__name__) # Логгер для текущего модуля
+
+# Поля вердикта, не зависящие от текста новости (релевантность и полнота контекста оцениваются заново)
+VERDICT_FIELDS = (
+    'source_confirmation',
+    'accuracy_level',
+    'temporal_accuracy',
+    'source_count',
+    'confidence_score',
+    'explanation'
+)
+UNDEFINED = 'не определено' # Значение полей в ответе о неудачной проверке
+
+def numbers_of(text: str) -> list:
+    """Числа утверждения: формулировки с разными датами или цифрами - разные факты"""
+    return sorted(re.findall(r'\d+(?:[.,]\d+)?', text))
+
+class FactVerdictStore:
+    """Вердикты по нормализованному факту (LRU в памяти + SQLite) с поиском близких формулировок"""
+
+    def __init__(self, path=FACT_VERDICT_PATH, ttl=FACT_VERDICT_TTL, max_size=FACT_VERDICT_SIZE,
+                 similarity=FACT_VERDICT_SIMILARITY):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.similarity = similarity
+        self.memory = OrderedDict() # {ключ: (время записи, вердикт)}
+        self.index = SimilarityIndex(capacity=max_size, max_age=ttl) # Формулировки фактов -> ключи
+        self.hits = 0 # Найденные вердикты (точные и по близкой формулировке)
+        self.similar_hits = 0 # Из них по близкой формулировке
+        self.misses = 0 # Промахи
+        self.db = None
+        self.writer = None # Отдельное соединение для записи в потоке, чтобы не блокировать цикл событий
+        self._write_lock = asyncio.Lock() # Одна запись за раз
+        self._read_lock = asyncio.Lock() # Одно чтение за раз через соединение db
+        if path:
+            if not os.path.isabs(path): # Относительный путь считается от каталога бота, а не от текущего
+                path = os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+            try:
+                if os.path.dirname(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                self.db = sqlite3.connect(path, check_same_thread=False)
+                self.db.execute("PRAGMA journal_mode=WAL") # Чтение не ждет записи из потока
+                self.db.execute(
+                    "CREATE TABLE IF NOT EXISTS fact_verdicts "
+                    "(key TEXT PRIMARY KEY, created REAL NOT NULL, verdict TEXT NOT NULL)"
+                )
+                self.db.commit()
+                self._load_recent()
+                self.writer = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            except sqlite3.Error as err:
+                logger.error(f"Дисковый кэш вердиктов недоступен: {err}") # Работаем только в памяти
+                self.db = self.writer = None
+
+    def _load_recent(self):
+        """Заполняет индекс формулировок свежими вердиктами, записанными до запуска и другими процессами"""
+        rows = self.db.execute(
+            "SELECT key, created, verdict FROM fact_verdicts WHERE created >= ? ORDER BY created DESC LIMIT ?",
+            (time.time() - self.ttl, self.max_size)
+        ).fetchall()
+        for key, created, verdict in reversed(rows):
+            try:
+                verdict = json.loads(verdict)
+            except json.JSONDecodeError:
+                continue
+            self._remember(key, created, verdict)
+            self._index(verdict['fact'], key)
+
+    def _remember(self, key, created, verdict):
+        self.memory[key] = (created, verdict)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_size:
+            self.memory.popitem(last=False) # Вытеснение самой старой по использованию записи
+
+    def _index(self, fact, key):
+        """Добавляет формулировку в индекс, если она там еще не записана под этим ключом"""
+        existing = self.index.query(fact, 1.0)
+        if existing is None or existing[1] != key: # Повторная запись того же факта не плодит копии в индексе
+            self.index.add(fact, key)
+
+    def _read(self, key):
+        return self.db.execute("SELECT created, verdict FROM fact_verdicts WHERE key = ?", (key,)).fetchone()
+
+    async def _lookup(self, key):
+        now = time.time()
+        entry = self.memory.get(key)
+        if entry and now - entry[0] < self.ttl:
+            self.memory.move_to_end(key)
+            return entry[1]
+        self.memory.pop(key, None)
+
+        if self.db is not None:
+            try:
+                async with self._read_lock:
+                    row = await asyncio.to_thread(self._read, key)
+                if row and now - row[0] < self.ttl:
+                    verdict = json.loads(row[1])
+                    self._remember(key, row[0], verdict)
+                    return verdict
+            except (sqlite3.Error, json.JSONDecodeError) as err:
+                logger.warning(f"Ошибка чтения кэша вердиктов: {err}")
+        return None
+
+    async def get(self, fact: str):
+        """Свежий вердикт для факта или его близкой формулировки с теми же числами, иначе None
+        (чтение с диска - в отдельном потоке)"""
+        verdict = await self._lookup(normalize_fact(fact))
+        if verdict is None:
+            similar = self.index.query(fact, self.similarity)
+            if similar:
+                verdict = await self._lookup(similar[1])
+                if verdict is not None and numbers_of(verdict['fact']) != numbers_of(fact):
+                    verdict = None
+                elif verdict is not None:
+                    self.similar_hits += 1
+        if verdict is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return verdict
+
+    def _store(self, fact: str, item: dict, sources: list):
+        """Запоминает вердикт в памяти и индексе; возвращает строку для диска или None"""
+        if not sources or is_error_result(sources) or item.get('source_confirmation', UNDEFINED) == UNDEFINED:
+            return None # Вердикт без источников или после ошибки не переносится на другие новости
+        key = normalize_fact(fact)
+        now = time.time()
+        verdict = {field: item[field] for field in VERDICT_FIELDS if field in item}
+        verdict.update(fact=fact, sources=sources, checked_at=now)
+        self._remember(key, now, verdict)
+        self._index(fact, key)
+        return key, now, json.dumps(verdict, ensure_ascii=False)
+
+    def _write(self, rows):
+        try:
+            self.writer.executemany(
+                "INSERT OR REPLACE INTO fact_verdicts (key, created, verdict) VALUES (?, ?, ?)", rows
+            )
+            self.writer.execute(
+                "DELETE FROM fact_verdicts WHERE created < ?", (time.time() - self.ttl,)
+            ) # Очистка устаревших
+            self.writer.commit()
+        except sqlite3.Error as err:
+            logger.warning(f"Ошибка записи кэша вердиктов: {err}")
+
+    async def _flush(self, rows):
+        """Записывает вердикты одной транзакцией в отдельном потоке"""
+        if rows and self.writer is not None:
+            async with self._write_lock:
+                await asyncio.to_thread(self._write, rows)
+
+    async def put(self, fact: str, item: dict, sources: list):
+        """Сохраняет вердикт модели вместе с источниками, на которых он основан"""
+        row = self._store(fact, item, sources)
+        await self._flush([row] if row else [])
+
+    async def remember(self, factcheck_results: dict, facts: list, fact_results: dict):
+        """Сохраняет вердикты ответа модели для фактов, которые она проверяла (на диск - одной транзакцией)"""
+        requested = {normalize_fact(fact): fact for fact in facts}
+        rows = []
+        for item in factcheck_results.get('factcheck_results', []):
+            if not isinstance(item, dict):
+                continue
+            fact = requested.get(normalize_fact(str(item.get('fact', ''))))
+            if fact is not None and (row := self._store(fact, item, fact_results.get(fact, []))):
+                rows.append(row)
+        await self._flush(rows)
+
+    def stats(self) -> dict:
+        """Счетчики попаданий и промахов"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'similar_hits': self.similar_hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'size': len(self.memory)
+        }
+
+def merge_verdicts(factcheck_results: dict, cached: dict) -> dict:
+    """Добавляет сохраненные вердикты {факт: вердикт} к результату проверки новых фактов;
+    общая оценка пересчитывается с учетом уверенности сохраненных вердиктов"""
+    if not cached:
+        return factcheck_results
+    checked = [item for item in factcheck_results.get('factcheck_results', []) if isinstance(item, dict)]
+    merged = dict(factcheck_results)
+    merged['factcheck_results'] = checked + [dict(
+        {field: verdict[field] for field in VERDICT_FIELDS if field in verdict},
+        fact=fact,
+        relevance_to_news='высокая', # В проверку попадают только релевантные факты
+        context_completeness='по предыдущей проверке',
+        cached=True
+    ) for fact, verdict in cached.items()]
+
+    scores = [verdict.get('confidence_score', 0) for verdict in cached.values()]
+    if checked:
+        try:
+            scores += [float(factcheck_results.get('overall_factcheck_score', 0))] * len(checked)
+        except (TypeError, ValueError):
+            pass
+    try:
+        merged['overall_factcheck_score'] = round(sum(float(score) for score in scores) / len(scores))
+    except (TypeError, ValueError):
+        pass
+    if not checked:
+        merged['overall_assessment'] = "Все факты уже проверялись в других новостях, использованы сохраненные вердикты"
+    merged['methodology_notes'] = (
+        f"{factcheck_results.get('methodology_notes', '')} "
+        f"Вердикты {len(cached)} фактов взяты из предыдущих проверок."
+    ).strip()
+    return merged
+
+# Глобальный экземпляр кэша вердиктов
+fact_verdicts = FactVerdictStore()
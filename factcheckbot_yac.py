@@ -2,32 +2,74 @@
 import logging # Для записи логов работы программы (помогает отслеживать ошибки и события)
 from telegram import Update # Базовый класс для обработки входящих сообщений
 from telegram.ext import Application, MessageHandler, filters, ContextTypes # Обработка событий в Telegram
-from telegram.helpers import escape_markdown # Экранирование текста для Telegram-сообщений
-import requests # HTTP-запросы к API
 import json # Работа с JSON-данными
-import ollama # Использование LLM (Large Language Model)
-from bs4 import BeautifulSoup # Парсинг HTML/XML документов
-from bs4 import XMLParsedAsHTMLWarning # Предупреждения от библиотеки BeautifulSoup
-import warnings # Управление предупреждениями
+from llm_gateway import llm_gateway # Общий асинхронный шлюз к LLM
+from yandex_client import yandex_client # Асинхронный клиент Yandex Search API
+from search_cache import search_cache # Кэш результатов поиска
+from fact_verdicts import fact_verdicts, merge_verdicts, numbers_of # Вердикты фактов, общие для разных новостей
+from report_cache import report_cache # Кэш готовых отчетов
+from similarity_index import similarity_index # Индекс похожих новостей
+from domain_reputation import domain_reputation # Таблица репутации доменов
+import request_stats # Счетчики вызовов в рамках одного сообщения
+from token_budget import compact_fact_results, estimate_tokens # Сжатие источников под бюджет токенов
+from evidence import render_evidence, render_assessment_data, source_ids, find_source # Компактный блок источников
+from progress import ThrottledMessageUpdater # Правки сообщения о ходе обработки
+from scheduler import analysis_scheduler, QueueFull # Очередь заданий анализа
+from broker import get_broker # Брокер заданий для процессов-обработчиков
+from rate_limiter import get_rate_limiter # Ограничение запросов пользователей
+from quotas import quota_engine, check_quota_backend, FULL_PLAN # Квоты по фактическому расходу и сокращенная проверка
+from load_shedding import load_shedder # Ступени упрощения анализа под нагрузкой
+from metrics import ( # Метрики этапов и эндпоинт /metrics
+    timed,
+    start_metrics_server,
+    ANALYSIS_SECONDS,
+    REQUESTS_IN_FLIGHT,
+    MESSAGES_TOTAL,
+    CACHE_HIT_RATIO,
+    ANALYSIS_QUEUE_DEPTH,
+    ANALYSIS_RUNNING,
+    STAGE_SECONDS,
+    COLD_START_SECONDS,
+    ANALYSIS_MODE
+)
+from yandex_parser import parse_search_response # Потоковый разбор ответов Yandex Search API
+from query_planner import plan_queries, fuse_results # Короткие запросы по факту и объединение результатов
 import asyncio # Асинхронная обработка запросов
-from urllib.parse import urlparse # Парсинг URL
+import signal # Остановка по SIGTERM/SIGINT с ожиданием анализов
+from xml.sax.saxutils import escape as xml_escape # Экранирование запроса в XML
 import time # Временные задержки и измерение времени
-from random import uniform # Генерация случайных чисел для избежания флуда
+import math # Округление времени до снятия ограничения
 import re # Регулярные выражения
-from collections import defaultdict # Для работы с пользовательскими ограничениями
-from datetime import datetime, timedelta # Работа с датой и временем
 
 # Конфигурация (заполнить своими данными)
 from config import (
     TELEGRAM_TOKEN, 
-    YANDEX_USER,
-    YANDEX_API_KEY,
-    YANDEX_FOLDER_ID,
-    YANDEX_SEARCH_URL
+    YANDEX_MAX_RETRIES,
+    LLM_PULL_ON_START,
+    SIMILARITY_REUSE_THRESHOLD,
+    SIMILARITY_PARTIAL_THRESHOLD,
+    SOURCES_QUALITY_BATCH,
+    LLM_EVIDENCE_BUDGET,
+    FACT_RELEVANCE_MODE,
+    METRICS_HOST,
+    METRICS_PORT,
+    ANALYSIS_QUEUE_SIZE,
+    BOT_MODE,
+    BROKER,
+    WORKER_CONCURRENCY,
+    TELEGRAM_WEBHOOK_URL,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PORT,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    DRAIN_TIMEOUT,
+    BROKER_HEARTBEAT,
+    FLOOD_MAX_REQUESTS,
+    FLOOD_PERIOD,
+    SHED_UNKNOWN_DOMAIN_SCORE
 ) # Конфигурационные параметры для Telegram и Yandex Search API
 
-# Инициализация Ollama
-ollama.pull('yandex/YandexGPT-5-Lite-8B-instruct-GGUF') # Загрузка модели LLM для анализа фактов
+STARTED_AT = time.monotonic() # Момент запуска процесса для замера холодного старта
 
 # Настройка логирования
 logging.basicConfig(
@@ -36,45 +78,8 @@ logging.basicConfig(
 ) # Форматирование и уровень логов для отслеживания работы программы
 logger = logging.getLogger(__name__) # Логгер для текущего модуля
 
-# Отключаем предупреждения XMLParsedAsHTMLWarning
-warnings.filterwarnings('ignore', category=XMLParsedAsHTMLWarning) # Игнорирование предупреждений при парсинге HTML
-
-# Класс для контроля флуда
-class FloodControl:
-    def __init__(self, max_requests_per_hour=15):
-        self.max_requests = max_requests_per_hour
-        self.user_requests = defaultdict(list)  # {user_id: [timestamp1, timestamp2, ...]}
-    
-    def check_user(self, user_id):
-        """Проверяет, может ли пользователь сделать запрос"""
-        now = datetime.now()
-        user_requests = self.user_requests[user_id]
-        
-        # Очищаем старые запросы (старше часа)
-        user_requests[:] = [req_time for req_time in user_requests 
-                           if now - req_time < timedelta(hours=1)]
-        
-        # Проверяем лимит
-        if len(user_requests) >= self.max_requests:
-            return False
-        
-        # Добавляем текущий запрос
-        user_requests.append(now)
-        return True
-    
-    def get_remaining_requests(self, user_id):
-        """Возвращает количество оставшихся запросов"""
-        now = datetime.now()
-        user_requests = self.user_requests[user_id]
-        
-        # Очищаем старые запросы
-        user_requests[:] = [req_time for req_time in user_requests 
-                           if now - req_time < timedelta(hours=1)]
-        
-        return max(0, self.max_requests - len(user_requests))
-
 # Глобальный экземпляр контроля флуда
-flood_control = FloodControl(max_requests_per_hour=15)
+flood_control = get_rate_limiter()
 
 def handle_api_error(code: str, message: str) -> list:
     """Обработка специфичных ошибок API"""
@@ -91,10 +96,48 @@ def handle_api_error(code: str, message: str) -> list:
         'snippet': f'Код {code}: {message}'
     }] # Возвращаем список с ошибкой и ссылкой на документацию
 
+# Общее начало промптов всех этапов. Ollama переиспользует кэш KV для совпадающего префикса промпта,
+# поэтому неизменная часть и текст новости идут первыми, а инструкции этапа - после них
+SYSTEM_PROMPT = (
+    "Ты - ассистент фактчекинга. Ты анализируешь новости на русском языке, сопоставляешь их с найденными "
+    "источниками и отвечаешь строго в формате, который указан в задании."
+)
+
+def news_system_prompt(text: str) -> str:
+    """Системная часть промпта с текстом новости: одинакова для всех этапов анализа одного сообщения"""
+    if not text:
+        return SYSTEM_PROMPT
+    truncated_text = text[:3000] + ("..." if len(text) > 3000 else "") # Обрезка длинного текста
+    return f"{SYSTEM_PROMPT}\n\nТекст новости:\n{truncated_text}"
+
+def prompt_fact_results(fact_results: dict) -> dict:
+    """Источники в том виде, в каком они попадают в промпты: сжатые под бюджет, одинаково для всех этапов"""
+    return compact_fact_results(
+        fact_results, LLM_EVIDENCE_BUDGET, measure=lambda results: estimate_tokens(render_evidence(results))
+    )
+
+def evidence_system_prompt(text: str, fact_results: dict) -> str:
+    """Системная часть этапов после поиска: текст новости и все найденные источники в неизменном порядке"""
+    return f"{news_system_prompt(text)}\n\n{render_evidence(prompt_fact_results(fact_results))}"
+
+@timed('extraction')
 async def analyze_facts(text: str) -> dict:
     """Извлечение проверяемых фактов из текста с максимальным контекстом"""
+    if FACT_RELEVANCE_MODE == 'extract': # Релевантность определяется сразу при извлечении
+        format_block = """8. Для каждого факта укажи, относится ли он НЕПОСРЕДСТВЕННО к основной теме новости (relevant: true) или это побочная/контекстная информация (relevant: false)
+
+Верни ТОЛЬКО JSON без пояснений:
+{
+    "facts": [{"fact": "полный факт 1 с максимальным контекстом", "relevant": true}, {"fact": "полный факт 2 с максимальным контекстом", "relevant": false}, ...]
+}"""
+    else:
+        format_block = """Верни ТОЛЬКО JSON без пояснений:
+{
+    "facts": ["полный факт 1 с максимальным контекстом", "полный факт 2 с максимальным контекстом", ...]
+}"""
+    
     prompt = f"""
-Проанализируй новостной текст и выдели из него проверяемые факты для дальнейшей верификации.
+Проанализируй текст новости и выдели из него проверяемые факты для дальнейшей верификации.
 ТОЛЬКО факты, которые НЕПОСРЕДСТВЕННО относятся к основной теме новости.
 
 ТРЕБОВАНИЯ К ФАКТАМ:
@@ -129,41 +172,49 @@ async def analyze_facts(text: str) -> dict:
 "15 ноября 2024 года в 11:27 по московскому времени произошло землетрясение магнитудой 4.2 балла в районе водопада Учан-Су в Крыму, по данным замдиректора Института сейсмологии и геодинамики Марины Бондарь"
 "Эпицентр землетрясения 15 ноября 2024 года находился на глубине 10 километров под землёй в районе водопада Учан-Су в Крыму, согласно данным сейсмологической службы"
 
-Верни ТОЛЬКО JSON без пояснений:
-{{
-    "facts": ["полный факт 1 с максимальным контекстом", "полный факт 2 с максимальным контекстом", ...]
-}}
-
-Текст: {text[:2500]}
+{format_block}
 """
     logger.info(f"LLM Fact Extraction: {text[:350]!r}") # Логирование входного запроса
     try:
-        resp = ollama.generate(
-            model='yandex/YandexGPT-5-Lite-8B-instruct-GGUF',
+        resp = await llm_gateway.generate(
+            system=news_system_prompt(text), # Текст новости - в общем префиксе
             prompt=prompt,
+            stage='extraction',
             format='json',
-            options={'temperature': 0.1, 'num_ctx': 16384}
+            options={'temperature': 0.1}
         ) # Вызов LLM с настройками
         raw = resp['response'].strip().replace('```json', '').replace('```', '') # Удаление лишних символов JSON
         try:
-            return json.loads(raw) # Парсинг JSON-ответа
+            result = json.loads(raw) # Парсинг JSON-ответа
         except json.JSONDecodeError:
             import json_repair # Использование библиотеки для исправления JSON
-            return json.loads(json_repair.repair_json(raw)) # Попытка исправить JSON
+            result = json.loads(json_repair.repair_json(raw)) # Попытка исправить JSON
+        if FACT_RELEVANCE_MODE == 'extract':
+            return split_relevant_facts(result)
+        return result
     except Exception as err:
         logger.error(f"Ошибка analyze_facts: {err}") # Логирование ошибок
         return {"facts": []} # Возврат пустого списка фактов при ошибках
 
-async def yandex_factcheck(fact: str) -> list:
-    """Поиск подтверждающих источников через Yandex Search API"""
-    try:
-        original_fact = fact
-        logger.info(f"Поиск источников для факта: '{original_fact}'") # Логирование исходного факта
-        
-        # Формируем XML запрос согласно документации
-        request_xml = f"""<?xml version="1.0" encoding="UTF-8"?>
+def split_relevant_facts(result: dict) -> dict:
+    """Разделяет размеченные факты на релевантные и побочные"""
+    relevant, irrelevant = [], []
+    for item in result.get('facts', []):
+        if isinstance(item, str): # Модель вернула факт без разметки: считаем релевантным
+            relevant.append(item)
+        elif isinstance(item, dict) and item.get('fact'):
+            is_relevant = item.get('relevant', True) not in (False, 'false', 'нет')
+            (relevant if is_relevant else irrelevant).append(item['fact'])
+    if irrelevant:
+        logger.info(f"Исключено нерелевантных фактов до поиска: {len(irrelevant)}")
+    return {"facts": relevant, "irrelevant_facts": irrelevant}
+
+async def search_query(query: str):
+    """Один запрос к Yandex Search API: (ошибка {'code', 'text'} или None, найденные документы)"""
+    # Формируем XML запрос согласно документации
+    request_xml = f"""<?xml version="1.0" encoding="UTF-8"?>
         <request>
-            <query>{original_fact}</query>
+            <query>{xml_escape(query)}</query>
             <page>0</page>
             <sortby order="descending">rlv</sortby>
             <maxpassages>3</maxpassages>
@@ -172,65 +223,94 @@ async def yandex_factcheck(fact: str) -> list:
             </groupings>
         </request>
         """
-        
-        # Актуальные параметры аутентификации
-        params = {
-            'folderid': YANDEX_FOLDER_ID,  # Идентификатор каталога
-            'apikey': YANDEX_API_KEY,      # API-ключ сервисного аккаунта
-            'type': 'xml'                  # Формат ответа
-        }
-        
-        headers = {
-            'Content-Type': 'application/xml',
-            'Accept': 'application/xml'
-        }
-
-        # Используем актуальный API endpoint
-        api_url = 'https://yandex.ru/search/xml' # URL для запросов
-        
-        logger.info(f"Отправляем запрос к Yandex Search API: {original_fact[:150]}...") # Логирование отправки запроса
-        await asyncio.sleep(uniform(0.7, 1.2)) # Рандомная задержка для избежания флуда
-        
-        response = requests.post(
-            api_url,
-            params=params,
-            data=request_xml.encode('utf-8'),
-            headers=headers,
-            timeout=15
-        ) # Отправка запроса к API
-        
-        response.raise_for_status() # Проверка на ошибки HTTP
+    
+    logger.info(f"Отправляем запрос к Yandex Search API: {query[:150]}") # Логирование отправки запроса
+    
+    for attempt in range(YANDEX_MAX_RETRIES + 1):
+        try:
+            body = await yandex_client.search(request_xml) # Запрос через общий пул соединений с ограничением RPS
+        except Exception: # Неудачная попытка уже учтена в расходе пользователя - учитываем и в общей квоте
+            await quota_engine.charge_search()
+            raise
+        await quota_engine.charge_search() # Общая квота аккаунта
         
         # Обработка ответа
-        xml_soup = BeautifulSoup(response.text, 'xml') # Парсинг XML
+        error, docs = parse_search_response(body) # Потоковый разбор байтов ответа
+        yandex_client.report(error['code'] if error else None) # Адаптация ограничителя
+        if error and error['code'] == '32':
+            await quota_engine.report_quota_exceeded() # Следующие анализы - в сокращенном режиме
+        if error and error['code'] == '55' and attempt < YANDEX_MAX_RETRIES:
+            logger.warning(f"RPS-ограничение, повтор запроса ({attempt + 1}/{YANDEX_MAX_RETRIES})")
+            continue
+        break
+    
+    if error:
+        logger.error(f"Ошибка API (код {error['code']}): {error['text']}") # Логирование ошибок API
+        return error, []
+    
+    # Извлечение результатов
+    results = []
+    for doc in docs:
+        if not doc['url']:
+            logger.warning("Ошибка обработки документа: нет URL") # Документ без ссылки пропускается
+            continue
+        results.append({
+            'title': (doc['title'] if doc['title'] is not None else "Без заголовка")[:250],
+            'url': doc['url'],
+            'snippet': ' '.join(doc['passages'])[:500]  # Размер отрывка
+        })
+    return None, results
+
+@timed('search')
+async def yandex_factcheck(fact: str, cached_only: bool = False) -> list:
+    """Поиск подтверждающих источников через Yandex Search API (cached_only - только из кэша, без запроса):
+    несколько коротких запросов по факту, результаты объединяются по URL"""
+    try:
+        original_fact = fact
+        logger.info(f"Поиск источников для факта: '{original_fact}'") # Логирование исходного факта
         
-        # Обработка ошибок API
-        if error := xml_soup.find('error'):
-            error_code = error.get('code', 'unknown')
-            logger.error(f"Ошибка API (код {error_code}): {error.text}") # Логирование ошибок API
-            return handle_api_error(error_code, error.text) # Возврат обработанной ошибки
+        cached = await search_cache.get(original_fact) # Проверка кэша по нормализованному факту
+        if cached is not None:
+            logger.info(f"Результаты поиска взяты из кэша: {search_cache.stats()}")
+            return cached
+        if cached_only: # Квота поиска на исходе: новых запросов к Yandex не делаем
+            return [{
+                'title': 'Поиск отложен',
+                'url': '',
+                'snippet': 'Квота поиска почти исчерпана, источники для этого факта не искались'
+            }]
         
-        # Извлечение результатов
-        results = []
-        for doc in xml_soup.find_all('doc'):
-            try:
-                url = doc.find('url').text.strip()
-                title = doc.find('title').text.strip() if doc.find('title') else "Без заголовка"
-                snippet = ' '.join([p.text for p in doc.find_all('passage')][:3]) # Больше отрывков
+        queries = plan_queries(original_fact) # Сущности, числа и ключевые слова вместо всего предложения
+        responses = await asyncio.gather(
+            *(search_query(query) for query in queries), return_exceptions=True
+        ) # В пределах RPS; сбой одного запроса не отменяет остальные
+        failures = [response for response in responses if isinstance(response, BaseException)]
+        for failure in failures:
+            logger.error(f"Ошибка запроса по факту: {failure!r}", exc_info=failure)
+        responses = [response for response in responses if not isinstance(response, BaseException)]
+        found = [results for error, results in responses if error is None]
+        errors = [error for error, _ in responses if error is not None]
         
-                results.append({
-                    'title': title[:250],
-                    'url': url,
-                    'snippet': snippet[:500]  # Размер отрывка
-                })
-            except Exception as doc_err:
-                logger.warning(f"Ошибка обработки документа: {doc_err}") # Логирование ошибок при обработке документов
-
-        return results if results else [{
+        # Обработка ошибок: все запросы факта завершились ошибкой
+        if not found:
+            if not errors:
+                raise failures[0]
+            return handle_api_error(errors[0]['code'], errors[0]['text']) # Возврат обработанной ошибки
+        
+        results = fuse_results(found) # Reciprocal rank fusion по URL и удаление повторяющихся отрывков
+        logger.info(
+            f"Запросов по факту: {len(queries)}, ошибок: {len(errors) + len(failures)}, "
+            f"документов: {sum(map(len, found))} -> источников: {len(results)}"
+        )
+
+        results = results if results else [{
             'title': 'Информация не найдена',
             'url': '',
             'snippet': f'По запросу "{original_fact}" ничего не найдено'
-        }] # Возврат результата или сообщения о неудаче
+        }] # Результат или сообщение о неудаче
+        if not errors and not failures: # Ответы об ошибках и неполные результаты в кэш не попадают
+            await search_cache.put(original_fact, results)
+        return results
         
     except Exception as err:
         logger.error(f"Критическая ошибка: {err}", exc_info=True) # Логирование критических ошибок
@@ -242,9 +322,7 @@ async def yandex_factcheck(fact: str) -> list:
 
 async def analyze_news_text(text: str) -> dict:
     """Анализ текста новости на предмет достоверности и качества"""
-    truncated_text = text[:3000] + ("..." if len(text) > 3000 else "") # Обрезка длинного текста
-    
-    prompt = f"""
+    prompt = """
 Проанализируй текст новости по внутренним признакам достоверности и качества журналистики:
 
 КРИТЕРИИ АНАЛИЗА:
@@ -281,7 +359,7 @@ async def analyze_news_text(text: str) -> dict:
    - Отсутствие контекста
 
 Верни результат в JSON:
-{{
+{
   "credibility_score": число от 0 до 100,
   "style_analysis": "оценка стиля и языка",
   "logical_consistency": "оценка внутренней логики",
@@ -292,16 +370,15 @@ async def analyze_news_text(text: str) -> dict:
   "strong_points": ["список сильных сторон текста"],
   "weak_points": ["список слабых мест"],
   "overall_conclusion": "общий вывод о качестве и надежности"
-}}
-
-Текст новости: {truncated_text}
+}
 """
     try:
-        resp = ollama.generate(
-            model='yandex/YandexGPT-5-Lite-8B-instruct-GGUF',
+        resp = await llm_gateway.generate(
+            system=news_system_prompt(text),
             prompt=prompt,
+            stage='text_analysis',
             format='json',
-            options={'temperature': 0.1, 'num_ctx': 16384}
+            options={'temperature': 0.1}
         )
         
         raw = resp['response'].strip().replace('```json', '').replace('```', '')
@@ -344,24 +421,34 @@ def is_meaningful_text(text: str) -> bool:
         any(c.isalpha() for c in clean_text) # Наличие букв
     )
 
-async def perform_factchecking(user_text, facts, fact_results):
-    """Проверка соответствия фактов источникам с фильтрацией нерелевантных фактов"""
+@timed('factcheck')
+async def perform_factchecking(user_text, facts, fact_results, prefiltered=False, verdicts=None):
+    """Проверка соответствия фактов источникам с фильтрацией нерелевантных фактов;
+    факты со свежим вердиктом из verdicts ({факт: вердикт}) модели не передаются"""
     
-    # Сначала фильтруем факты на релевантность к новости
-    relevant_facts = await filter_relevant_facts(user_text, facts)
+    # Сначала фильтруем факты на релевантность к новости (если это не сделано при извлечении)
+    relevant_facts = facts if prefiltered else await filter_relevant_facts(user_text, facts)
     
-    # Подготовка данных для анализа только релевантных фактов
-    factcheck_data = {
-        "original_text": user_text[:3000],
-        "relevant_facts": relevant_facts,
-        "sources_data": {fact: fact_results[fact] for fact in relevant_facts if fact in fact_results}
-    }
+    verdicts = verdicts or {}
+    cached = {fact: verdicts[fact] for fact in relevant_facts if fact in verdicts}
+    new_facts = [fact for fact in relevant_facts if fact not in cached]
+    if cached:
+        logger.info(f"Вердикты взяты из кэша для {len(cached)} из {len(relevant_facts)} фактов")
+    if cached and not new_facts:
+        return merge_verdicts({"factcheck_results": []}, cached) # Модель проверять нечего
     
-    data_str = json.dumps(factcheck_data, ensure_ascii=False)
+    factcheck_results = await check_facts(user_text, new_facts, fact_results)
+    await fact_verdicts.remember(factcheck_results, new_facts, fact_results)
+    return merge_verdicts(factcheck_results, cached)
+
+async def check_facts(user_text, relevant_facts, fact_results):
+    """Проверка фактов моделью по источникам из системной части промпта"""
+    # Текст новости и источники передаются в системной части промпта, здесь - только факты для проверки
+    data_str = json.dumps({"relevant_facts": relevant_facts}, ensure_ascii=False)
     
     prompt = f"""
 Выполни проверку фактов между текстом новости и найденными источниками.
-АНАЛИЗИРУЙ ТОЛЬКО ФАКТЫ, КОТОРЫЕ НЕПОСРЕДСТВЕННО ОТНОСЯТСЯ К ОСНОВНОЙ ТЕМЕ НОВОСТИ.
+АНАЛИЗИРУЙ ТОЛЬКО ФАКТЫ ИЗ СПИСКА relevant_facts: ОНИ НЕПОСРЕДСТВЕННО ОТНОСЯТСЯ К ОСНОВНОЙ ТЕМЕ НОВОСТИ.
 
 Для каждого релевантного факта проведи многоуровневую проверку:
 
@@ -412,11 +499,12 @@ async def perform_factchecking(user_text, facts, fact_results):
 """
     
     try:
-        resp = ollama.generate(
-            model='yandex/YandexGPT-5-Lite-8B-instruct-GGUF',
+        resp = await llm_gateway.generate(
+            system=evidence_system_prompt(user_text, fact_results),
             prompt=prompt,
+            stage='factcheck',
             format='json',
-            options={'temperature': 0.05, 'num_ctx': 16384}  # Снижена температура для большей точности
+            options={'temperature': 0.05}  # Снижена температура для большей точности
         )
         
         raw = resp['response'].strip().replace('```json', '').replace('```', '')
@@ -448,6 +536,7 @@ async def perform_factchecking(user_text, facts, fact_results):
             "methodology_notes": "Проверка была прервана из-за технической ошибки"
         }
 
+@timed('relevance_filter')
 async def filter_relevant_facts(text: str, facts: list) -> list:
     """Фильтрует факты, оставляя только те, которые относятся к основной теме новости"""
     
@@ -464,8 +553,6 @@ async def filter_relevant_facts(text: str, facts: list) -> list:
 - Содержат ключевую информацию для понимания сути новости
 - Являются проверяемыми утверждениями о конкретных фактах
 
-Текст новости: {text[:1000]}
-
 Факты для фильтрации:
 {json.dumps(facts, ensure_ascii=False)}
 
@@ -476,11 +563,12 @@ async def filter_relevant_facts(text: str, facts: list) -> list:
 """
     
     try:
-        resp = ollama.generate(
-            model='yandex/YandexGPT-5-Lite-8B-instruct-GGUF',
+        resp = await llm_gateway.generate(
+            system=news_system_prompt(text),
             prompt=prompt,
+            stage='relevance_filter',
             format='json',
-            options={'temperature': 0.1, 'num_ctx': 16384}
+            options={'temperature': 0.1}
         )
         
         raw = resp['response'].strip().replace('```json', '').replace('```', '')
@@ -496,39 +584,28 @@ async def filter_relevant_facts(text: str, facts: list) -> list:
         logger.error(f"Ошибка filter_relevant_facts: {err}")
         return facts  # Возвращаем исходные факты при ошибке
 
-async def evaluate_sources_quality(fact_results: dict) -> dict:
-    """Оценивает качество и надежность найденных источников с подсчетом"""
-    sources_assessment = {}
-    
-    for fact, sources in fact_results.items():
-        source_count = len(sources) if sources else 0
-        
-        if not sources:
-            sources_assessment[fact] = {
-                "reliability_score": 0,
-                "sources_count": 0,
-                "authoritative_sources": False,
-                "consensus": "Нет данных",
-                "summary": "Источники не найдены",
-                "top_source": None
-            }
-            continue
-        
-        # Собираем данные для оценки качества источников
-        sources_data = []
-        for src in sources:
-            url = src.get('url', '')
-            title = src.get('title', '')
-            snippet = src.get('snippet', '')
-            
-            sources_data.append({
-                'url': url,
-                'title': title,
-                'snippet': snippet[:250]
-            })
-        
-        # Оцениваем качество источников с помощью LLM
-        prompt = f"""
+def _sources_data(sources: list) -> list:
+    """Сокращенные данные источников для оценки моделью"""
+    return [{
+        'url': src.get('url', ''),
+        'title': src.get('title', ''),
+        'snippet': src.get('snippet', '')[:250]
+    } for src in sources]
+
+def _attach_top_source(assessment: dict, sources: list) -> dict:
+    """Добавляет информацию о лучшем источнике по индексу из ответа модели"""
+    top_index = assessment.get('top_source_index', 0)
+    if isinstance(top_index, int) and 0 <= top_index < len(sources):
+        assessment['top_source'] = sources[top_index]
+    else:
+        assessment['top_source'] = sources[0] if sources else None
+    return assessment
+
+def fact_sources_prompt(fact: str, sources: list) -> str:
+    """Промпт оценки источников одного факта"""
+    source_count = len(sources)
+    sources_data = _sources_data(sources)
+    return f"""
 Оцени качество и надежность источников для проверки факта: "{fact}"
 
 Количество найденных источников: {source_count}
@@ -547,64 +624,177 @@ async def evaluate_sources_quality(fact_results: dict) -> dict:
   "source_diversity": "оценка разнообразия типов источников"
 }}
 """
+
+async def evaluate_fact_sources(fact: str, sources: list) -> dict:
+    """Оценивает качество источников одного факта отдельным вызовом LLM"""
+    source_count = len(sources)
+    prompt = fact_sources_prompt(fact, sources) # Оцениваем качество источников с помощью LLM
+    try:
+        resp = await llm_gateway.generate(
+            system=SYSTEM_PROMPT, # Текст новости этому этапу не нужен
+            prompt=prompt,
+            stage='sources_quality',
+            format='json',
+            options={'temperature': 0.1}
+        )
+        
+        raw = resp['response'].strip().replace('```json', '').replace('```', '')
         try:
-            resp = ollama.generate(
-                model='yandex/YandexGPT-5-Lite-8B-instruct-GGUF',
-                prompt=prompt,
-                format='json',
-                options={'temperature': 0.1, 'num_ctx': 16384}
+            assessment = json.loads(raw)
+        except json.JSONDecodeError:
+            import json_repair
+            assessment = json.loads(json_repair.repair_json(raw))
+        
+        return _attach_top_source(assessment, sources) # Сохранение оценки
+    except Exception as err:
+        logger.error(f"Ошибка evaluate_sources_quality: {err}") # Логирование ошибок
+        return {
+            "reliability_score": 30,
+            "sources_count": source_count,
+            "authoritative_sources": False,
+            "consensus": "Не удалось определить",
+            "summary": "Возникла ошибка при оценке качества источников",
+            "top_source": sources[0] if sources else None,
+            "source_diversity": "Не определено"
+        } # Возврат стандартного ответа при ошибке
+
+async def evaluate_sources_batch(fact_results: dict, pending: list, text: str = None):
+    """Оценивает источники фактов pending одним вызовом LLM; возвращает оценки, которые удалось разобрать,
+    и ответ модели (None при ошибке) для оценки выигрыша по времени"""
+    facts = list(fact_results) # Индексы фактов - как в общем блоке источников (fact_index N - факт FN)
+    ids = source_ids(prompt_fact_results(fact_results))
+    batch_data = [{
+        'fact_index': i,
+        'sources_count': len(fact_results[fact])
+    } for i, fact in enumerate(facts) if fact in pending]
+    
+    prompt = f"""
+Оцени качество и надежность источников для проверки каждого из фактов.
+Для каждого факта оценивай только его собственный список источников (строка "источники" под фактом FN, где N - fact_index).
+
+Факты для оценки:
+{json.dumps(batch_data, ensure_ascii=False)}
+
+Верни оценку в формате JSON, по одному элементу на каждый fact_index:
+{{
+  "assessments": [
+    {{
+      "fact_index": индекс факта из данных,
+      "reliability_score": число от 0 до 100,
+      "sources_count": число источников факта,
+      "authoritative_sources": true/false - есть ли авторитетные СМИ/организации,
+      "consensus": "согласуются ли источники между собой",
+      "summary": "краткий вывод о качестве источников",
+      "top_source_id": "id самого надежного источника из списка факта, например S3",
+      "source_diversity": "оценка разнообразия типов источников"
+    }}
+  ]
+}}
+"""
+    try:
+        resp = await llm_gateway.generate(
+            system=evidence_system_prompt(text, fact_results), # Общий префикс с проверкой фактов и итоговой оценкой
+            prompt=prompt,
+            stage='sources_quality',
+            format='json',
+            options={'temperature': 0.1}
+        )
+        
+        raw = resp['response'].strip().replace('```json', '').replace('```', '')
+        try:
+            result = json.loads(raw)
+        except json.JSONDecodeError:
+            import json_repair
+            result = json.loads(json_repair.repair_json(raw))
+    except Exception as err:
+        logger.error(f"Ошибка пакетной оценки источников: {err}") # Логирование ошибок
+        return {}, None
+    
+    assessments = {}
+    for item in result.get('assessments', []) if isinstance(result, dict) else []:
+        index = item.get('fact_index') if isinstance(item, dict) else None
+        if isinstance(index, int) and 0 <= index < len(facts) and facts[index] in pending \
+                and facts[index] not in assessments:
+            item.pop('fact_index')
+            sources = fact_results[facts[index]]
+            top_source = find_source(sources, ids, item.pop('top_source_id', ''))
+            assessments[facts[index]] = (
+                dict(item, top_source=top_source) if top_source else _attach_top_source(item, sources)
             )
-            
-            raw = resp['response'].strip().replace('```json', '').replace('```', '')
-            try:
-                assessment = json.loads(raw)
-            except json.JSONDecodeError:
-                import json_repair
-                assessment = json.loads(json_repair.repair_json(raw))
-            
-            # Добавляем информацию о лучшем источнике
-            top_index = assessment.get('top_source_index', 0)
-            if 0 <= top_index < len(sources):
-                assessment['top_source'] = sources[top_index]
-            else:
-                assessment['top_source'] = sources[0] if sources else None
-                
-            sources_assessment[fact] = assessment # Сохранение оценки
-        except Exception as err:
-            logger.error(f"Ошибка evaluate_sources_quality: {err}") # Логирование ошибок
+    return assessments, resp
+
+def estimate_per_fact_seconds(resp, batch_seconds: float, pending: dict) -> float:
+    """Время пофактового режима по замерам пакетного вызова: для каждого факта - свой вызов с обработкой
+    его промпта, ответом на один факт и теми же накладными расходами вызова (очередь, загрузка, сеть)"""
+    prompt_tokens = resp.get('prompt_eval_count') or 0
+    prompt_seconds = (resp.get('prompt_eval_duration') or 0) / 1e9 # Ollama отдает наносекунды
+    answer_seconds = (resp.get('eval_duration') or 0) / 1e9
+    per_prompt_token = prompt_seconds / prompt_tokens if prompt_tokens else 0.0
+    overhead = max(0.0, batch_seconds - prompt_seconds - answer_seconds)
+    answer = answer_seconds / len(pending) # Ответ пакета - по одной оценке на факт
+    return sum(
+        estimate_tokens(fact_sources_prompt(fact, sources)) * per_prompt_token + answer + overhead
+        for fact, sources in pending.items()
+    )
+
+@timed('sources_quality')
+async def evaluate_sources_quality(fact_results: dict, text: str = None, unknown_score: int = None) -> dict:
+    """Оценивает качество и надежность найденных источников с подсчетом;
+    unknown_score - оценить все источники по таблице репутации без LLM, неизвестным доменам дается эта оценка"""
+    sources_assessment = {}
+    
+    for fact, sources in fact_results.items():
+        if not sources:
             sources_assessment[fact] = {
-                "reliability_score": 30,
-                "sources_count": source_count,
+                "reliability_score": 0,
+                "sources_count": 0,
                 "authoritative_sources": False,
-                "consensus": "Не удалось определить",
-                "summary": "Возникла ошибка при оценке качества источников",
-                "top_source": sources[0] if sources else None,
-                "source_diversity": "Не определено"
-            } # Возврат стандартного ответа при ошибке
+                "consensus": "Нет данных",
+                "summary": "Источники не найдены",
+                "top_source": None
+            }
+        elif (assessment := domain_reputation.assess(sources, unknown_score)) is not None:
+            sources_assessment[fact] = assessment # Все домены известны: LLM не нужна
     
-    return sources_assessment
-
-async def generate_comprehensive_assessment(text_analysis, facts, fact_results, sources_quality, factcheck_results):
-    """Создает комплексную оценку с учетом всех компонентов анализа"""
+    pending = {fact: sources for fact, sources in fact_results.items() if fact not in sources_assessment}
+    logger.info(f"Оценка источников по таблице репутации: {len(fact_results) - len(pending)}/{len(fact_results)} фактов")
+    if not pending:
+        return sources_assessment
     
-    # Подсчитываем общую статистику источников
-    total_sources = sum(len(sources) for sources in fact_results.values())
-    facts_with_sources = sum(1 for sources in fact_results.values() if sources)
+    started = time.perf_counter()
+    if SOURCES_QUALITY_BATCH and len(pending) > 1:
+        batch, resp = await evaluate_sources_batch(fact_results, list(pending), text)
+        sources_assessment.update(batch)
+        batch_seconds = time.perf_counter() - started
+        estimate = (
+            f", пофактовый режим: ~{estimate_per_fact_seconds(resp, batch_seconds, pending):.1f} с (оценка)"
+            if resp is not None else ""
+        )
+        logger.info(
+            f"Пакетная оценка источников: {len(batch)}/{len(pending)} фактов за {batch_seconds:.1f} с{estimate}"
+        ) # Логирование выигрыша по времени
+        pending = {fact: sources for fact, sources in pending.items() if fact not in batch}
+        if pending:
+            logger.warning(f"Пакетная оценка не разобрана для {len(pending)} фактов, оцениваем по одному")
     
-    data = {
-        "text_analysis": text_analysis,
-        "facts": facts,
-        "fact_results": fact_results,
-        "sources_quality": sources_quality, 
-        "factcheck_results": factcheck_results,
-        "sources_statistics": {
-            "total_sources_found": total_sources,
-            "facts_with_sources": facts_with_sources,
-            "total_facts_checked": len(facts)
-        }
-    }
+    for fact, sources in pending.items(): # Пофактовый режим и запасной путь при сбое пакетной оценки
+        sources_assessment[fact] = await evaluate_fact_sources(fact, sources)
+    
+    return {fact: sources_assessment[fact] for fact in fact_results} # Исходный порядок фактов
+
+ASSESSMENT_FAILED = "Не удалось сформировать комплексную оценку." # Ответ при ошибке итоговой оценки
+
+@timed('assessment')
+async def generate_comprehensive_assessment(text_analysis, facts, fact_results, sources_quality, factcheck_results,
+                                            on_partial=None, text=None):
+    """Создает комплексную оценку с учетом всех компонентов анализа (on_partial получает текст по мере генерации)"""
+    system = evidence_system_prompt(text, fact_results) # Текст новости и источники уже в кэше сервера
     
-    data_str = json.dumps(data, ensure_ascii=False)
+    # Факты и источники - ссылками на блок источников в системной части, остальное - строками без JSON
+    data_str = render_assessment_data(
+        text_analysis, prompt_fact_results(fact_results), sources_quality, factcheck_results,
+        total_sources=sum(len(sources) for sources in fact_results.values())
+    )
     prompt = f"""
 Создай комплексную оценку достоверности новости на основе всех доступных данных.
 НЕ используй markdown-форматирование, символы *, **, ##, [], (), ~, `, >, #, +, -, =, |.
@@ -638,39 +828,265 @@ async def generate_comprehensive_assessment(text_analysis, facts, fact_results,
 
 💭 ИТОГОВОЕ ЗАКЛЮЧЕНИЕ: [финальный вывод о надежности]
 
-Данные: {data_str}
+Результаты этапов анализа (FN - факты, SN - источники из системной части):
+{data_str}
 """
     try:
-        resp = ollama.generate(
-            model='yandex/YandexGPT-5-Lite-8B-instruct-GGUF',
-            prompt=prompt,
-            options={'temperature': 0.1, 'num_ctx': 16384}
-        )
-        return remove_thinking_tags(resp['response']) # Удаление маркеров мышления
+        if on_partial is None:
+            resp = await llm_gateway.generate(
+                system=system,
+                prompt=prompt,
+                stage='assessment',
+                options={'temperature': 0.1}
+            )
+            return remove_thinking_tags(resp['response']) # Удаление маркеров мышления
+        
+        response = ''
+        async for chunk in llm_gateway.stream(
+            system=system, prompt=prompt, stage='assessment', options={'temperature': 0.1}
+        ):
+            response += chunk['response']
+            partial = remove_thinking_tags(response).split('<think>')[0].strip() # Незакрытое рассуждение не показываем
+            if partial:
+                await on_partial(partial) # Промежуточный текст отчета
+        return remove_thinking_tags(response) # Удаление маркеров мышления
     except Exception as err:
         logger.error(f"Ошибка в comprehensive_assessment: {err}") # Логирование ошибок
-        return "Не удалось сформировать комплексную оценку." # Возврат сообщения об ошибке
+        return ASSESSMENT_FAILED # Возврат сообщения об ошибке
 
 async def anti_flood(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик защиты от флуда"""
+    """Обработчик защиты от флуда: число оставшихся запросов или None, если запрос заблокирован"""
     user_id = update.effective_user.id
     
-    if not flood_control.check_user(user_id): # Проверка на флуд через контроллер
-        remaining = flood_control.get_remaining_requests(user_id)
+    allowed, remaining, retry_after = await flood_control.acquire(user_id) # Одна проверка на сообщение
+    if not allowed:
         logger.warning(f"Флуд-блокировка пользователя {user_id}") # Логирование блокировки
         await update.message.reply_text(
-            f"⚠️ Превышен лимит запросов (15 в час).\n"
+            f"⚠️ Превышен лимит запросов ({FLOOD_MAX_REQUESTS} за {FLOOD_PERIOD // 60} мин).\n"
             f"Оставшиеся запросы: {remaining}\n" 
-            f"Попробуйте через час."
+            f"Попробуйте через {math.ceil(retry_after / 60)} мин."
         )
-        return True  # Блокируем обработку
-    return False  # Продолжаем обработку
+        return None  # Блокируем обработку
+    return remaining  # Продолжаем обработку
+
+def text_analysis_report(text_analysis: dict) -> str:
+    """Отчет только по анализу текста (факты не проверялись)"""
+    report = (
+        f"📝 АНАЛИЗ ТЕКСТА\n"
+        f"Достоверность по признакам текста: {text_analysis.get('credibility_score', 'не определена')}/100\n"
+        f"Признаки манипуляции: {text_analysis.get('manipulation_signs', 'не определены')}\n"
+    )
+    for title, key in (("Сильные стороны", 'strong_points'), ("Слабые места", 'weak_points')):
+        points = text_analysis.get(key) or []
+        if points:
+            report += f"{title}:\n" + "".join(f"- {point}\n" for point in points[:5])
+    report += f"\nВывод: {text_analysis.get('overall_conclusion', '')}"
+    return report
+
+async def finish_analysis(user_text: str, analysis: dict, stats: dict, started: float, user_id, plan: dict,
+                          tier: int):
+    """Кэширование полного анализа, списание квот, метрики и замер длительности для контроллера нагрузки"""
+    if analysis["complete"]:
+        similarity_index.add(user_text, (numbers_of(user_text), analysis)) # Запоминаем для похожих новостей
+    if user_id is not None:
+        await quota_engine.charge(user_id, stats) # Оплата по фактическому расходу; попадания в кэши бесплатны
+    elapsed = time.perf_counter() - started
+    if not tier: # Упрощенный анализ быстрее и занизил бы длительность, по которой выбирается сама ступень
+        load_shedder.observe('analysis', elapsed)
+    ANALYSIS_MODE.inc(mode='degraded' if plan['degraded'] else 'full')
+    ANALYSIS_SECONDS.observe(elapsed)
+    logger.info(
+        f"Анализ завершен за {elapsed:.1f} с: вызовов LLM {stats['llm_calls']}, "
+        f"запросов к Yandex {stats['search_calls']}, режим релевантности {FACT_RELEVANCE_MODE}, "
+        f"ступень нагрузки {tier}, обработка промптов: {stats['prompt_tokens']} токенов за "
+        f"{stats['prompt_eval_seconds']:.1f} с, ответы: {stats['completion_tokens']} токенов"
+    ) # Сравнение режимов по времени, числу вызовов и стоимости промптов
+    return analysis
+
+def find_similar(user_text: str):
+    """(сходство, анализ) похожей новости с теми же числами или None: копия с измененными цифрами
+    (магнитуда, число жертв, дата) - другая новость и не должна получать чужой отчет или факты"""
+    numbers = numbers_of(user_text)
+    similar = similarity_index.query(
+        user_text, SIMILARITY_PARTIAL_THRESHOLD, accept=lambda payload: payload[0] == numbers
+    )
+    return (similar[0], similar[1][1]) if similar else None
+
+async def run_analysis(user_text: str, update_status, user_id=None, plan=None) -> dict:
+    """Полный цикл анализа текста: факты, поиск, проверка и итоговый отчет;
+    plan - режим квот (quota_engine.plan), расход списывается с user_id; под нагрузкой этапы упрощаются
+    по ступени load_shedder"""
+    stats = request_stats.start() # Подсчет вызовов LLM и Yandex для этого сообщения
+    started = time.perf_counter()
+    plan = plan or FULL_PLAN
+    
+    # Ищем ранее проанализированную похожую новость
+    similar = find_similar(user_text)
+    if similar and similar[0] >= SIMILARITY_REUSE_THRESHOLD:
+        logger.info(f"Найдена почти идентичная новость (сходство {similar[0]:.2f}), используем готовый отчет")
+        return similar[1]
+    
+    tier = load_shedder.current_tier()
+    shed = load_shedder.settings(tier)
+    max_facts = min(plan['max_facts'], shed['max_facts']) # Лимит фактов с учетом квот и нагрузки
+    load_notice = f"⚙️ Режим нагрузки: ступень {tier} - {shed['name']}.\n" if tier else ""
+    
+    if shed['text_only']: # Наибольшая нагрузка: только анализ текста новости
+        await update_status("⏳ Выполняю анализ текста...")
+        text_analysis = await analyze_news_text(user_text)
+        analysis = {
+            "final_report": load_notice + "\n" + text_analysis_report(text_analysis),
+            "facts": [],
+            "fact_results": {},
+            "factcheck_results": {"factcheck_results": []},
+            "complete": False
+        }
+        return await finish_analysis(user_text, analysis, stats, started, user_id, plan, tier)
+    
+    await update_status("⏳ Выполняю анализ текста и извлечение фактов...")
+    
+    text_analysis_task = asyncio.create_task(analyze_news_text(user_text)) # Создание задачи анализа текста
+    if similar: # Та же история в другой редакции: факты и источники берем из прошлого анализа
+        logger.info(f"Найдена похожая новость (сходство {similar[0]:.2f}), используем ее факты и источники")
+        facts = similar[1]['facts'][:max_facts]
+        fact_results = {fact: similar[1]['fact_results'].get(fact, []) for fact in facts}
+        verdicts = {fact: verdict for fact in facts if (verdict := await fact_verdicts.get(fact))}
+    else:
+        facts_data = await analyze_facts(user_text)
+        facts = facts_data.get('facts', [])[:max_facts] # лимит фактов (меньше в сокращенном режиме и под нагрузкой)
+        
+        # Получаем результаты проверки фактов
+        await update_status(f"⏳ Проверяю {len(facts)} извлеченных фактов...")
+        
+        # Факты, уже проверенные в других новостях, не ищем заново: берем источники их вердикта
+        verdicts = {fact: verdict for fact in facts if (verdict := await fact_verdicts.get(fact))}
+        new_facts = [fact for fact in facts if fact not in verdicts]
+        search_results = await asyncio.gather(*(
+            yandex_factcheck(fact, cached_only=plan['cached_only']) for fact in new_facts
+        )) # Параллельный поиск в пределах RPS
+        found = dict(zip(new_facts, search_results))
+        fact_results = {
+            fact: verdicts[fact]['sources'] if fact in verdicts else found[fact] for fact in facts
+        } # Получение результатов проверки
+    
+    # Получаем результат анализа текста
+    await update_status("⏳ Анализирую качество текста...")
+    text_analysis = await text_analysis_task
+    
+    # Оцениваем качество источников
+    await update_status("⏳ Оцениваю качество и количество источников...")
+    sources_quality_task = asyncio.create_task(evaluate_sources_quality(
+        fact_results, user_text, unknown_score=None if shed['llm_sources'] else SHED_UNKNOWN_DOMAIN_SCORE
+    )) # Создание задачи оценки источников
+    
+    # Выполняем проверку фактов
+    await update_status("⏳ Выполняю проверку фактов...")
+    factcheck_task = asyncio.create_task(perform_factchecking(
+        user_text, facts, fact_results, verdicts=verdicts,
+        prefiltered=FACT_RELEVANCE_MODE == 'extract' or not shed['relevance_filter']
+    )) # Создание задачи проверки фактов
+    
+    # Ждем завершения всех задач
+    sources_quality = await sources_quality_task
+    factcheck_results = await factcheck_task
+    
+    # Формируем комплексную оценку
+    await update_status("⏳ Формирую комплексную оценку с учетом источников...")
+    
+    async def show_partial_report(text):
+        await update_status(f"⏳ Формирую отчет...\n\n{text}")
+    
+    comprehensive_report = await generate_comprehensive_assessment(
+        text_analysis, facts, fact_results, sources_quality, factcheck_results,
+        on_partial=show_partial_report, text=user_text
+    ) # Генерация итогового отчёта с показом текста по мере готовности
+    
+    # Объединенный блок результатов проверки и источников
+    combined_results = "\n📑 РЕЗУЛЬТАТЫ ПРОВЕРКИ:\n"
+    total_sources = 0
+    
+    if "factcheck_results" in factcheck_results:
+        for i, fact_check in enumerate(factcheck_results["factcheck_results"][:3], 1): # Ограничиваем для экономии места
+            fact = fact_check.get("fact", "")
+            status = fact_check.get("source_confirmation", "")
+            accuracy = fact_check.get("accuracy_level", "")
+            sources_count = fact_check.get("source_count", 0)
+            confidence = fact_check.get("confidence_score", 0)
+            
+            total_sources += sources_count
+            
+            combined_results += f"{i}. {fact[:150]}{'...' if len(fact) > 150 else ''}\n"
+            combined_results += f"   Подтверждение: {status}\n"
+            combined_results += f"   Точность: {accuracy}, Уверенность: {confidence}%\n"
+            combined_results += f"   Источников найдено: {sources_count}\n"
+            
+            # Добавляем топ-источник если есть
+            if fact in fact_results and fact_results[fact]:
+                top_source = fact_results[fact][0]
+                title = top_source.get('title', 'Без заголовка')
+                url = top_source.get('url', '')
+                combined_results += f"   Топ-источник: {title[:100]}{'...' if len(title) > 100 else ''}\n"
+                if url:
+                    combined_results += f"   Ссылка: {url[:200]}{'...' if len(url) > 200 else ''}\n"
+            combined_results += "\n"
+    
+    combined_results += f"📊\n"
+    
+    # Формируем полный отчет
+    report_parts = [comprehensive_report[:3500], combined_results[:3500]]
+    if plan['degraded']: # Пользователь видит, что проверка неполная и почему
+        report_parts.insert(0, (
+            f"⚠️ Сокращенная проверка ({'; '.join(plan['reasons'])}): не больше {plan['max_facts']} фактов"
+            f"{', источники только из ранее выполненных поисков' if plan['cached_only'] else ''}.\n"
+        ))
+    if tier: # Какие этапы упрощены из-за нагрузки
+        report_parts.insert(0, load_notice)
+    final_report = "\n".join(report_parts) # Объединение частей отчёта
+    
+    analysis = {
+        "final_report": final_report,
+        "facts": facts,
+        "fact_results": fact_results,
+        "factcheck_results": factcheck_results,
+        # Неудачные, сокращенные и упрощенные под нагрузкой анализы не кэшируются
+        "complete": comprehensive_report != ASSESSMENT_FAILED and not plan['degraded'] and not tier
+    }
+    return await finish_analysis(user_text, analysis, stats, started, user_id, plan, tier)
+
+active_handlers = set() # Выполняющиеся обработчики сообщений, которых ждет остановка бота
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка входящих текстовых и пересланных сообщений"""
+    task = asyncio.current_task()
+    active_handlers.add(task)
+    try:
+        await process_message(update, context)
+    finally:
+        active_handlers.discard(task)
+
+async def process_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Проверки сообщения, анализ и отправка отчета"""
     try:
+        # Модели еще загружаются: отвечаем сразу, не расходуя лимит запросов
+        if BOT_MODE == 'standalone' and not llm_gateway.ready:
+            await update.message.reply_text("🔥 Бот запускается и загружает модель. Попробуйте через минуту.")
+            MESSAGES_TOTAL.inc(result='warming_up')
+            return
+
         # Проверка антифлуд
-        if await anti_flood(update, context):
+        remaining = await anti_flood(update, context)
+        if remaining is None:
+            return
+
+        # Квоты по расходу: при нехватке - сокращенная проверка, отказ - только когда токены исчерпаны
+        plan = await quota_engine.plan(update.effective_user.id)
+        if plan is None:
+            retry_after = await quota_engine.retry_after(update.effective_user.id)
+            await update.message.reply_text(
+                f"⚠️ Исчерпана квота обработки.\n"
+                f"Попробуйте через {math.ceil(retry_after / 60)} мин."
+            )
+            MESSAGES_TOTAL.inc(result='quota_exhausted')
             return
 
         user_text = update.message.text or update.message.caption
@@ -698,129 +1114,65 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         logger.info(f"Received from {update.effective_user.id}: {user_text[:120]!r}") # Логирование получения сообщения
 
+        if BOT_MODE == 'frontend': # Анализ выполняют процессы-обработчики
+            await enqueue_analysis(update, user_text, remaining)
+            return
+
+        # Готовый или уже выполняющийся анализ не занимает место в очереди
+        user_id = update.effective_user.id
+        queued = not report_cache.is_known(user_text)
+        if queued and analysis_scheduler.is_full(user_id):
+            await reply_queue_full(update, analysis_scheduler.size < analysis_scheduler.max_queue)
+            return
+
         # Показываем оставшиеся запросы
-        remaining = flood_control.get_remaining_requests(update.effective_user.id)
-        
         processing_message = await update.message.reply_text(
             f"⏳ Анализирую информацию...\n"
-            f"📊 Оставшиеся запросы: {remaining}/15"
+            f"📊 Оставшиеся запросы: {remaining}/{FLOOD_MAX_REQUESTS}"
         )
 
-        try:
-            await context.bot.edit_message_text(
-                chat_id=update.effective_message.chat_id,
-                message_id=processing_message.message_id,
-                text="⏳ Выполняю анализ текста и извлечение фактов..."
-            )
-        except Exception as e:
-            logger.warning(f"Не удалось обновить сообщение: {e}") # Логирование ошибок при обновлении сообщения
-        
-        text_analysis_task = asyncio.create_task(analyze_news_text(user_text)) # Создание задачи анализа текста
-        facts_data = await analyze_facts(user_text)
-        facts = facts_data.get('facts', [])[:6] # лимит фактов
-        
-        # Получаем результаты проверки фактов
-        try:
-            await context.bot.edit_message_text(
-                chat_id=update.effective_message.chat_id,
-                message_id=processing_message.message_id,
-                text=f"⏳ Проверяю {len(facts)} извлеченных фактов..."
-            )
-        except Exception as e:
-            logger.warning(f"Не удалось обновить сообщение: {e}")
-        
-        fact_results = {fact: await yandex_factcheck(fact) for fact in facts} # Получение результатов проверки
-        
-        # Получаем результат анализа текста
-        try:
-            await context.bot.edit_message_text(
-                chat_id=update.effective_message.chat_id,
-                message_id=processing_message.message_id,
-                text="⏳ Анализирую качество текста..."
-            )
-        except Exception as e:
-            logger.warning(f"Не удалось обновить сообщение: {e}")
-            
-        text_analysis = await text_analysis_task
-        
-        # Оцениваем качество источников
-        try:
-            await context.bot.edit_message_text(
-                chat_id=update.effective_message.chat_id,
-                message_id=processing_message.message_id,
-                text="⏳ Оцениваю качество и количество источников..."
-            )
-        except Exception as e:
-            logger.warning(f"Не удалось обновить сообщение: {e}")
+        # Статусы и текст отчета выводятся правками с ограничением частоты
+        status_updater = ThrottledMessageUpdater(
+            context.bot, update.effective_message.chat_id, processing_message.message_id
+        )
 
-        sources_quality_task = asyncio.create_task(evaluate_sources_quality(fact_results)) # Создание задачи оценки источников
-        
-        # Выполняем проверку фактов
-        try:
-            await context.bot.edit_message_text(
-                chat_id=update.effective_message.chat_id,
-                message_id=processing_message.message_id,
-                text="⏳ Выполняю проверку фактов..."
-            )
-        except Exception as e:
-            logger.warning(f"Не удалось обновить сообщение: {e}")
+        def analyze():
+            return report_cache.get_or_compute(
+                user_text, lambda update_status: run_analysis(user_text, update_status, user_id, plan),
+                status_updater.update
+            ) # Повторные и одновременные одинаковые тексты анализируются один раз
 
-        factcheck_task = asyncio.create_task(perform_factchecking(user_text, facts, fact_results)) # Создание задачи проверки фактов
-        
-        # Ждем завершения всех задач
-        sources_quality = await sources_quality_task
-        factcheck_results = await factcheck_task
-        
-        # Формируем комплексную оценку
-        try:
-            await context.bot.edit_message_text(
-                chat_id=update.effective_message.chat_id,
-                message_id=processing_message.message_id,
-                text="⏳ Формирую комплексную оценку с учетом источников..."
+        async def show_position(position):
+            await status_updater.update(
+                f"🕒 Запрос в очереди, позиция: {position}\n"
+                f"📊 Оставшиеся запросы: {remaining}/{FLOOD_MAX_REQUESTS}"
             )
-        except Exception as e:
-            logger.warning(f"Не удалось обновить сообщение: {e}")
 
-        comprehensive_report = await generate_comprehensive_assessment(
-            text_analysis, facts, fact_results, sources_quality, factcheck_results
-        ) # Генерация итогового отчёта
-        
-        # Объединенный блок результатов проверки и источников
-        combined_results = "\n📑 РЕЗУЛЬТАТЫ ПРОВЕРКИ:\n"
-        total_sources = 0
-        
-        if "factcheck_results" in factcheck_results:
-            for i, fact_check in enumerate(factcheck_results["factcheck_results"][:3], 1): # Ограничиваем для экономии места
-                fact = fact_check.get("fact", "")
-                status = fact_check.get("source_confirmation", "")
-                accuracy = fact_check.get("accuracy_level", "")
-                sources_count = fact_check.get("source_count", 0)
-                confidence = fact_check.get("confidence_score", 0)
-                
-                total_sources += sources_count
-                
-                combined_results += f"{i}. {fact[:150]}{'...' if len(fact) > 150 else ''}\n"
-                combined_results += f"   Подтверждение: {status}\n"
-                combined_results += f"   Точность: {accuracy}, Уверенность: {confidence}%\n"
-                combined_results += f"   Источников найдено: {sources_count}\n"
-                
-                # Добавляем топ-источник если есть
-                if fact in fact_results and fact_results[fact]:
-                    top_source = fact_results[fact][0]
-                    title = top_source.get('title', 'Без заголовка')
-                    url = top_source.get('url', '')
-                    combined_results += f"   Топ-источник: {title[:100]}{'...' if len(title) > 100 else ''}\n"
-                    if url:
-                        combined_results += f"   Ссылка: {url[:200]}{'...' if len(url) > 200 else ''}\n"
-                combined_results += "\n"
-        
-        combined_results += f"📊\n"
-        
-        # Формируем полный отчет
-        final_report = "\n".join([
-            comprehensive_report[:3500],
-            combined_results[:3500]
-        ]) # Объединение частей отчёта
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            if queued:
+                analysis = await analysis_scheduler.submit(
+                    user_id, analyze, on_position=show_position, known=lambda: report_cache.is_known(user_text)
+                )
+            else:
+                analysis = await analyze()
+        except QueueFull as err: # Очередь заполнилась, пока отправлялось сообщение о ходе обработки
+            MESSAGES_TOTAL.inc(result='rejected')
+            await status_updater.close()
+            try:
+                await context.bot.edit_message_text(
+                    chat_id=update.effective_message.chat_id,
+                    message_id=processing_message.message_id,
+                    text=queue_full_text(err.per_user)
+                )
+            except Exception as e:
+                logger.warning(f"Не удалось обновить сообщение: {e}")
+            return
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            await status_updater.close() # Неотправленные правки больше не нужны
+        final_report = analysis['final_report']
+        logger.info(f"Кэш отчетов: {report_cache.stats()}")
         
         # Удаляем сообщение о обработке
         try:
@@ -833,19 +1185,36 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Отправляем отчет
         await send_long_message(update, final_report) # Отправка сообщения
+        MESSAGES_TOTAL.inc(result='ok')
         
     except Exception as err:
+        MESSAGES_TOTAL.inc(result='error')
         logger.error(f"Ошибка handle_message: {err}", exc_info=True) # Логирование ошибок
         await update.message.reply_text("⚠️ Ошибка при обработке запроса.")
 
-async def send_long_message(update, text):
-    """Отправляет сообщение, сокращая его при необходимости до одного сообщения"""
+def queue_full_text(per_user: bool) -> str:
+    """Текст отказа при заполненной очереди анализа"""
+    if per_user:
+        return (
+            f"⚠️ У вас уже {analysis_scheduler.max_per_user} запроса в очереди.\n"
+            f"Дождитесь их результатов и отправьте новость снова."
+        )
+    return "⚠️ Бот сейчас перегружен: очередь анализа заполнена.\nПопробуйте через несколько минут."
+
+async def reply_queue_full(update, per_user: bool):
+    """Отказ в анализе при заполненной очереди"""
+    logger.warning(f"Очередь заполнена, отказ пользователю {update.effective_user.id}")
+    MESSAGES_TOTAL.inc(result='rejected')
+    await update.message.reply_text(queue_full_text(per_user))
+
+def shorten_message(text: str) -> str:
+    """Сокращает текст до одного сообщения Telegram"""
     # Максимальная длина сообщения в Telegram
     MAX_MESSAGE_LENGTH = 4000  # Немного меньше официального лимита для подстраховки
     
     # Если сообщение короче максимальной длины, отправляем его целиком
     if len(text) <= MAX_MESSAGE_LENGTH:
-        return await update.message.reply_text(text)
+        return text
     
     # Сокращаем сообщение до допустимого размера
     beginning_length = MAX_MESSAGE_LENGTH // 2
@@ -854,13 +1223,106 @@ async def send_long_message(update, text):
     beginning = text[:beginning_length]
     ending = text[-ending_length:]
     
-    shortened_message = (
+    return (
         f"{beginning}\n\n"
         f"[...сообщение сокращено из-за ограничений Telegram...]\n\n"
         f"{ending}"
     )
-    
-    return await update.message.reply_text(shortened_message)
+
+@timed('send')
+async def send_long_message(update, text):
+    """Отправляет сообщение, сокращая его при необходимости до одного сообщения"""
+    return await update.message.reply_text(shorten_message(text))
+
+async def enqueue_analysis(update, user_text: str, remaining: int):
+    """Режим фронтенда: задание анализа передается обработчикам через брокер"""
+    broker = get_broker()
+    if await broker.size() >= ANALYSIS_QUEUE_SIZE:
+        await reply_queue_full(update, per_user=False)
+        return
+
+    processing_message = await update.message.reply_text(
+        f"🕒 Запрос в очереди на анализ...\n"
+        f"📊 Оставшиеся запросы: {remaining}/{FLOOD_MAX_REQUESTS}"
+    )
+    job_id = await broker.put({
+        'user_id': update.effective_user.id,
+        'chat_id': update.effective_message.chat_id,
+        'message_id': processing_message.message_id, # Сообщение о ходе обработки
+        'reply_to': update.message.message_id, # Сообщение пользователя, на которое отвечает отчет
+        'text': user_text
+    })
+    MESSAGES_TOTAL.inc(result='queued')
+    logger.info(f"Задание {job_id} поставлено в очередь брокера")
+
+async def process_job(bot, job: dict) -> dict:
+    """Анализ задания из брокера с отправкой отчета через Bot API"""
+    user_text = job['text']
+    status_updater = ThrottledMessageUpdater(bot, job['chat_id'], job['message_id'])
+    plan = await quota_engine.plan(job['user_id'], allow_refusal=False) # Запрос уже принят фронтендом
+    REQUESTS_IN_FLIGHT.inc()
+    try:
+        analysis = await report_cache.get_or_compute(
+            user_text, lambda update_status: run_analysis(user_text, update_status, job['user_id'], plan),
+            status_updater.update
+        )
+    finally:
+        REQUESTS_IN_FLIGHT.dec()
+        await status_updater.close()
+
+    try:
+        await bot.delete_message(chat_id=job['chat_id'], message_id=job['message_id'])
+    except Exception as e:
+        logger.warning(f"Не удалось удалить сообщение о обработке: {e}")
+    with STAGE_SECONDS.time(stage='send'):
+        await bot.send_message(
+            chat_id=job['chat_id'], text=shorten_message(analysis['final_report']),
+            reply_to_message_id=job.get('reply_to')
+        )
+    MESSAGES_TOTAL.inc(result='ok')
+    return analysis
+
+async def serve_jobs(bot, broker, worker_id: str, concurrency: int = WORKER_CONCURRENCY, stopping=None):
+    """Цикл обработчика: забирает задания из брокера, пока не будет отменен или не установлено событие stopping
+    (после него начатые задания доделываются, новые не берутся)"""
+    async def heartbeat(job_id, slot_id):
+        while True:
+            await asyncio.sleep(BROKER_HEARTBEAT)
+            try:
+                renewed = await broker.renew(job_id, slot_id)
+            except Exception as err:
+                logger.warning(f"Не удалось продлить аренду задания {job_id}: {err}")
+                continue
+            if not renewed:
+                logger.warning(f"Аренда задания {job_id} потеряна: оно может быть выдано другому обработчику")
+                return
+
+    async def slot(index):
+        slot_id = f"{worker_id}/{index}"
+        while stopping is None or not stopping.is_set():
+            job = await broker.get(slot_id, timeout=1.0) # Раз в секунду проверяем, не началась ли остановка
+            if job is None:
+                continue
+            renewing = asyncio.create_task(heartbeat(job['id'], slot_id)) # Аренда продлевается, пока идет анализ
+            try:
+                analysis = await process_job(bot, job)
+                await broker.complete(job['id'], {'complete': analysis['complete']})
+            except Exception as err:
+                MESSAGES_TOTAL.inc(result='error')
+                logger.error(f"Ошибка обработки задания {job['id']}: {err}", exc_info=True)
+                await broker.fail(job['id'], str(err))
+                try:
+                    await bot.send_message(
+                        chat_id=job['chat_id'], text="⚠️ Ошибка при обработке запроса.",
+                        reply_to_message_id=job.get('reply_to')
+                    )
+                except Exception as e:
+                    logger.warning(f"Не удалось сообщить об ошибке: {e}")
+            finally:
+                renewing.cancel()
+
+    logger.info(f"Обработчик {worker_id}: одновременных анализов {concurrency}")
+    await asyncio.gather(*(slot(index) for index in range(concurrency)))
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Глобальный обработчик исключений"""
@@ -872,11 +1334,92 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "🚨 Произошла системная ошибка. Пожалуйста, попробуйте позже."
         ) # Сообщение пользователю
 
+# Доли попаданий в кэши вычисляются при каждом запросе /metrics
+CACHE_HIT_RATIO.set_function(lambda: search_cache.stats()['hit_rate'], cache='search')
+CACHE_HIT_RATIO.set_function(lambda: fact_verdicts.stats()['hit_rate'], cache='fact_verdict')
+CACHE_HIT_RATIO.set_function(
+    lambda: report_cache.hits / max(1, report_cache.hits + report_cache.coalesced + report_cache.misses), cache='report'
+)
+
+ANALYSIS_QUEUE_DEPTH.set_function(lambda: analysis_scheduler.size)
+ANALYSIS_RUNNING.set_function(lambda: analysis_scheduler.running)
+load_shedder.in_flight = REQUESTS_IN_FLIGHT.get # Сообщения в обработке, включая очередь анализа
+llm_gateway.on_latency = lambda seconds: load_shedder.observe('llm', seconds) # Длительность каждого вызова LLM
+
+async def warm_up_models():
+    """Фоновый прогрев моделей; до его завершения бот отвечает, что загружается"""
+    await llm_gateway.warm_up(pull=LLM_PULL_ON_START)
+    cold_start = time.monotonic() - STARTED_AT
+    COLD_START_SECONDS.set(cold_start)
+    logger.info(f"Бот готов к анализу через {cold_start:.1f} с после запуска")
+
+async def post_init(application: Application):
+    """Запуск вспомогательных служб в цикле событий бота"""
+    install_stop_signals(application)
+    if BOT_MODE == 'standalone':
+        application.bot_data['warm_up'] = asyncio.create_task(warm_up_models())
+        analysis_scheduler.start() # Обработчики очереди анализа
+    elif BROKER == 'memory': # Фронтенд и обработчики в одном процессе
+        stopping = application.bot_data['jobs_stopping'] = asyncio.Event()
+        async def serve_local_jobs():
+            await warm_up_models()
+            await serve_jobs(application.bot, get_broker(), 'local', stopping=stopping)
+        application.bot_data['job_workers'] = asyncio.create_task(serve_local_jobs())
+    if METRICS_PORT:
+        application.bot_data['metrics_server'] = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+
+async def drain_and_stop(application: Application):
+    """Плавная остановка: прекращаем прием обновлений и ждем начатые анализы (и задания обработчиков
+    в процессе бота) не дольше DRAIN_TIMEOUT"""
+    if application.bot_data.get('draining'):
+        return
+    application.bot_data['draining'] = True
+    if application.updater and application.updater.running:
+        await application.updater.stop() # Сервер вебхука или опрос больше не принимают обновления
+    pending = [task for task in active_handlers if not task.done()]
+    if 'job_workers' in application.bot_data: # Обработчики в процессе бота доделывают взятые задания
+        application.bot_data['jobs_stopping'].set()
+        pending.append(application.bot_data['job_workers'])
+    logger.info(f"Остановка: ожидаем {len(pending)} обрабатываемых сообщений, не дольше {DRAIN_TIMEOUT} с")
+    if pending:
+        _, not_finished = await asyncio.wait(pending, timeout=DRAIN_TIMEOUT)
+        for task in not_finished:
+            task.cancel()
+        if not_finished:
+            logger.warning(f"Прерваны по таймауту: {len(not_finished)} сообщений")
+            await asyncio.gather(*not_finished, return_exceptions=True)
+    application.stop_running()
+
+def install_stop_signals(application: Application):
+    """SIGTERM и SIGINT запускают плавную остановку вместо немедленной"""
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, lambda: asyncio.create_task(drain_and_stop(application)))
+
 if __name__ == '__main__':
-    app = Application.builder().token(TELEGRAM_TOKEN).build() # Создание приложения
+    check_quota_backend() # Отказ запуска с квотами, которые не соблюдались бы
+    app = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .concurrent_updates(True) # Сообщения разных пользователей обрабатываются одновременно
+        .post_init(post_init)
+        .build()
+    ) # Создание приложения
     # Обработчик всех сообщений кроме команд
     app.add_handler(MessageHandler(filters.ALL & ~filters.COMMAND, handle_message))
     app.add_error_handler(error_handler) # Глобальный обработчик ошибок
 
     logger.info("Бот фактчекинга запущен с новыми функциями")
-    app.run_polling() # Запуск бота в режиме опроса
+    if TELEGRAM_WEBHOOK_URL:
+        if not WEBHOOK_SECRET:
+            logger.warning("WEBHOOK_SECRET не задан: вебхук примет запросы от любого отправителя")
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=TELEGRAM_WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET or None, # Запросы без верного заголовка получают 403
+            stop_signals=None # Сигналы обрабатывает install_stop_signals
+        ) # Запуск бота в режиме вебхука
+    else:
+        app.run_polling(stop_signals=None) # Запуск бота в режиме опроса
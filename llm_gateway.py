@@ -0,0 +1,352 @@
+# Общий асинхронный шлюз к Ollama для всех этапов анализа с балансировкой между серверами
+import asyncio # Асинхронная обработка запросов
+import logging # Для записи логов работы программы
+import re # Разбор длительности keep_alive
+import time # Время исключения серверов и задержки вызовов
+import httpx # Сетевые ошибки клиента Ollama
+import ollama # Использование LLM (Large Language Model)
+
+import request_stats # Счетчики вызовов в рамках одного сообщения
+from token_budget import estimate_tokens, pick_num_ctx, CTX_BUCKETS # Размер контекста по размеру промпта
+from metrics import ( # Метрики вызовов LLM
+    LLM_CALLS,
+    LLM_IN_FLIGHT,
+    LLM_BACKEND_UP,
+    LLM_WARMUP_SECONDS,
+    LLM_READY,
+    observe_llm_response
+)
+
+from config import ( # Параметры модели, серверов и ограничений
+    OLLAMA_MODEL,
+    OLLAMA_HOSTS,
+    LLM_STAGE_MODELS,
+    LLM_MAX_PARALLEL,
+    LLM_TIMEOUT,
+    LLM_RETRIES,
+    LLM_EJECT_AFTER,
+    LLM_EJECT_SECONDS,
+    LLM_HEALTH_INTERVAL,
+    LLM_KEEP_ALIVE
+)
+
+logger = logging.getLogger(__name__) # Логгер для текущего модуля
+
+def duration_seconds(value) -> float:
+    """keep_alive Ollama в секундах: число секунд или строка вида "30m", "1h30m"; отрицательное - бессрочно"""
+    if isinstance(value, (int, float)):
+        return float(value) if value >= 0 else float('inf')
+    text = str(value).strip()
+    if text.startswith('-'):
+        return float('inf')
+    units = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+    parts = re.findall(r'(\d+(?:\.\d+)?)(ms|s|m|h)?', text)
+    return sum(float(number) * units[unit or 's'] for number, unit in parts) if parts else 300.0 # 5m по умолчанию
+
+def is_retryable(err: Exception) -> bool:
+    """Ошибки сервера, после которых вызов можно повторить на другом сервере"""
+    if isinstance(err, (asyncio.TimeoutError, ConnectionError, httpx.TransportError)):
+        return True
+    return isinstance(err, ollama.ResponseError) and err.status_code >= 500
+
+def _field(response, name):
+    return getattr(response, name, None) if not isinstance(response, dict) else response.get(name)
+
+def count_prompt_eval(response):
+    """Добавляет вычисленные токены промпта, токены ответа и время обработки промпта к счетчикам сообщения"""
+    request_stats.count('prompt_tokens', _field(response, 'prompt_eval_count') or 0)
+    request_stats.count('completion_tokens', _field(response, 'eval_count') or 0)
+    request_stats.count('prompt_eval_seconds', (_field(response, 'prompt_eval_duration') or 0) / 1e9) # Ollama отдает наносекунды
+
+def log_call(stage, backend, estimated, options, response):
+    """Размер вызова: оценка промпта, фактически вычисленные токены и выбранный контекст"""
+    logger.info(
+        f"LLM {stage} на {backend.host}: промпт ~{estimated} токенов (оценка), "
+        f"вычислено {_field(response, 'prompt_eval_count') or 0}, ответ {_field(response, 'eval_count') or 0}, "
+        f"num_ctx {options.get('num_ctx')}"
+    )
+
+class Backend:
+    """Сервер Ollama: собственный клиент, слоты, нагрузка и состояние исключения"""
+
+    def __init__(self, host, max_parallel):
+        self.host = host or 'OLLAMA_HOST'
+        self.client = ollama.AsyncClient(host=host) # Асинхронный клиент (host=None -> OLLAMA_HOST)
+        self.max_parallel = max_parallel
+        self.slots = asyncio.Semaphore(max_parallel) # Слоты, соответствующие параллельным слотам сервера
+        self.in_flight = 0 # Вызовы, занявшие или ожидающие слот этого сервера
+        self.latency = 0.0 # Скользящее среднее длительности вызова, секунды
+        self.failures = 0 # Ошибки подряд
+        self.ejected_until = 0.0 # До этого момента сервер не получает вызовов
+        self.num_ctx = {} # {модель: размер контекста последнего вызова}, чтобы не перезагружать модель
+        self.ctx_needed = {} # {(модель, размер): время последнего промпта, которому нужен этот размер}
+        self.prepared = False # Модели этапов есть на сервере и загружены в память (warm_up)
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.ejected_until
+
+    def load(self):
+        """Ключ выбора: сначала доля занятых слотов, затем наблюдаемая задержка"""
+        return (self.in_flight / self.max_parallel, self.latency)
+
+    def record_success(self, seconds):
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.latency = seconds if not self.latency else 0.8 * self.latency + 0.2 * seconds
+
+    def record_failure(self, eject_after, eject_seconds):
+        self.failures += 1
+        if self.failures >= eject_after and self.healthy:
+            self.ejected_until = time.monotonic() + eject_seconds
+            logger.warning(f"Сервер Ollama {self.host} исключен на {eject_seconds} с после {self.failures} ошибок")
+
+class LLMGateway:
+    """Неблокирующий доступ к пулу серверов Ollama с выбором наименее загруженного, таймаутом и повтором"""
+
+    def __init__(self, model=OLLAMA_MODEL, max_parallel=LLM_MAX_PARALLEL, timeout=LLM_TIMEOUT, hosts=None,
+                 stage_models=None, retries=LLM_RETRIES, eject_after=LLM_EJECT_AFTER,
+                 eject_seconds=LLM_EJECT_SECONDS, health_interval=LLM_HEALTH_INTERVAL, keep_alive=LLM_KEEP_ALIVE):
+        self.model = model
+        self.keep_alive = keep_alive # Сколько модель остается в памяти сервера после вызова
+        self.keep_alive_seconds = duration_seconds(keep_alive)
+        self.timeout = timeout
+        self.max_parallel = max_parallel
+        self.stage_models = dict(LLM_STAGE_MODELS if stage_models is None else stage_models)
+        self.retries = retries
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.health_interval = health_interval
+        self.backends = [Backend(host, max_parallel) for host in (hosts or OLLAMA_HOSTS or [None])]
+        self._health_task = None
+        self.on_latency = None # Функция (секунды), вызываемая после каждого успешного вызова (учет нагрузки)
+
+    @property
+    def ready(self) -> bool:
+        """Хотя бы один сервер загрузил в память все модели этапов"""
+        return any(backend.prepared for backend in self.backends)
+
+    @property
+    def in_flight(self) -> int:
+        """Количество выполняемых сейчас вызовов на всех серверах"""
+        return sum(backend.in_flight for backend in self.backends)
+
+    def _record_success(self, backend, seconds):
+        backend.record_success(seconds)
+        if self.on_latency:
+            self.on_latency(seconds)
+
+    def model_for(self, stage: str, model: str = None) -> str:
+        """Модель вызова: явно заданная, затем модель этапа из LLM_STAGE_MODELS, затем OLLAMA_MODEL"""
+        return model or self.stage_models.get(stage) or self.model
+
+    def models(self) -> set:
+        """Все модели, которые могут понадобиться этапам"""
+        return {self.model, *self.stage_models.values()}
+
+    def _pick(self, tried) -> Backend:
+        # После прогрева первого сервера вызовы получают только прогретые: остальные могут еще скачивать модели.
+        # Без прогрева (worker.py) выбираются все серверы
+        pool = [b for b in self.backends if b.prepared] or self.backends
+        candidates = [b for b in pool if b not in tried] or pool
+        healthy = [b for b in candidates if b.healthy]
+        if healthy:
+            return min(healthy, key=Backend.load)
+        return min(candidates, key=lambda b: b.ejected_until) # Все исключены: пробуем тот, что вернется первым
+
+    def _options(self, backend, model, estimated, options):
+        """Параметры вызова с размером контекста по оценке промпта, если этап не задал его сам"""
+        options = dict(options or {})
+        if 'num_ctx' not in options:
+            now = time.monotonic()
+            backend.ctx_needed[(model, pick_num_ctx(estimated))] = now
+            loaded = backend.num_ctx.get(model)
+            needed_at = backend.ctx_needed.get((model, loaded))
+            # Больший контекст сохраняется, пока промпты, которым он нужен, приходят чаще, чем выгружается модель
+            loaded_needed = needed_at is not None and now - needed_at < self.keep_alive_seconds
+            options['num_ctx'] = pick_num_ctx(estimated, loaded, loaded_needed)
+        if estimated > options['num_ctx']:
+            logger.warning(f"Промпт ~{estimated} токенов не помещается в контекст {options['num_ctx']}: Ollama обрежет его")
+        return options
+
+    def _ensure_health_checks(self):
+        if self._health_task is None and len(self.backends) > 1 and self.health_interval:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def _health_loop(self):
+        """Периодическая проверка серверов: недоступные исключаются, восстановившиеся возвращаются"""
+        while True:
+            await asyncio.sleep(self.health_interval)
+            for backend in self.backends:
+                try:
+                    await asyncio.wait_for(backend.client.list(), timeout=5)
+                    if not backend.healthy:
+                        logger.info(f"Сервер Ollama {backend.host} снова доступен")
+                    backend.failures = 0
+                    backend.ejected_until = 0.0
+                except Exception as err:
+                    if backend.healthy:
+                        logger.warning(f"Проверка сервера Ollama {backend.host} не прошла: {err}")
+                    backend.failures = max(backend.failures, self.eject_after - 1)
+                    backend.record_failure(self.eject_after, self.eject_seconds)
+
+    async def prepare(self, backend: Backend, pull: bool = True):
+        """Проверяет наличие моделей на сервере (при pull - скачивает недостающие) и загружает их в память"""
+        started = time.perf_counter()
+        for model in sorted(self.models()):
+            try:
+                await backend.client.show(model)
+            except ollama.ResponseError as err:
+                if err.status_code != 404 or not pull:
+                    raise
+                logger.info(f"Загрузка модели {model} на {backend.host}")
+                await backend.client.pull(model)
+            # Пустой промпт только загружает модель в память (с наименьшим контекстом), не генерируя ответ
+            await asyncio.wait_for(
+                backend.client.generate(model=model, prompt='', keep_alive=self.keep_alive,
+                                        options={'num_ctx': CTX_BUCKETS[0]}),
+                timeout=self.timeout
+            )
+            backend.num_ctx[model] = CTX_BUCKETS[0]
+        seconds = time.perf_counter() - started
+        LLM_WARMUP_SECONDS.set(seconds, host=backend.host)
+        logger.info(f"Сервер Ollama {backend.host} прогрет за {seconds:.1f} с: {', '.join(sorted(self.models()))}")
+        return seconds
+
+    async def warm_up(self, pull: bool = True, retry_interval: float = 10):
+        """Прогрев всех серверов пула; каждый сервер получает вызовы после своего прогрева,
+        ready - после первого готового сервера"""
+        async def prepare_backend(backend):
+            while True:
+                try:
+                    await self.prepare(backend, pull)
+                    backend.prepared = True
+                    return
+                except Exception as err:
+                    logger.warning(f"Прогрев сервера Ollama {backend.host} не удался: {err!r}; повтор через {retry_interval} с")
+                    await asyncio.sleep(retry_interval)
+
+        await asyncio.gather(*(prepare_backend(backend) for backend in self.backends))
+
+    async def generate(self, prompt: str, model: str = None, stage: str = 'other', **kwargs):
+        """Вызов ollama generate без блокировки цикла событий; при сбое сервера - повтор на другом"""
+        request_stats.count('llm_calls')
+        self._ensure_health_checks()
+        model = self.model_for(stage, model)
+        kwargs.setdefault('keep_alive', self.keep_alive)
+        requested_options = kwargs.pop('options', None)
+        estimated = estimate_tokens((kwargs.get('system') or '') + prompt)
+        tried = []
+        while True:
+            backend = self._pick(tried)
+            tried.append(backend)
+            backend.in_flight += 1
+            try:
+                async with backend.slots:
+                    options = self._options(backend, model, estimated, requested_options)
+                    started = time.perf_counter()
+                    response = await asyncio.wait_for(
+                        backend.client.generate(model=model, prompt=prompt, options=options, **kwargs),
+                        timeout=self.timeout
+                    ) # Таймаут считается только для самого вызова, без ожидания слота
+                    backend.num_ctx[model] = options['num_ctx']
+                self._record_success(backend, time.perf_counter() - started)
+                LLM_CALLS.inc(stage=stage, result='ok')
+                observe_llm_response(stage, response) # Токены и длительности из ответа Ollama
+                count_prompt_eval(response)
+                log_call(stage, backend, estimated, options, response)
+                return response
+            except Exception as err:
+                result = 'timeout' if isinstance(err, asyncio.TimeoutError) else 'error'
+                LLM_CALLS.inc(stage=stage, result=result)
+                if not is_retryable(err):
+                    raise
+                backend.record_failure(self.eject_after, self.eject_seconds)
+                if isinstance(err, asyncio.TimeoutError):
+                    logger.error(f"Таймаут вызова LLM на {backend.host} ({self.timeout} с)") # Логирование таймаута
+                if len(tried) > self.retries or len(tried) >= len(self.backends):
+                    raise
+                logger.warning(f"Повтор вызова LLM этапа {stage} на другом сервере после ошибки на {backend.host}: {err!r}")
+            finally:
+                backend.in_flight -= 1
+
+    async def stream(self, prompt: str, model: str = None, stage: str = 'other', **kwargs):
+        """Потоковая генерация: асинхронно отдает фрагменты ответа по мере их появления"""
+        request_stats.count('llm_calls')
+        self._ensure_health_checks()
+        model = self.model_for(stage, model)
+        kwargs.setdefault('keep_alive', self.keep_alive)
+        requested_options = kwargs.pop('options', None)
+        estimated = estimate_tokens((kwargs.get('system') or '') + prompt)
+        tried = []
+        while True:
+            backend = self._pick(tried)
+            tried.append(backend)
+            backend.in_flight += 1
+            received = False # После первого фрагмента повтор на другом сервере невозможен
+            try:
+                async with backend.slots:
+                    options = self._options(backend, model, estimated, requested_options)
+                    loop = asyncio.get_running_loop()
+                    started = loop.time()
+                    deadline = started + self.timeout # Общий таймаут на весь ответ
+                    chunks = await asyncio.wait_for(
+                        backend.client.generate(model=model, prompt=prompt, stream=True, options=options, **kwargs),
+                        timeout=self.timeout
+                    )
+                    backend.num_ctx[model] = options['num_ctx']
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(chunks.__anext__(), timeout=max(0.0, deadline - loop.time()))
+                        except StopAsyncIteration:
+                            break
+                        if chunk.get('done'):
+                            observe_llm_response(stage, chunk) # Статистика приходит в последнем фрагменте
+                            count_prompt_eval(chunk)
+                            log_call(stage, backend, estimated, options, chunk)
+                        received = True
+                        yield chunk
+                self._record_success(backend, loop.time() - started)
+                LLM_CALLS.inc(stage=stage, result='ok')
+                return
+            except Exception as err:
+                result = 'timeout' if isinstance(err, asyncio.TimeoutError) else 'error'
+                LLM_CALLS.inc(stage=stage, result=result)
+                if not is_retryable(err):
+                    raise
+                backend.record_failure(self.eject_after, self.eject_seconds)
+                if isinstance(err, asyncio.TimeoutError):
+                    logger.error(f"Таймаут потокового вызова LLM на {backend.host} ({self.timeout} с)") # Логирование таймаута
+                if received or len(tried) > self.retries or len(tried) >= len(self.backends):
+                    raise
+                logger.warning(f"Повтор потокового вызова LLM на другом сервере после ошибки на {backend.host}: {err!r}")
+            finally:
+                backend.in_flight -= 1
+
+# Глобальный экземпляр шлюза, общий для всех этапов
+llm_gateway = LLMGateway()
+LLM_IN_FLIGHT.set_function(lambda: llm_gateway.in_flight)
+LLM_READY.set_function(lambda: int(llm_gateway.ready))
+for _backend in llm_gateway.backends:
+    LLM_BACKEND_UP.set_function(lambda backend=_backend: int(backend.healthy), host=_backend.host)
+
+if __name__ == '__main__':
+    import argparse # Параметры запуска
+    parser = argparse.ArgumentParser(description="Подготовка моделей на серверах Ollama")
+    parser.add_argument('command', choices=['pull', 'warmup'],
+                        help="pull - скачать недостающие модели и загрузить их в память, warmup - только загрузить в память")
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+
+    async def prepare_all():
+        results = await asyncio.gather(
+            *(llm_gateway.prepare(backend, pull=args.command == 'pull') for backend in llm_gateway.backends),
+            return_exceptions=True
+        )
+        failed = [backend.host for backend, result in zip(llm_gateway.backends, results) if isinstance(result, Exception)]
+        for backend, result in zip(llm_gateway.backends, results):
+            if isinstance(result, Exception):
+                logger.error(f"Сервер Ollama {backend.host}: {result!r}")
+        raise SystemExit(1 if failed else 0)
+
+    asyncio.run(prepare_all())
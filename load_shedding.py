@@ -0,0 +1,111 @@
+# Ступени упрощения анализа под нагрузкой: выбор по числу сообщений в обработке и задержкам этапов
+import logging # Для записи логов работы программы
+import time # Монотонные часы
+
+from metrics import LOAD_TIER # Текущая ступень нагрузки
+
+from config import (
+    MAX_FACTS,
+    SHED_IN_FLIGHT,
+    SHED_LATENCY_TARGETS,
+    SHED_THRESHOLDS,
+    SHED_COOLDOWN,
+    SHED_FACTS,
+    SHED_LATENCY_HALF_LIFE,
+    FACT_RELEVANCE_MODE
+) # Параметры снижения нагрузки
+
+logger = logging.getLogger(__name__) # Логгер для текущего модуля
+
+# Ступени по возрастанию нагрузки; каждая включает упрощения предыдущих
+TIERS = (
+    {'name': "полная проверка", 'max_facts': MAX_FACTS, 'llm_sources': True, 'relevance_filter': True,
+     'text_only': False},
+    {'name': f"сокращенная проверка: не больше {SHED_FACTS} фактов", 'max_facts': SHED_FACTS, 'llm_sources': True,
+     'relevance_filter': True, 'text_only': False},
+    {'name': "источники оценены по репутации доменов, без LLM", 'max_facts': SHED_FACTS, 'llm_sources': False,
+     'relevance_filter': True, 'text_only': False},
+    {'name': "без отдельного отбора релевантных фактов", 'max_facts': SHED_FACTS, 'llm_sources': False,
+     'relevance_filter': False, 'text_only': False},
+    {'name': "только анализ текста, факты не проверялись", 'max_facts': 0, 'llm_sources': False,
+     'relevance_filter': False, 'text_only': True}
+)
+
+def active_tiers(thresholds=SHED_THRESHOLDS, relevance_mode=FACT_RELEVANCE_MODE):
+    """(ступени, пороги их включения) без ступени отбора релевантных фактов, если отдельного отбора
+    и так нет (FACT_RELEVANCE_MODE = 'extract'): ее порог удаляется вместе с ней"""
+    steps = [
+        (tier, threshold) for tier, threshold in zip(TIERS[1:], thresholds)
+        if relevance_mode != 'extract' or tier['relevance_filter'] or tier['text_only']
+    ]
+    return (TIERS[0], *(tier for tier, _ in steps)), tuple(threshold for _, threshold in steps)
+
+class LoadShedder:
+    """Давление - наибольшее из отношений: сообщения в обработке (включая очередь) к SHED_IN_FLIGHT и скользящие
+    длительности этапов к SHED_LATENCY_TARGETS. Длительности затухают вдвое за каждые SHED_LATENCY_HALF_LIFE
+    секунд без замеров и не учитываются, когда в обработке ничего нет. Ступень растет сразу, как только давление
+    достигает ее порога, и снижается на одну после SHED_COOLDOWN секунд давления ниже порога текущей ступени"""
+
+    def __init__(self, capacity=SHED_IN_FLIGHT, latency_targets=SHED_LATENCY_TARGETS, thresholds=SHED_THRESHOLDS,
+                 cooldown=SHED_COOLDOWN, half_life=SHED_LATENCY_HALF_LIFE, relevance_mode=FACT_RELEVANCE_MODE,
+                 clock=time.monotonic):
+        self.capacity = capacity
+        self.latency_targets = latency_targets
+        self.tiers, self.thresholds = active_tiers(thresholds, relevance_mode) # Порог включения ступени 1, 2, ...
+        self.cooldown = cooldown
+        self.half_life = half_life
+        self.clock = clock
+        self.in_flight = lambda: 0 # Сообщения в обработке, включая ожидающие в очереди (задает бот)
+        self.latency = {} # {этап: (скользящее среднее длительности, секунды; время замера)}
+        self.tier = 0
+        self.calm_since = None # Начало интервала давления ниже порога текущей ступени
+
+    def _latency(self, stage: str, now: float) -> float:
+        """Скользящая длительность этапа, затухшая со времени последнего замера"""
+        value, observed_at = self.latency[stage]
+        return value * 0.5 ** ((now - observed_at) / self.half_life)
+
+    def observe(self, stage: str, seconds: float):
+        """Учитывает длительность этапа"""
+        now = self.clock()
+        if stage in self.latency:
+            seconds = 0.8 * self._latency(stage, now) + 0.2 * seconds
+        self.latency[stage] = (seconds, now)
+
+    def pressure(self) -> float:
+        in_flight = self.in_flight()
+        if not in_flight: # Без работы прошлые задержки о нагрузке не говорят
+            return 0.0
+        now = self.clock()
+        values = [in_flight / self.capacity]
+        values += [
+            self._latency(stage, now) / target for stage, target in self.latency_targets.items()
+            if stage in self.latency
+        ]
+        return max(values)
+
+    def current_tier(self) -> int:
+        """Ступень для нового анализа"""
+        pressure = self.pressure()
+        target = sum(1 for threshold in self.thresholds if pressure >= threshold)
+        now = self.clock()
+        if target > self.tier:
+            logger.warning(f"Нагрузка: давление {pressure:.2f}, ступень {self.tier} -> {target}")
+            self.tier, self.calm_since = target, None
+        elif target < self.tier:
+            if self.calm_since is None:
+                self.calm_since = now
+            elif now - self.calm_since >= self.cooldown:
+                self.tier -= 1 # Снижение по одной ступени, чтобы не раскачивать нагрузку
+                self.calm_since = now
+                logger.info(f"Нагрузка: давление {pressure:.2f}, ступень снижена до {self.tier}")
+        else:
+            self.calm_since = None
+        LOAD_TIER.set(self.tier)
+        return self.tier
+
+    def settings(self, tier: int) -> dict:
+        return self.tiers[min(tier, len(self.tiers) - 1)]
+
+# Глобальный экземпляр контроллера нагрузки
+load_shedder = LoadShedder()
@@ -0,0 +1,207 @@
+# Метрики работы бота в формате Prometheus и HTTP-эндпоинт /metrics
+import asyncio # Асинхронная обработка запросов
+import functools # Декоратор замера этапов
+import logging # Для записи логов работы программы
+import time # Измерение времени
+from contextlib import contextmanager # Контекстный менеджер замера
+
+logger = logging.getLogger(__name__) # Логгер для текущего модуля
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300) # Секунды
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+class Metric:
+    """Базовая метрика с набором меток"""
+    type = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {} # {значения меток: значение}
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, key, (), value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for name, key, extra, value in self.samples():
+            lines.append(f'{name}{_format_labels(self.labelnames, key, extra)} {value}')
+        return '\n'.join(lines)
+
+class Counter(Metric):
+    """Монотонно растущий счетчик"""
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    """Текущее значение; может вычисляться функцией в момент сбора"""
+    type = 'gauge'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.functions = {} # {значения меток: функция}
+
+    def set(self, value, **labels):
+        self.values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def get(self, **labels):
+        return self.values.get(self._key(labels), 0)
+
+    def set_function(self, function, **labels):
+        self.functions[self._key(labels)] = function
+
+    def samples(self):
+        yield from super().samples()
+        for key, function in self.functions.items():
+            try:
+                yield self.name, key, (), function()
+            except Exception as err:
+                logger.warning(f"Ошибка вычисления метрики {self.name}: {err}")
+
+class Histogram(Metric):
+    """Распределение значений по корзинам"""
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        state = self.values.get(key)
+        if state is None:
+            state = self.values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state['counts'][i] += 1
+        state['sum'] += value
+        state['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Замер длительности блока кода"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        for key, state in self.values.items():
+            for bound, count in zip(self.buckets, state['counts']):
+                yield f'{self.name}_bucket', key, (('le', bound),), count
+            yield f'{self.name}_bucket', key, (('le', '+Inf'),), state['count']
+            yield f'{self.name}_sum', key, (), state['sum']
+            yield f'{self.name}_count', key, (), state['count']
+
+class Registry:
+    """Набор метрик, отдаваемых эндпоинтом"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+REGISTRY = Registry() # Общий реестр метрик
+
+# Метрики бота
+STAGE_SECONDS = Histogram('factcheck_stage_seconds', 'Длительность этапов анализа', ['stage'])
+ANALYSIS_SECONDS = Histogram('factcheck_analysis_seconds', 'Полное время анализа одного сообщения')
+REQUESTS_IN_FLIGHT = Gauge('factcheck_requests_in_flight', 'Сообщения в обработке')
+MESSAGES_TOTAL = Counter('factcheck_messages_total', 'Обработанные сообщения по результату', ['result'])
+LLM_IN_FLIGHT = Gauge('factcheck_llm_in_flight', 'Выполняемые вызовы LLM')
+LLM_BACKEND_UP = Gauge('factcheck_llm_backend_up', 'Сервер Ollama в пуле (1) или исключен (0)', ['host'])
+LLM_READY = Gauge('factcheck_llm_ready', 'Модели загружены хотя бы на одном сервере (1) или прогрев идет (0)')
+LLM_WARMUP_SECONDS = Gauge('factcheck_llm_warmup_seconds', 'Длительность прогрева моделей на сервере', ['host'])
+COLD_START_SECONDS = Gauge('factcheck_cold_start_seconds', 'Время от запуска процесса до готовности к анализу')
+LLM_CALLS = Counter('factcheck_llm_calls_total', 'Вызовы LLM по этапам и результату', ['stage', 'result'])
+LLM_PROMPT_TOKENS = Counter('factcheck_llm_prompt_tokens_total', 'Токены промптов LLM', ['stage'])
+LLM_COMPLETION_TOKENS = Counter('factcheck_llm_completion_tokens_total', 'Сгенерированные токены LLM', ['stage'])
+LLM_PROMPT_EVAL_SECONDS = Histogram(
+    'factcheck_llm_prompt_eval_seconds', 'Время обработки промпта (prompt_eval_duration)', ['stage']
+)
+LLM_EVAL_SECONDS = Histogram('factcheck_llm_eval_seconds', 'Время генерации ответа (eval_duration)', ['stage'])
+YANDEX_REQUESTS = Counter('factcheck_yandex_requests_total', 'Запросы к Yandex Search API')
+YANDEX_ERRORS = Counter('factcheck_yandex_errors_total', 'Ошибки Yandex Search API по кодам', ['code'])
+CACHE_HIT_RATIO = Gauge('factcheck_cache_hit_ratio', 'Доля попаданий в кэш', ['cache'])
+ANALYSIS_QUEUE_DEPTH = Gauge('factcheck_analysis_queue_depth', 'Задания в очереди анализа')
+ANALYSIS_RUNNING = Gauge('factcheck_analysis_running', 'Задания, выполняемые обработчиками очереди')
+LOAD_TIER = Gauge('factcheck_load_tier', 'Ступень упрощения анализа под нагрузкой (0 - полная проверка)')
+ANALYSIS_MODE = Counter('factcheck_analysis_mode_total', 'Анализы по режиму квот (full, degraded)', ['mode'])
+TELEGRAM_EDITS = Counter('factcheck_telegram_edits_total', 'Правки сообщений о ходе обработки', ['result'])
+
+def timed(stage: str):
+    """Декоратор асинхронного этапа: длительность попадает в factcheck_stage_seconds"""
+    def decorator(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            with STAGE_SECONDS.time(stage=stage):
+                return await function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def observe_llm_response(stage: str, response):
+    """Учитывает токены и длительности из ответа Ollama"""
+    def field(name):
+        return getattr(response, name, None) if not isinstance(response, dict) else response.get(name)
+    if prompt_tokens := field('prompt_eval_count'):
+        LLM_PROMPT_TOKENS.inc(prompt_tokens, stage=stage)
+    if completion_tokens := field('eval_count'):
+        LLM_COMPLETION_TOKENS.inc(completion_tokens, stage=stage)
+    if prompt_eval := field('prompt_eval_duration'):
+        LLM_PROMPT_EVAL_SECONDS.observe(prompt_eval / 1e9, stage=stage) # Ollama отдает наносекунды
+    if eval_duration := field('eval_duration'):
+        LLM_EVAL_SECONDS.observe(eval_duration / 1e9, stage=stage)
+
+async def _handle_metrics_request(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b'\r\n', b'\n', b''):
+            pass # Заголовки запроса не нужны
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+            status, body = '200 OK', REGISTRY.render().encode('utf-8')
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            status, body, content_type = '404 Not Found', b'Not Found\n', 'text/plain'
+        writer.write(
+            f'HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n'
+            f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + body
+        )
+        await writer.drain()
+    except Exception as err:
+        logger.debug(f"Ошибка запроса метрик: {err}")
+    finally:
+        writer.close()
+
+async def start_metrics_server(host: str, port: int):
+    """Запускает HTTP-эндпоинт /metrics в текущем цикле событий"""
+    server = await asyncio.start_server(_handle_metrics_request, host, port)
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
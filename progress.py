@@ -0,0 +1,73 @@
+# Обновление сообщения о ходе обработки с учетом ограничений Telegram на редактирование
+import asyncio # Асинхронная обработка запросов
+import logging # Для записи логов работы программы
+import time # Монотонные часы для интервала между правками
+from telegram.error import RetryAfter # Ответ Telegram при превышении частоты запросов
+
+from config import TELEGRAM_EDIT_INTERVAL # Минимальный интервал между правками сообщения
+from metrics import STAGE_SECONDS, TELEGRAM_EDITS # Метрики правок сообщений
+
+logger = logging.getLogger(__name__) # Логгер для текущего модуля
+
+MAX_EDIT_LENGTH = 4000 # Немного меньше лимита Telegram на длину сообщения
+
+class ThrottledMessageUpdater:
+    """Правит одно сообщение не чаще min_interval, отправляя только последний текст"""
+
+    def __init__(self, bot, chat_id, message_id, min_interval=TELEGRAM_EDIT_INTERVAL):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.min_interval = min_interval
+        self._pending = None # Последний еще не отправленный текст
+        self._sent = None # Текст, который сейчас показан пользователю
+        self._next_edit = 0.0 # Момент, раньше которого править нельзя
+        self._task = None # Фоновая задача отправки
+        self.edits = 0 # Выполненные правки
+        self.coalesced = 0 # Промежуточные тексты, замененные более новыми
+
+    async def update(self, text: str):
+        """Запоминает новый текст; промежуточные тексты между правками схлопываются"""
+        if self._pending is not None:
+            self.coalesced += 1
+        self._pending = text[:MAX_EDIT_LENGTH]
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while self._pending is not None:
+            delay = self._next_edit - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            text, self._pending = self._pending, None
+            if text == self._sent: # Telegram отклоняет правку без изменений
+                continue
+            try:
+                with STAGE_SECONDS.time(stage='telegram_edit'):
+                    await self.bot.edit_message_text(chat_id=self.chat_id, message_id=self.message_id, text=text)
+                TELEGRAM_EDITS.inc(result='ok')
+                self._sent = text
+                self.edits += 1
+                self._next_edit = time.monotonic() + self.min_interval
+            except RetryAfter as e:
+                TELEGRAM_EDITS.inc(result='retry_after')
+                retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+                logger.warning(f"Ограничение частоты правок Telegram, пауза {retry_after} с")
+                self._next_edit = time.monotonic() + retry_after
+                if self._pending is None:
+                    self._pending = text # Повторим этот же текст после паузы
+            except Exception as e:
+                TELEGRAM_EDITS.inc(result='error')
+                logger.warning(f"Не удалось обновить сообщение: {e}") # Логирование ошибок при обновлении сообщения
+                self._next_edit = time.monotonic() + self.min_interval
+
+    async def close(self):
+        """Отменяет неотправленные правки (перед удалением сообщения)"""
+        self._pending = None
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        logger.debug(f"Правок сообщения: {self.edits}, схлопнуто обновлений: {self.coalesced}")
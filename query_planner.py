@@ -0,0 +1,103 @@
+# Короткие поисковые запросы для факта и объединение их результатов (reciprocal rank fusion)
+import re # Регулярные выражения
+from urllib.parse import urlparse # Нормализация URL
+
+from similarity_index import shingle_hashes # Шинглы для поиска почти одинаковых отрывков
+
+from config import (
+    SEARCH_QUERIES_PER_FACT,
+    SEARCH_QUERY_WORDS,
+    SEARCH_RRF_K,
+    SEARCH_MAX_RESULTS,
+    SEARCH_SNIPPET_SIMILARITY
+) # Параметры планирования запросов
+
+# Служебные слова, не помогающие поиску
+STOP_WORDS = frozenset('''
+а без более бы был была были было быть в во вот все всех где год года году да для до его ее если есть же за
+из или им их к как когда ко который которая которое которые кто ли либо менее на над не него нее нет ни но о
+об около он она они оно от по под после при про с со так также те то того только у уже чем что это этот эта
+эти этого я
+'''.split())
+MONTHS = frozenset(
+    'января февраля марта апреля мая июня июля августа сентября октября ноября декабря'.split()
+) # Месяцы в датах вида "5 мая"
+
+TOKEN_RE = re.compile(r'\w+(?:[.,:/-]\w+)*%?') # Слова и числа с разделителями (3,5%; 01.05.2024; COVID-19)
+QUOTED_RE = re.compile(r'[«"„“]([^«»"„“”]{3,80})[»"“”]') # Названия в кавычках
+
+def _take(words: list, limit: int) -> str:
+    """Слова без повторов (без учета регистра), не больше limit"""
+    seen, result = set(), []
+    for word in words:
+        if word.casefold() not in seen:
+            seen.add(word.casefold())
+            result.append(word)
+    return ' '.join(result[:limit])
+
+def _title_query(title: str, max_words: int) -> str:
+    """Название точной фразой; длинное - только первые max_words слов"""
+    words = TOKEN_RE.findall(title)
+    return f'"{" ".join(words[:max_words])}"' if len(words) > max_words else f'"{title.strip()}"'
+
+def plan_queries(fact: str, max_queries: int = SEARCH_QUERIES_PER_FACT, max_words: int = SEARCH_QUERY_WORDS) -> list:
+    """Запросы для факта: сам факт, если он короткий, иначе ключевые слова по порядку;
+    затем сущности, числа и даты (названия в кавычках - точной фразой)"""
+    tokens = TOKEN_RE.findall(fact)
+    keywords = [t for t in tokens if t.casefold() not in STOP_WORDS and (len(t) > 2 or t[0].isdigit())]
+    anchors = [
+        t for t in tokens
+        if any(c.isdigit() for c in t) or t.casefold() in MONTHS or (t[0].isupper() and t.casefold() not in STOP_WORDS)
+    ] # Имена, организации, числа и даты
+    titles = [_title_query(title, max_words) for title in QUOTED_RE.findall(fact)]
+
+    queries = [fact.strip() if len(tokens) <= max_words else _take(keywords, max_words)]
+    if titles:
+        title_words = {word.casefold() for word in TOKEN_RE.findall(titles[0])}
+        rest = [t for t in anchors if t.casefold() not in title_words]
+        queries.append(' '.join([titles[0], _take(rest, max(0, max_words - len(title_words)))]).strip())
+    else:
+        queries.append(_take(anchors, max_words))
+    queries.append(_take(keywords[max_words:] + anchors, max_words)) # Оставшиеся ключевые слова длинного факта
+
+    result, seen = [], set()
+    for query in queries:
+        key = ' '.join(sorted(query.casefold().split()))
+        if query and len(query.split()) > 1 and key not in seen: # Одно слово - слишком общий запрос
+            seen.add(key)
+            result.append(query)
+    return result[:max_queries] or [fact.strip()]
+
+def url_key(url: str) -> str:
+    """URL без схемы, www, фрагмента и завершающей косой черты: один документ из разных запросов"""
+    parsed = urlparse(url)
+    host = (parsed.hostname or '').lower()
+    host = host[4:] if host.startswith('www.') else host
+    query = f'?{parsed.query}' if parsed.query else ''
+    return f"{host}{parsed.path.rstrip('/')}{query}"
+
+def fuse_results(result_lists: list, k: int = SEARCH_RRF_K, limit: int = SEARCH_MAX_RESULTS) -> list:
+    """Reciprocal rank fusion по URL: документ получает сумму 1 / (k + место) по всем запросам.
+    Из повторов документа остается самый длинный отрывок"""
+    scores, docs = {}, {}
+    for results in result_lists:
+        for rank, doc in enumerate(results, 1):
+            key = url_key(doc['url'])
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            if key not in docs or len(doc['snippet']) > len(docs[key]['snippet']):
+                docs[key] = doc
+    ranked = sorted(scores, key=scores.get, reverse=True) # sorted устойчив: при равенстве - порядок появления
+    return dedupe_snippets([docs[key] for key in ranked])[:limit]
+
+def dedupe_snippets(results: list, threshold: float = SEARCH_SNIPPET_SIMILARITY) -> list:
+    """Убирает документы с почти тем же отрывком, что у документа выше (перепечатки одной заметки)"""
+    kept, kept_shingles = [], []
+    for doc in results:
+        shingles = shingle_hashes(doc['snippet'])
+        if doc['snippet'] and any(
+            len(shingles & other) / len(shingles | other) >= threshold for other in kept_shingles
+        ):
+            continue
+        kept.append(doc)
+        kept_shingles.append(shingles)
+    return kept
@@ -0,0 +1,99 @@
+# Квоты по фактическому расходу: запросы к Yandex и токены LLM пользователя, общая квота Yandex аккаунта
+import logging # Для записи логов работы программы
+
+from rate_limiter import create_rate_limiter # Учет расхода (GCRA) в памяти или в общем файле
+
+from config import (
+    BOT_MODE,
+    BROKER,
+    FLOOD_BACKEND,
+    QUOTA_PERIOD,
+    QUOTA_USER_SEARCHES,
+    QUOTA_USER_TOKENS,
+    QUOTA_GLOBAL_SEARCHES,
+    QUOTA_GLOBAL_PERIOD,
+    QUOTA_DEGRADED_SHARE,
+    QUOTA_ANALYSIS_TOKENS,
+    MAX_FACTS,
+    QUOTA_DEGRADED_FACTS,
+    SEARCH_QUERIES_PER_FACT
+) # Параметры квот
+
+logger = logging.getLogger(__name__) # Логгер для текущего модуля
+
+GLOBAL_KEY = 'yandex' # Ключ общей квоты аккаунта
+ANALYSIS_TOKENS = min(QUOTA_ANALYSIS_TOKENS, QUOTA_USER_TOKENS) # Токенов, без которых анализ не начинается
+FULL_PLAN = {'degraded': False, 'cached_only': False, 'max_facts': MAX_FACTS, 'reasons': []} # Без учета квот
+
+def check_quota_backend():
+    """Фронтенд и процессы-обработчики должны видеть один расход квот: хранилище в памяти
+    каждого процесса не видит списаний, сделанных в worker.py"""
+    if BOT_MODE == 'frontend' and BROKER == 'sqlite' and FLOOD_BACKEND == 'memory':
+        raise RuntimeError(
+            "BOT_MODE = 'frontend' с отдельными обработчиками требует FLOOD_BACKEND = 'sqlite': "
+            "иначе квоты пользователей не соблюдаются"
+        )
+
+class QuotaEngine:
+    """Списывает с пользователя фактически сделанные запросы к Yandex и токены Ollama после анализа,
+    а перед анализом выбирает режим: полный, сокращенный (меньше фактов, поиск только по кэшу) или отказ"""
+
+    def __init__(self):
+        self.user_searches = create_rate_limiter(QUOTA_USER_SEARCHES, QUOTA_PERIOD, 'quota_searches')
+        self.user_tokens = create_rate_limiter(QUOTA_USER_TOKENS, QUOTA_PERIOD, 'quota_tokens')
+        self.global_searches = create_rate_limiter(QUOTA_GLOBAL_SEARCHES, QUOTA_GLOBAL_PERIOD, 'quota_global')
+
+    async def plan(self, user_id, allow_refusal=True):
+        """Режим анализа {'degraded', 'cached_only', 'max_facts', 'reasons'} или None, если квоты токенов
+        не хватит даже на один анализ (QUOTA_ANALYSIS_TOKENS)
+        (allow_refusal=False - для уже принятого запроса: вместо отказа самая сокращенная проверка)"""
+        tokens_left = await self.user_tokens.remaining(user_id)
+        if tokens_left < ANALYSIS_TOKENS:
+            if allow_refusal:
+                return None
+            return {
+                'degraded': True, 'cached_only': True, 'max_facts': QUOTA_DEGRADED_FACTS,
+                'reasons': ["ваша квота обработки исчерпана"]
+            }
+        searches_left = await self.user_searches.remaining(user_id)
+        global_left = await self.global_searches.remaining(GLOBAL_KEY)
+
+        reasons = []
+        if global_left < QUOTA_GLOBAL_SEARCHES * QUOTA_DEGRADED_SHARE:
+            reasons.append("общая квота поиска почти исчерпана")
+        if searches_left < MAX_FACTS * SEARCH_QUERIES_PER_FACT: # Не хватит на полный поиск одного сообщения
+            reasons.append("ваша квота поиска почти исчерпана")
+        cached_only = bool(reasons) # Новые запросы к Yandex не делаются, используются только кэши
+        if tokens_left < QUOTA_USER_TOKENS * QUOTA_DEGRADED_SHARE:
+            reasons.append("ваша квота обработки почти исчерпана")
+        if reasons:
+            logger.info(f"Сокращенная проверка для {user_id}: {', '.join(reasons)}")
+        return {
+            'degraded': bool(reasons),
+            'cached_only': cached_only,
+            'max_facts': QUOTA_DEGRADED_FACTS if reasons else MAX_FACTS,
+            'reasons': reasons
+        }
+
+    async def retry_after(self, user_id) -> float:
+        """Через сколько секунд квоты токенов пользователю снова хватит на один анализ"""
+        return await self.user_tokens.retry_after(user_id, ANALYSIS_TOKENS)
+
+    async def charge(self, user_id, stats: dict):
+        """Списывает расход одного анализа (счетчики request_stats)"""
+        if stats.get('search_calls'):
+            await self.user_searches.charge(user_id, stats['search_calls'])
+        tokens = stats.get('prompt_tokens', 0) + stats.get('completion_tokens', 0)
+        if tokens:
+            await self.user_tokens.charge(user_id, tokens)
+
+    async def charge_search(self):
+        """Учитывает запрос к Yandex в общей квоте аккаунта"""
+        await self.global_searches.charge(GLOBAL_KEY, 1)
+
+    async def report_quota_exceeded(self):
+        """Ошибка 32: квота аккаунта исчерпана раньше, чем по нашему учету, - остаток обнуляется"""
+        await self.global_searches.charge(GLOBAL_KEY, QUOTA_GLOBAL_SEARCHES)
+
+# Глобальный экземпляр квот
+quota_engine = QuotaEngine()
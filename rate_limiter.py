@@ -0,0 +1,213 @@
+# Ограничение числа запросов пользователя (GCRA) с вытеснением неактивных пользователей
+import asyncio # Асинхронная обработка запросов
+import math # Округление числа оставшихся запросов
+import os # Работа с путями
+import sqlite3 # Общее состояние ограничителя для нескольких процессов бота
+import time # Монотонные часы
+from abc import ABC, abstractmethod # Интерфейс, который должны реализовать все ограничители
+
+from config import FLOOD_MAX_REQUESTS, FLOOD_PERIOD, FLOOD_BACKEND, FLOOD_PATH # Параметры ограничения
+
+class RateLimiter(ABC):
+    """Интерфейс ограничителя: limit единиц (запросов, токенов) за period секунд, не больше limit подряд.
+    GCRA: для пользователя хранится одно число - теоретическое время следующего запроса (tat)"""
+
+    __slots__ = ('limit', 'period')
+
+    def __init__(self, limit=FLOOD_MAX_REQUESTS, period=FLOOD_PERIOD):
+        self.limit = limit
+        self.period = period
+
+    def _decide(self, tat, now, cost=1, force=False):
+        """(разрешен ли запрос, новое tat, осталось единиц, через сколько секунд повторить);
+        force - учесть уже израсходованное без отказа: перерасход сохраняется целиком, и tat может уйти дальше
+        now + period (долг погашается следующими периодами)"""
+        interval = self.period / self.limit
+        new_tat = max(tat if tat is not None else now, now) + cost * interval
+        if not force and new_tat - now > self.period:
+            return False, tat, 0, new_tat - self.period - now
+        return True, new_tat, self._remaining(new_tat, now), 0.0
+
+    def _remaining(self, tat, now):
+        if tat is None or tat <= now:
+            return self.limit
+        return max(0, math.floor((self.period - (tat - now)) * self.limit / self.period + 1e-9))
+
+    def _retry_after(self, tat, now, cost=1):
+        if tat is None:
+            return 0.0
+        return max(0.0, tat + cost * self.period / self.limit - self.period - now)
+
+    @abstractmethod
+    async def acquire(self, user_id, cost=1):
+        """Учитывает запрос пользователя: (разрешен, осталось единиц, через сколько секунд повторить)"""
+
+    @abstractmethod
+    async def charge(self, user_id, cost):
+        """Списывает фактически израсходованные единицы без отказа (оплата по факту)"""
+
+    @abstractmethod
+    async def remaining(self, user_id) -> int:
+        """Число единиц, доступных пользователю сейчас"""
+
+    @abstractmethod
+    async def retry_after(self, user_id, cost=1) -> float:
+        """Через сколько секунд пользователю снова станут доступны cost единиц"""
+
+class InProcessRateLimiter(RateLimiter):
+    """Ограничитель в памяти процесса: O(1) на запрос, память - только пользователи последних двух периодов.
+    Пользователи хранятся в двух поколениях по period секунд; tat не позже последнего запроса + period,
+    поэтому к концу следующего поколения записи прошлого уже не ограничивают. Они разбираются по нескольку
+    за вызов: устаревшие удаляются, действующие переносятся в текущее поколение. Перерасход (charge) может
+    отодвинуть tat дальше; такие записи хранятся отдельно до погашения долга"""
+
+    __slots__ = ('clock', 'current', 'retired', 'debts', 'generation_end')
+
+    def __init__(self, limit=FLOOD_MAX_REQUESTS, period=FLOOD_PERIOD, clock=time.monotonic):
+        super().__init__(limit, period)
+        self.clock = clock
+        self.current = {} # {user_id: tat} пользователей с запросами в текущем поколении
+        self.retired = {} # Прошлое поколение, ожидающее удаления
+        self.debts = {} # {user_id: tat} пользователей с tat дальше конца следующего поколения
+        self.generation_end = clock() + period
+
+    def _rotate(self, now):
+        if now < self.generation_end:
+            for _ in range(2): # Постепенный разбор без пауз на освобождение большого словаря
+                if not self.retired:
+                    break
+                user_id, tat = self.retired.popitem()
+                if tat > now:
+                    self.current.setdefault(user_id, tat)
+            return
+        if now >= self.generation_end + self.period: # Запросов не было больше периода: все записи устарели
+            self.current.clear()
+        self.retired = self.current # Остаток прежнего прошлого поколения освобождается здесь
+        self.current = {}
+        self.generation_end = now + self.period
+        for user_id, tat in list(self.debts.items()): # Долги, погашаемые до конца нового поколения
+            if tat <= self.generation_end:
+                del self.debts[user_id]
+                if tat > now:
+                    self.current[user_id] = tat
+
+    def _tat(self, user_id):
+        tat = self.current.get(user_id)
+        if tat is None:
+            tat = self.retired.pop(user_id, None)
+        if tat is None:
+            tat = self.debts.pop(user_id, None)
+        return tat
+
+    def check(self, user_id, cost=1, force=False):
+        """Синхронная версия acquire (force=True - charge)"""
+        now = self.clock()
+        self._rotate(now)
+        allowed, tat, remaining, retry_after = self._decide(self._tat(user_id), now, cost, force)
+        if tat is not None and tat > now + self.period: # Перерасход дальше следующего поколения
+            self.current.pop(user_id, None)
+            self.debts[user_id] = tat
+        elif tat is not None and tat > now:
+            self.current[user_id] = tat
+        else:
+            self.current.pop(user_id, None)
+        return allowed, remaining, retry_after
+
+    def _peek(self, user_id):
+        tat = self.current.get(user_id)
+        if tat is None:
+            tat = self.retired.get(user_id)
+        if tat is None:
+            tat = self.debts.get(user_id)
+        return tat
+
+    async def acquire(self, user_id, cost=1):
+        return self.check(user_id, cost)
+
+    async def charge(self, user_id, cost):
+        self.check(user_id, cost, force=True)
+
+    async def remaining(self, user_id) -> int:
+        return self._remaining(self._peek(user_id), self.clock())
+
+    async def retry_after(self, user_id, cost=1) -> float:
+        return self._retry_after(self._peek(user_id), self.clock(), cost)
+
+    def __len__(self):
+        return len(self.current) + len(self.retired) + len(self.debts)
+
+class SQLiteRateLimiter(RateLimiter):
+    """Ограничитель с общим файлом для нескольких процессов бота (часы - системное время хоста)"""
+
+    __slots__ = ('db', 'table', 'calls', '_lock')
+
+    def __init__(self, path=FLOOD_PATH, limit=FLOOD_MAX_REQUESTS, period=FLOOD_PERIOD, table='flood'):
+        super().__init__(limit, period)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.table = table # Отдельная таблица для каждого ограничителя в общем файле
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL") # Чтение и запись из разных процессов без блокировок
+        self.db.execute(f"CREATE TABLE IF NOT EXISTS {table} (user_id TEXT PRIMARY KEY, tat REAL NOT NULL)")
+        self.db.execute(f"CREATE INDEX IF NOT EXISTS {table}_tat ON {table} (tat)")
+        self.calls = 0
+        self._lock = asyncio.Lock() # Одно обращение к соединению за раз
+
+    async def _run(self, function, *args):
+        async with self._lock:
+            return await asyncio.to_thread(function, *args)
+
+    def _tat(self, user_id):
+        row = self.db.execute(f"SELECT tat FROM {self.table} WHERE user_id = ?", (str(user_id),)).fetchone()
+        return row[0] if row else None
+
+    def _acquire(self, user_id, cost=1, force=False):
+        now = time.time()
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            allowed, tat, remaining, retry_after = self._decide(self._tat(user_id), now, cost, force)
+            if allowed:
+                self.db.execute(
+                    f"INSERT INTO {self.table} (user_id, tat) VALUES (?, ?) "
+                    "ON CONFLICT (user_id) DO UPDATE SET tat = excluded.tat",
+                    (str(user_id), tat)
+                )
+            self.calls += 1
+            if self.calls % 1000 == 0:
+                self.db.execute(f"DELETE FROM {self.table} WHERE tat < ?", (now,)) # Неактивные пользователи
+            self.db.execute("COMMIT")
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+        return allowed, remaining, retry_after
+
+    async def acquire(self, user_id, cost=1):
+        return await self._run(self._acquire, user_id, cost)
+
+    async def charge(self, user_id, cost):
+        await self._run(self._acquire, user_id, cost, True)
+
+    async def remaining(self, user_id) -> int:
+        tat = await self._run(self._tat, user_id)
+        return self._remaining(tat, time.time())
+
+    async def retry_after(self, user_id, cost=1) -> float:
+        tat = await self._run(self._tat, user_id)
+        return self._retry_after(tat, time.time(), cost)
+
+def create_rate_limiter(limit, period, name) -> RateLimiter:
+    """Ограничитель в хранилище config.FLOOD_BACKEND; name - имя таблицы в общем файле"""
+    if FLOOD_BACKEND == 'memory':
+        return InProcessRateLimiter(limit, period)
+    if FLOOD_BACKEND == 'sqlite':
+        return SQLiteRateLimiter(FLOOD_PATH, limit, period, table=name)
+    raise ValueError(f"Неизвестное хранилище ограничителя: {FLOOD_BACKEND}")
+
+_rate_limiter = None
+
+def get_rate_limiter() -> RateLimiter:
+    """Ограничитель сообщений пользователей (создается при первом обращении)"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = create_rate_limiter(FLOOD_MAX_REQUESTS, FLOOD_PERIOD, 'flood')
+    return _rate_limiter
@@ -0,0 +1,133 @@
+# Кэш готовых отчетов по содержимому текста с объединением одновременных запросов
+import asyncio # Асинхронная обработка запросов
+import hashlib # Хэш канонического текста
+import logging # Для записи логов работы программы
+import re # Регулярные выражения
+import time # Время жизни записей
+from collections import OrderedDict # Хранилище с вытеснением старых записей
+
+from config import REPORT_CACHE_TTL, REPORT_CACHE_SIZE # Параметры кэша отчетов
+
+logger = logging.getLogger(__name__) # Логгер для текущего модуля
+
+# Заголовки пересылки, которые клиенты добавляют при копировании сообщения
+FORWARD_HEADER = re.compile(
+    r'^\s*(?:forwarded from|переслано от|пересланное сообщение)[^\n]*\n',
+    re.IGNORECASE
+)
+
+def canonicalize_text(text: str) -> str:
+    """Приводит текст к канонической форме: без заголовка пересылки и лишних пробелов"""
+    text = FORWARD_HEADER.sub('', text.replace('\r\n', '\n'))
+    lines = [re.sub(r'[ \t ]+', ' ', line).strip() for line in text.split('\n')]
+    return '\n'.join(line for line in lines if line) # Пустые строки не влияют на ключ
+
+def text_key(text: str) -> str:
+    """Ключ кэша: SHA-256 канонического текста"""
+    return hashlib.sha256(canonicalize_text(text).encode('utf-8')).hexdigest()
+
+class AnalysisCancelled(Exception):
+    """Анализ, к которому присоединился запрос, был отменен у ведущего запроса"""
+
+class InFlight:
+    """Идущий анализ: результат для всех ожидающих и рассылка сообщений о ходе обработки"""
+
+    def __init__(self, update_status=None):
+        self.future = asyncio.get_running_loop().create_future()
+        self.listeners = [update_status] if update_status else [] # Функции обновления статуса ожидающих
+        self.last_status = None # Последнее сообщение, чтобы показать его присоединившемуся
+
+    async def update_status(self, text):
+        self.last_status = text
+        for listener in list(self.listeners):
+            try:
+                await listener(text)
+            except Exception as err:
+                logger.warning(f"Не удалось обновить статус ожидающего запроса: {err}")
+
+class ReportCache:
+    """Кэш результатов анализа с TTL и single-flight для одинаковых текстов"""
+
+    def __init__(self, ttl=REPORT_CACHE_TTL, max_size=REPORT_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict() # {ключ: (время записи, результат анализа)}
+        self.in_flight = {} # {ключ: InFlight выполняющегося анализа}
+        self.hits = 0
+        self.coalesced = 0 # Запросы, присоединившиеся к уже идущему анализу
+        self.misses = 0
+
+    def get(self, key: str):
+        """Возвращает сохраненный результат или None"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry[0] >= self.ttl:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def is_known(self, text: str) -> bool:
+        """Есть ли для текста готовый результат или уже идущий анализ"""
+        key = text_key(text)
+        return key in self.in_flight or self.get(key) is not None
+
+    def put(self, key: str, result: dict):
+        self.entries[key] = (time.time(), result)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    async def get_or_compute(self, text: str, compute, update_status=None):
+        """Возвращает кэшированный результат, ожидает идущий анализ или запускает compute(update_status).
+        Сообщения о ходе анализа получают все запросы, ожидающие его результата"""
+        key = text_key(text)
+        if (result := self.get(key)) is not None:
+            self.hits += 1
+            return result
+
+        if (flight := self.in_flight.get(key)) is not None: # Такой же текст уже анализируется
+            self.coalesced += 1
+            if update_status is None:
+                return await asyncio.shield(flight.future)
+            flight.listeners.append(update_status)
+            try:
+                if flight.last_status is not None:
+                    await update_status(flight.last_status)
+                return await asyncio.shield(flight.future) # Отмена ожидающего не отменяет общий анализ
+            finally:
+                flight.listeners.remove(update_status)
+
+        self.misses += 1
+        flight = InFlight(update_status)
+        self.in_flight[key] = flight
+        try:
+            result = await compute(flight.update_status)
+            if result.get('complete', True): # Неудачные анализы не кэшируются
+                self.put(key, result)
+            flight.future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            # Для ожидающих отмена ведущего запроса - обычная ошибка анализа
+            flight.future.set_exception(AnalysisCancelled("Анализ отменен"))
+            flight.future.exception() # Помечаем исключение как полученное, если ожидающих нет
+            raise
+        except Exception as err:
+            flight.future.set_exception(err)
+            flight.future.exception()
+            raise
+        finally:
+            del self.in_flight[key]
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'coalesced': self.coalesced,
+            'misses': self.misses,
+            'size': len(self.entries),
+            'in_flight': len(self.in_flight)
+        }
+
+# Глобальный экземпляр кэша отчетов
+report_cache = ReportCache()
@@ -0,0 +1,18 @@
+# Счетчики внешних вызовов в рамках обработки одного сообщения
+import contextvars # Контекст текущего анализа, наследуется задачами asyncio
+
+_current = contextvars.ContextVar('request_stats', default=None)
+
+def start() -> dict:
+    """Начинает подсчет для текущего анализа; задачи, созданные после вызова, пишут в тот же словарь"""
+    stats = {
+        'llm_calls': 0, 'search_calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'prompt_eval_seconds': 0.0
+    }
+    _current.set(stats)
+    return stats
+
+def count(name: str, amount: int = 1):
+    """Увеличивает счетчик текущего анализа, если подсчет запущен"""
+    stats = _current.get()
+    if stats is not None:
+        stats[name] = stats.get(name, 0) + amount
@@ -0,0 +1,139 @@
+# Ограниченная очередь заданий анализа с обслуживанием пользователей по кругу
+import asyncio # Асинхронная обработка запросов
+import logging # Для записи логов работы программы
+from collections import OrderedDict, deque # Очереди пользователей в порядке обхода
+
+from config import ANALYSIS_WORKERS, ANALYSIS_QUEUE_SIZE, ANALYSIS_QUEUE_PER_USER # Параметры очереди
+
+logger = logging.getLogger(__name__) # Логгер для текущего модуля
+
+class QueueFull(Exception):
+    """Очередь анализа заполнена (общий лимит или лимит пользователя)"""
+
+    def __init__(self, per_user: bool):
+        super().__init__("Очередь пользователя заполнена" if per_user else "Очередь анализа заполнена")
+        self.per_user = per_user
+
+class Job:
+    """Задание анализа в очереди"""
+    __slots__ = ('user_id', 'factory', 'future', 'on_position', 'known', 'position')
+
+    def __init__(self, user_id, factory, future, on_position, known=None):
+        self.user_id = user_id
+        self.factory = factory # Функция без аргументов, возвращающая корутину анализа
+        self.future = future
+        self.on_position = on_position # async-функция, получающая новую позицию в очереди
+        self.known = known # Функция: результат уже готов или вычисляется другим заданием
+        self.position = None
+
+class JobScheduler:
+    """Пул обработчиков, забирающих задания по кругу между пользователями, а не по порядку поступления"""
+
+    def __init__(self, workers=ANALYSIS_WORKERS, max_queue=ANALYSIS_QUEUE_SIZE, max_per_user=ANALYSIS_QUEUE_PER_USER):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self.queues = OrderedDict() # {user_id: deque заданий}; порядок ключей - порядок обхода
+        self.size = 0 # Заданий в очереди
+        self.running = 0 # Заданий в работе
+        self._available = asyncio.Semaphore(0) # Число заданий, которые можно забрать
+        self._tasks = []
+        self._background = set() # Уведомления о позициях и ожидание чужих анализов (ссылки до завершения)
+
+    def is_full(self, user_id=None) -> bool:
+        """Проверяет, примет ли очередь новое задание"""
+        if self.size >= self.max_queue:
+            return True
+        return user_id is not None and len(self.queues.get(user_id, ())) >= self.max_per_user
+
+    def submit(self, user_id, factory, on_position=None, known=None) -> asyncio.Future:
+        """Ставит задание в очередь; результат анализа придет в возвращаемый Future.
+        known() - результат уже готов или вычисляется: тогда задание не занимает обработчик"""
+        if self.size >= self.max_queue:
+            raise QueueFull(per_user=False)
+        if len(self.queues.get(user_id, ())) >= self.max_per_user:
+            raise QueueFull(per_user=True)
+        if not self._tasks:
+            self.start()
+
+        job = Job(user_id, factory, asyncio.get_running_loop().create_future(), on_position, known)
+        self.queues.setdefault(user_id, deque()).append(job)
+        self.size += 1
+        self._available.release()
+        self._notify_positions()
+        return job.future
+
+    def _pop(self) -> Job:
+        user_id, queue = next(iter(self.queues.items()))
+        job = queue.popleft()
+        del self.queues[user_id]
+        if queue:
+            self.queues[user_id] = queue # Пользователь с оставшимися заданиями уходит в конец круга
+        self.size -= 1
+        return job
+
+    def positions(self):
+        """Позиции ожидающих заданий с учетом обхода по кругу (1 - следующее)"""
+        lengths = [len(queue) for queue in self.queues.values()]
+        for user_index, queue in enumerate(self.queues.values()):
+            for round_index, job in enumerate(queue):
+                ahead = sum(
+                    min(length, round_index + 1 if other < user_index else round_index)
+                    for other, length in enumerate(lengths)
+                )
+                yield job, ahead + 1
+
+    def _notify_positions(self):
+        idle = self.workers - self.running # Столько заданий начнут выполняться сразу, без ожидания
+        for job, position in self.positions():
+            if job.position != position and job.on_position is not None and position > idle:
+                self._spawn(job.on_position(position))
+            job.position = position
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _run(self, job: Job):
+        try:
+            result = await job.factory()
+            if not job.future.done():
+                job.future.set_result(result)
+        except Exception as err:
+            if not job.future.done():
+                job.future.set_exception(err)
+
+    async def _worker(self):
+        while True:
+            await self._available.acquire()
+            job = self._pop()
+            if job.future.done(): # Ожидающий уже отказался от результата
+                continue
+            if job.known is not None and job.known(): # Тот же текст уже проанализирован или анализируется
+                self._spawn(self._run(job)) # Ожидание чужого анализа не занимает обработчик
+                self._notify_positions()
+                continue
+            self.running += 1
+            self._notify_positions()
+            try:
+                await self._run(job)
+            finally:
+                self.running -= 1
+
+    def start(self):
+        """Запускает обработчики в текущем цикле событий"""
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Очередь анализа: обработчиков {self.workers}, мест {self.max_queue}")
+
+    async def stop(self):
+        tasks = self._tasks + list(self._background)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+
+# Глобальный экземпляр очереди анализа
+analysis_scheduler = JobScheduler()
@@ -0,0 +1,132 @@
+# Кэш результатов поиска Yandex по нормализованному тексту факта
+import asyncio # Запись на диск вне цикла событий
+import json # Сериализация результатов для дискового уровня
+import logging # Для записи логов работы программы
+import os # Работа с путями
+import re # Регулярные выражения
+import sqlite3 # Дисковый уровень кэша, переживающий перезапуск
+import time # Время жизни записей
+from collections import OrderedDict # LRU-уровень в памяти
+
+from config import SEARCH_CACHE_TTL, SEARCH_CACHE_SIZE, SEARCH_CACHE_PATH # Параметры кэша
+
+logger = logging.getLogger(__name__) # Логгер для текущего модуля
+
+ERROR_DOCS_URL = 'https://yandex.cloud/ru/docs/search-api/reference/error-codes' # Ссылка из handle_api_error
+ERROR_TITLES = {'Ошибка системы', 'Поиск отложен'} # Заголовки служебных ответов об ошибках и пропуске поиска
+
+def normalize_fact(text: str) -> str:
+    """Приводит факт к ключу кэша: регистр, пунктуация и пробелы схлопываются"""
+    text = re.sub(r'[^\w\s]', ' ', text.casefold()) # Пунктуация -> пробел
+    return re.sub(r'\s+', ' ', text.replace('_', ' ')).strip() # Схлопывание пробелов
+
+def is_error_result(results: list) -> bool:
+    """Проверяет, является ли результат служебным ответом об ошибке"""
+    return any(
+        src.get('url') == ERROR_DOCS_URL or src.get('title') in ERROR_TITLES
+        for src in results
+    )
+
+class SearchCache:
+    """Двухуровневый кэш (LRU в памяти + SQLite) с временем жизни записей"""
+
+    def __init__(self, path=SEARCH_CACHE_PATH, ttl=SEARCH_CACHE_TTL, max_size=SEARCH_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.memory = OrderedDict() # {ключ: (время записи, результаты)}
+        self.hits = 0 # Попадания в память
+        self.disk_hits = 0 # Попадания на диск
+        self.misses = 0 # Промахи
+        self.db = None
+        self.writer = None # Отдельное соединение для записи в потоке, чтобы не блокировать цикл событий
+        self._write_lock = asyncio.Lock() # Одна запись за раз
+        self._read_lock = asyncio.Lock() # Одно чтение за раз через соединение db
+        if path:
+            if not os.path.isabs(path): # Относительный путь считается от каталога бота, а не от текущего
+                path = os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+            try:
+                if os.path.dirname(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                self.db = sqlite3.connect(path, check_same_thread=False)
+                self.db.execute("PRAGMA journal_mode=WAL") # Чтение не ждет записи из потока
+                self.db.execute(
+                    "CREATE TABLE IF NOT EXISTS search_cache "
+                    "(key TEXT PRIMARY KEY, created REAL NOT NULL, results TEXT NOT NULL)"
+                )
+                self.db.commit()
+                self.writer = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            except sqlite3.Error as err:
+                logger.error(f"Дисковый кэш поиска недоступен: {err}") # Работаем только в памяти
+                self.db = self.writer = None
+
+    def _remember(self, key, created, results):
+        self.memory[key] = (created, results)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_size:
+            self.memory.popitem(last=False) # Вытеснение самой старой по использованию записи
+
+    def _read(self, key):
+        return self.db.execute("SELECT created, results FROM search_cache WHERE key = ?", (key,)).fetchone()
+
+    async def get(self, fact: str):
+        """Возвращает результаты поиска из кэша или None (чтение с диска - в отдельном потоке)"""
+        key = normalize_fact(fact)
+        now = time.time()
+
+        entry = self.memory.get(key)
+        if entry and now - entry[0] < self.ttl:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        self.memory.pop(key, None)
+
+        if self.db is not None:
+            try:
+                async with self._read_lock:
+                    row = await asyncio.to_thread(self._read, key)
+                if row and now - row[0] < self.ttl:
+                    results = json.loads(row[1])
+                    self._remember(key, row[0], results)
+                    self.disk_hits += 1
+                    return results
+            except (sqlite3.Error, json.JSONDecodeError) as err:
+                logger.warning(f"Ошибка чтения кэша поиска: {err}")
+
+        self.misses += 1
+        return None
+
+    def _write(self, key, now, results):
+        try:
+            self.writer.execute(
+                "INSERT OR REPLACE INTO search_cache (key, created, results) VALUES (?, ?, ?)",
+                (key, now, json.dumps(results, ensure_ascii=False))
+            )
+            self.writer.execute("DELETE FROM search_cache WHERE created < ?", (now - self.ttl,)) # Очистка устаревших
+            self.writer.commit()
+        except sqlite3.Error as err:
+            logger.warning(f"Ошибка записи кэша поиска: {err}")
+
+    async def put(self, fact: str, results: list):
+        """Сохраняет результаты поиска, пропуская ответы об ошибках (запись на диск - в отдельном потоке)"""
+        if not results or is_error_result(results):
+            return
+        key = normalize_fact(fact)
+        now = time.time()
+        self._remember(key, now, results) # Память обновляется сразу: следующий get уже попадет в кэш
+        if self.writer is not None:
+            async with self._write_lock:
+                await asyncio.to_thread(self._write, key, now, results)
+
+    def stats(self) -> dict:
+        """Счетчики попаданий и промахов"""
+        total = self.hits + self.disk_hits + self.misses
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.disk_hits) / total if total else 0.0,
+            'size': len(self.memory)
+        }
+
+# Глобальный экземпляр кэша поиска
+search_cache = SearchCache()
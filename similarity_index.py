@@ -0,0 +1,138 @@
+# Индекс похожих новостей (MinHash + LSH) для повторного использования результатов анализа
+import logging # Для записи логов работы программы
+import random # Генерация масок перестановок
+import re # Регулярные выражения
+import time # Возраст записей
+from array import array # Компактное хранение сигнатур
+
+from config import (
+    SIMILARITY_INDEX_SIZE,
+    SIMILARITY_INDEX_MAX_AGE,
+    SIMILARITY_PARTIAL_THRESHOLD
+) # Параметры индекса
+
+logger = logging.getLogger(__name__) # Логгер для текущего модуля
+
+SHINGLE_SIZE = 3 # Слов в одном шингле
+HASH_MASK = 0xFFFFFFFF # Значения сигнатуры хранятся как 32-битные числа
+
+def shingle_hashes(text: str) -> set:
+    """Множество хэшей словесных шинглов текста"""
+    words = re.findall(r'\w+', text.casefold())
+    if len(words) < SHINGLE_SIZE:
+        return {hash(' '.join(words)) & HASH_MASK}
+    return {
+        hash(' '.join(words[i:i + SHINGLE_SIZE])) & HASH_MASK # hash() стабилен в пределах процесса
+        for i in range(len(words) - SHINGLE_SIZE + 1)
+    }
+
+class SimilarityIndex:
+    """MinHash-сигнатуры в кольцевом буфере array и LSH-корзины по полосам"""
+
+    def __init__(self, capacity=SIMILARITY_INDEX_SIZE, max_age=SIMILARITY_INDEX_MAX_AGE,
+                 num_perm=64, bands=16, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm должно делиться на bands")
+        self.capacity = capacity
+        self.max_age = max_age
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = random.Random(seed)
+        self.masks = [rng.getrandbits(32) for _ in range(num_perm)] # XOR-маски вместо перестановок
+        self.signatures = array('I', bytes(4 * capacity * num_perm)) # Сигнатуры подряд, по num_perm на слот
+        self.created = array('d', bytes(8 * capacity)) # Время добавления каждого слота
+        self.payloads = [None] * capacity # Результаты анализа
+        self.buckets = [{} for _ in range(bands)] # {хэш полосы: слот или список слотов}
+        self.next_slot = 0 # Следующий слот для записи (кольцо)
+        self.count = 0 # Занятые слоты
+
+    def signature(self, text: str) -> array:
+        """MinHash-сигнатура текста"""
+        hashes = shingle_hashes(text)
+        return array('I', [min(map(mask.__xor__, hashes)) for mask in self.masks])
+
+    def _band_keys(self, sig):
+        rows = self.rows
+        return [hash(sig[b * rows:(b + 1) * rows].tobytes()) for b in range(self.bands)]
+
+    def _slot_signature(self, slot):
+        start = slot * self.num_perm
+        return self.signatures[start:start + self.num_perm]
+
+    def _evict(self, slot):
+        """Удаляет слот из LSH-корзин"""
+        for band, key in enumerate(self._band_keys(self._slot_signature(slot))):
+            bucket = self.buckets[band].get(key)
+            if bucket == slot:
+                del self.buckets[band][key]
+            elif isinstance(bucket, list):
+                bucket.remove(slot)
+                if len(bucket) == 1:
+                    self.buckets[band][key] = bucket[0] # Одиночные корзины храним без списка
+        self.payloads[slot] = None
+        self.count -= 1
+
+    def _evict_expired(self, now):
+        """Удаляет записи старше max_age, начиная с самой старой"""
+        while self.count:
+            oldest = (self.next_slot - self.count) % self.capacity
+            if now - self.created[oldest] < self.max_age:
+                break
+            self._evict(oldest)
+
+    def add(self, text: str, payload):
+        """Добавляет текст и связанный с ним результат анализа"""
+        now = time.time()
+        self._evict_expired(now)
+        slot = self.next_slot
+        if self.payloads[slot] is not None: # Кольцо заполнено: вытесняем самую старую запись
+            self._evict(slot)
+
+        sig = self.signature(text)
+        self.signatures[slot * self.num_perm:(slot + 1) * self.num_perm] = sig
+        self.created[slot] = now
+        self.payloads[slot] = payload
+        for band, key in enumerate(self._band_keys(sig)):
+            bucket = self.buckets[band].get(key)
+            if bucket is None:
+                self.buckets[band][key] = slot
+            elif isinstance(bucket, list):
+                bucket.append(slot)
+            else:
+                self.buckets[band][key] = [bucket, slot]
+        self.next_slot = (slot + 1) % self.capacity
+        self.count += 1
+
+    def query(self, text: str, threshold: float = SIMILARITY_PARTIAL_THRESHOLD, accept=None):
+        """Возвращает (оценка сходства, результат) самого похожего текста не ниже порога или None;
+        accept(результат) - дополнительное условие для кандидата"""
+        if not self.count:
+            return None
+        now = time.time()
+        sig = self.signature(text)
+        candidates = set()
+        for band, key in enumerate(self._band_keys(sig)):
+            bucket = self.buckets[band].get(key)
+            if isinstance(bucket, list):
+                candidates.update(bucket)
+            elif bucket is not None:
+                candidates.add(bucket)
+
+        best = None
+        for slot in candidates:
+            if now - self.created[slot] >= self.max_age:
+                continue
+            stored = self._slot_signature(slot)
+            similarity = sum(a == b for a, b in zip(sig, stored)) / self.num_perm # Оценка сходства Жаккара
+            if similarity >= threshold and (best is None or similarity > best[0]) and (
+                accept is None or accept(self.payloads[slot])
+            ):
+                best = (similarity, self.payloads[slot])
+        return best
+
+    def __len__(self):
+        return self.count
+
+# Глобальный экземпляр индекса
+similarity_index = SimilarityIndex()
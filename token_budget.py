@@ -0,0 +1,74 @@
+# Оценка размера промптов, выбор размера контекста и сжатие данных под бюджет токенов
+import json # Работа с JSON-данными
+import logging # Для записи логов работы программы
+
+from config import LLM_CTX_BUCKETS, LLM_CHARS_PER_TOKEN, LLM_OUTPUT_RESERVE # Параметры бюджета токенов
+
+logger = logging.getLogger(__name__) # Логгер для текущего модуля
+
+CTX_BUCKETS = tuple(sorted(LLM_CTX_BUCKETS))
+MAX_CTX = CTX_BUCKETS[-1]
+
+def estimate_tokens(text: str) -> int:
+    """Оценка числа токенов по длине текста (калибровка LLM_CHARS_PER_TOKEN - с запасом для JSON и URL)"""
+    return int(len(text) / LLM_CHARS_PER_TOKEN) + 1
+
+def pick_num_ctx(prompt_tokens: int, loaded: int = None, loaded_needed: bool = False,
+                 reserve: int = LLM_OUTPUT_RESERVE) -> int:
+    """Наименьший подходящий размер контекста. Уже загруженный больший размер сохраняется, только если
+    он недавно понадобился промпту (loaded_needed): тогда переход на меньший вызвал бы две перезагрузки модели
+    (смена num_ctx перезагружает ее и теряет кэш префиксов). Иначе - одна перезагрузка на меньший размер"""
+    needed = prompt_tokens + reserve
+    bucket = next((size for size in CTX_BUCKETS if size >= needed), MAX_CTX)
+    if loaded and loaded > bucket and loaded_needed:
+        return loaded
+    return bucket
+
+def _sources_size(evidence) -> int:
+    return estimate_tokens(json.dumps(evidence, ensure_ascii=False))
+
+def compact_fact_results(fact_results: dict, max_tokens: int, measure=None) -> dict:
+    """Сжимает источники фактов до бюджета: сначала убирает повторы, затем сокращает и удаляет отрывки,
+    затем оставляет первые источники. Индексы оставшихся источников внутри факта не меняются.
+    measure(results) - размер в токенах в том виде, в каком данные попадут в промпт"""
+    measure = measure or _sources_size
+    def repeats_without_snippets(results):
+        seen, compacted = set(), {}
+        for fact, sources in results.items():
+            compacted[fact] = []
+            for src in sources:
+                url = src.get('url')
+                if url and url in seen: # Источник уже приведен для другого факта: отрывок не повторяем
+                    src = {key: value for key, value in src.items() if key != 'snippet'}
+                seen.add(url)
+                compacted[fact].append(src)
+        return compacted
+
+    def short_snippets(length):
+        def step(results):
+            return {fact: [dict(src, snippet=src['snippet'][:length]) if src.get('snippet') else src
+                           for src in sources] for fact, sources in results.items()}
+        return step
+
+    def no_snippets(results):
+        return {fact: [{key: value for key, value in src.items() if key != 'snippet'} for src in sources]
+                for fact, sources in results.items()}
+
+    def top_sources(count):
+        def step(results):
+            return {fact: sources[:count] for fact, sources in results.items()}
+        return step
+
+    results = fact_results
+    size = measure(results)
+    if size <= max_tokens:
+        return results
+    for step in (repeats_without_snippets, short_snippets(200), no_snippets, top_sources(5), top_sources(3)):
+        results = step(results)
+        if measure(results) <= max_tokens:
+            break
+    compacted_size = measure(results)
+    logger.info(f"Источники сжаты под бюджет {max_tokens} токенов: ~{size} -> ~{compacted_size}")
+    if compacted_size > max_tokens:
+        logger.warning(f"Источники не уложились в бюджет {max_tokens} токенов даже после сжатия")
+    return results
@@ -0,0 +1,59 @@
+# Процесс-обработчик: забирает задания анализа из брокера и отправляет отчеты в Telegram
+import argparse # Параметры запуска
+import asyncio # Асинхронная обработка запросов
+import logging # Для записи логов работы программы
+import os # Переменные окружения
+import signal # Остановка по SIGTERM/SIGINT с ожиданием начатых заданий
+import socket # Имя хоста для идентификатора обработчика
+
+logger = logging.getLogger(__name__) # Логгер для текущего модуля
+
+def main():
+    parser = argparse.ArgumentParser(description="Обработчик заданий анализа для BOT_MODE = 'frontend'")
+    parser.add_argument('--ollama-host', help="Сервер Ollama этого обработчика (по умолчанию OLLAMA_HOST)")
+    parser.add_argument('--concurrency', type=int, help="Одновременных анализов (по умолчанию WORKER_CONCURRENCY)")
+    parser.add_argument('--metrics-port', type=int, default=0, help="Порт эндпоинта /metrics обработчика (0 - отключить)")
+    parser.add_argument('--worker-id', default=f"{socket.gethostname()}-{os.getpid()}", help="Имя обработчика в брокере")
+    args = parser.parse_args()
+
+    if args.ollama_host:
+        os.environ['OLLAMA_HOST'] = args.ollama_host # Клиенты Ollama читают адрес при создании
+        import config # Пул серверов обработчика - только его сервер
+        config.OLLAMA_HOSTS = [args.ollama_host]
+
+    import factcheckbot_yac as bot_module # Импорт после выбора сервера Ollama
+    bot_module.check_quota_backend() # Списания обработчика должен видеть фронтенд
+    from telegram import Bot # Отправка отчетов через Bot API
+    from broker import get_broker # Брокер заданий
+    from metrics import start_metrics_server # Эндпоинт /metrics
+    from config import TELEGRAM_TOKEN, METRICS_HOST, WORKER_CONCURRENCY, DRAIN_TIMEOUT # Параметры обработчика
+
+    async def run():
+        stopping = asyncio.Event() # SIGTERM/SIGINT: новые задания не берутся, начатые доделываются
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stopping.set)
+        if args.metrics_port:
+            await start_metrics_server(METRICS_HOST, args.metrics_port)
+        await bot_module.warm_up_models() # Задания берутся только после загрузки моделей
+        async with Bot(TELEGRAM_TOKEN) as bot:
+            serving = asyncio.create_task(bot_module.serve_jobs(
+                bot, get_broker(), args.worker_id, args.concurrency or WORKER_CONCURRENCY, stopping=stopping
+            ))
+            stop_requested = asyncio.create_task(stopping.wait())
+            await asyncio.wait({serving, stop_requested}, return_when=asyncio.FIRST_COMPLETED)
+            stop_requested.cancel()
+            if not serving.done():
+                logger.info(f"Остановка: ожидаем начатые задания, не дольше {DRAIN_TIMEOUT} с")
+                _, not_finished = await asyncio.wait({serving}, timeout=DRAIN_TIMEOUT)
+                if not_finished:
+                    logger.warning("Задания прерваны по таймауту, брокер выдаст их снова после истечения аренды")
+                    serving.cancel()
+                    await asyncio.gather(serving, return_exceptions=True)
+                    return
+            await serving # Ошибка цикла обработчика не скрывается
+
+    asyncio.run(run())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+# Асинхронный клиент Yandex Search API с пулом соединений и адаптивным ограничением RPS
+import asyncio # Асинхронная обработка запросов
+import logging # Для записи логов работы программы
+import time # Монотонные часы для ограничителя
+import httpx # Асинхронные HTTP-запросы с keep-alive и HTTP/2
+
+import request_stats # Счетчики вызовов в рамках одного сообщения
+from metrics import YANDEX_REQUESTS, YANDEX_ERRORS # Метрики запросов к API
+
+from config import (
+    YANDEX_API_KEY,
+    YANDEX_FOLDER_ID,
+    YANDEX_SEARCH_URL,
+    YANDEX_RPS,
+    YANDEX_QUOTA_COOLDOWN
+) # Параметры доступа и квоты Yandex Search API
+
+logger = logging.getLogger(__name__) # Логгер для текущего модуля
+
+try:
+    import h2 # noqa: F401 Поддержка HTTP/2 (httpx[http2])
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+class TokenBucket:
+    """Ограничитель запросов «корзина токенов» с адаптацией к ошибкам API"""
+
+    def __init__(self, rate: float, capacity: float = None, min_rate: float = 0.2):
+        self.max_rate = rate # Номинальная квота аккаунта (запросов в секунду)
+        self.rate = rate # Текущая скорость с учетом штрафов
+        self.min_rate = min_rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0 # Пауза после ошибок квоты
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Ждет свободный токен"""
+        async with self._lock: # Очередь ожидающих обслуживается по порядку
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def penalize(self, code: str, cooldown: float = YANDEX_QUOTA_COOLDOWN):
+        """Снижает скорость после ошибки 55 (RPS) или приостанавливает запросы после 32 (квота)"""
+        now = time.monotonic()
+        if code == '55':
+            self.rate = max(self.min_rate, self.rate / 2) # Мультипликативное снижение
+            self.tokens = 0
+            self.blocked_until = max(self.blocked_until, now + 1 / self.rate)
+        elif code == '32':
+            self.tokens = 0
+            self.blocked_until = max(self.blocked_until, now + cooldown)
+        logger.warning(f"Ограничитель Yandex: код {code}, скорость {self.rate:.2f} RPS") # Логирование адаптации
+
+    def reward(self):
+        """Плавно возвращает скорость к номинальной после успешного запроса"""
+        if self.rate < self.max_rate:
+            self._refill(time.monotonic())
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.1) # Аддитивное восстановление
+
+class YandexSearchClient:
+    """Пул соединений к Yandex Search API, общий для всех запросов"""
+
+    def __init__(self, url=YANDEX_SEARCH_URL, rps=YANDEX_RPS, timeout=15):
+        self.url = url
+        self.timeout = timeout
+        self.limiter = TokenBucket(rps)
+        self._client = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None: # Создаем клиент в работающем цикле событий
+            self._client = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=10, max_keepalive_connections=10, keepalive_expiry=60),
+                params={
+                    'folderid': YANDEX_FOLDER_ID, # Идентификатор каталога
+                    'apikey': YANDEX_API_KEY,     # API-ключ сервисного аккаунта
+                    'type': 'xml'                 # Формат ответа
+                },
+                headers={
+                    'Content-Type': 'application/xml',
+                    'Accept': 'application/xml'
+                }
+            )
+        return self._client
+
+    async def search(self, request_xml: str) -> bytes:
+        """Отправляет XML-запрос с учетом ограничения RPS и возвращает тело ответа"""
+        await self.limiter.acquire()
+        request_stats.count('search_calls')
+        YANDEX_REQUESTS.inc()
+        response = await self._get_client().post(self.url, content=request_xml.encode('utf-8'))
+        response.raise_for_status() # Проверка на ошибки HTTP
+        return response.content
+
+    def report(self, error_code: str = None):
+        """Передает ограничителю результат запроса (код ошибки API или None)"""
+        if error_code is not None:
+            YANDEX_ERRORS.inc(code=error_code)
+        if error_code in ('55', '32'):
+            self.limiter.penalize(error_code)
+        elif error_code is None:
+            self.limiter.reward()
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+# Глобальный экземпляр клиента
+yandex_client = YandexSearchClient()
@@ -0,0 +1,44 @@
+# Потоковый разбор XML-ответов Yandex Search API без построения полного дерева
+import io # Поток байтов ответа для iterparse
+from lxml import etree # Потоковый XML-парсер
+
+MAX_PASSAGES = 3 # Отрывков на документ (как maxpassages в запросе)
+
+def _text(elem) -> str:
+    """Весь текст элемента вместе с вложенными <hlword>"""
+    return ''.join(elem.itertext()) if elem is not None else ''
+
+def _discard(elem):
+    """Освобождает разобранное поддерево и уже пройденные соседние элементы его предков"""
+    elem.clear(keep_tail=False)
+    node = elem
+    while node is not None:
+        parent = node.getparent()
+        while node.getprevious() is not None:
+            del parent[0]
+        node = parent
+
+def parse_search_response(body: bytes):
+    """Разбор ответа: (ошибка {'code', 'text'} или None, документы [{'url', 'title', 'passages'}]).
+    Читаются только error, doc/url, doc/title и passage; title - None, если заголовка нет"""
+    error, docs = None, []
+    events = etree.iterparse(
+        io.BytesIO(body), events=('end',), tag=('error', 'doc'),
+        recover=True, resolve_entities=False, no_network=True
+    ) # recover - как у BeautifulSoup, битый ответ разбирается до первой ошибки
+    try:
+        for _, elem in events:
+            if elem.tag == 'error':
+                if error is None:
+                    error = {'code': elem.get('code', 'unknown'), 'text': _text(elem)}
+            else:
+                title = elem.find('title')
+                docs.append({
+                    'url': _text(elem.find('url')).strip(),
+                    'title': _text(title).strip() if title is not None else None,
+                    'passages': [_text(p) for p in elem.iter('passage')][:MAX_PASSAGES]
+                })
+            _discard(elem)
+    except etree.XMLSyntaxError:
+        pass # Пустой или обрезанный ответ: возвращаем то, что успели разобрать
+    return error, docs